@@ -1,54 +1,508 @@
 import argparse
+import cProfile
+import glob
+from contextlib import ExitStack
+from dataclasses import astuple, fields
+import json
+import os
+import sys
 from os import makedirs
 
 import gc
 
+import numpy as np
+
 from dataclass_csv import DataclassWriter
 
 from wildfrag.util import *
 from wildfrag.wildfrag import WildFrag
+from wildfrag.extract import compile_extract, default_extract_path
+from wildfrag.volume_filter import VolumeFilter
+from wildfrag.file_sample import FileSample
 from metrics.disk_allocations import *
 from metrics.free_space_extents import *
 from metrics.internal_fragmentation import *
 from metrics.out_of_orderness import *
 from metrics.percentage_stats import *
+from metrics.sample_ratios import CONFIDENCE, FRAGMENTED_FRACTION, \
+    RATIO_METRICS
+from metrics.quantiles import make_sketches, merge_sketches, \
+    quantile_header, quantile_row
 from graphs.disk_allocation_chart import *
 from graphs.histogram import *
+from volume_report import *
+from result_store import ResultStore, default_result_store_path
+from parallel import map_each_volume_in_databases
+from prefetch import DEFAULT_PREFETCH_MEMORY
+from progress import report_progress
+import profiling
+from profiling import Profiler
 
 
 VolumeTriplet = namedtuple("VolumeTriplet", ["system", "device", "volume"])
 
 MODE_STATISTICS = "statistics"
 MODE_CSV = "csv"
+MODE_COMPILE = "compile"
+MODE_FREE_SPACE = "freespace"
 # Secret mode for getting a list of all file sizes in a database. This is useful
 # for deriving filesize distributions, which several artificial aging tools take
 # as an argument.
 MODE_FILE_SIZES = "filesizes"
+# The formats that MODE_FILE_SIZES can write.
+FILE_SIZES_CSV = "csv"
+FILE_SIZES_INT64 = "int64"  # Raw little-endian int64s, without a header
+FILE_SIZES_NPY = "npy"
 
 parser = argparse.ArgumentParser()
 args = None
 is_measuring_filetype_stats = True
+# The name of each opened database in the output, by `WildFrag.db_path`
+database_names = {}
+# The path that was given on the commandline for each opened database, by
+# `WildFrag.db_path`. These only differ when --index-copy is used.
+database_files = {}
 
 
 def parse_args():
     parser.add_argument('mode',
                         help='Determines the mode of operation. ' +
-                             f'"{MODE_STATISTICS}" to print statistics' +
-                             f'"{MODE_CSV}" to generate CSV files',
+                             f'"{MODE_STATISTICS}" to print statistics, ' +
+                             f'"{MODE_CSV}" to generate CSV files, ' +
+                             f'"{MODE_COMPILE}" to convert the database ' +
+                             'into an extract that later runs read instead ' +
+                             'of the Files table, ' +
+                             f'"{MODE_FREE_SPACE}" to generate a CSV file ' +
+                             'of free space extents',
                         type=str)
-    parser.add_argument('dbfile',
-                        help='The path to the database file ' +
-                             'generated by PriFiwalk.')
+    parser.add_argument('dbfiles',
+                        help='The paths to the database files generated by ' +
+                             'PriFiwalk. Patterns like "sites/*.db" are ' +
+                             'expanded, even if the shell doesn\'t. The ' +
+                             'volumes of all databases are processed ' +
+                             'together and their results are merged, with ' +
+                             'a "database" column and ids that are ' +
+                             'prefixed with the name of the database.',
+                        nargs='+')
     parser.add_argument('--filestats',
                         help='Enables saving filetype statistics. ' +
                              'This is not supported by all modes of operation.',
                         dest='filestats',
                         action='store_true',
                         default=False)
-    return parser.parse_args()
-
-
-
+    parser.add_argument('--top-extensions',
+                        help='Only keeps the filetype statistics of this ' +
+                             'many extensions with the most files in each ' +
+                             'volume. The files of all other extensions are ' +
+                             f'counted under "{OTHER_EXTENSIONS}". ' +
+                             'Only used with --filestats.',
+                        dest='top_extensions',
+                        type=int,
+                        default=None)
+    parser.add_argument('--extract',
+                        help='Where the extract of the database is stored. ' +
+                             'Defaults to "<dbfile>.extract". The extract ' +
+                             'is only used if the database has not changed ' +
+                             'since it was compiled.',
+                        dest='extract',
+                        default=None)
+    parser.add_argument('--jobs',
+                        help='The amount of processes used to derive the ' +
+                             'statistics of volumes. Each process handles ' +
+                             'one volume at a time. ' +
+                             f'Only used by "{MODE_STATISTICS}", ' +
+                             f'"{MODE_CSV}" and "{MODE_FREE_SPACE}".',
+                        dest='jobs',
+                        type=int,
+                        default=1)
+    parser.add_argument('--prefetch-memory',
+                        help='With a single job, the files of the next ' +
+                             'volumes are loaded on a separate thread while ' +
+                             'the current volume is measured. This is how ' +
+                             'many megabytes of loaded volumes may be ' +
+                             'waiting. 0 disables prefetching. ' +
+                             f'Only used by "{MODE_STATISTICS}" and ' +
+                             f'"{MODE_CSV}".',
+                        dest='prefetch_memory',
+                        type=int,
+                        default=DEFAULT_PREFETCH_MEMORY // 1_000_000)
+    parser.add_argument('--pushdown',
+                        help='Aggregates most statistics inside of SQLite ' +
+                             'instead of retrieving every file. This is ' +
+                             'a lot faster, but it can\'t be combined with ' +
+                             '--filestats.',
+                        dest='pushdown',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--store',
+                        help='Keeps the results of each volume in a result ' +
+                             'store, so that volumes that were already ' +
+                             'measured are skipped by later runs, unless ' +
+                             'their files have changed. Defaults to ' +
+                             '"<dbfile>.results" if no path is given. ' +
+                             f'Only used by "{MODE_CSV}".',
+                        dest='store',
+                        nargs='?',
+                        const="",
+                        default=None)
+    parser.add_argument('--filesizes-format',
+                        help=f'The format of the "{MODE_FILE_SIZES}" mode. ' +
+                             f'"{FILE_SIZES_CSV}" for a CSV file, ' +
+                             f'"{FILE_SIZES_INT64}" for a file of raw ' +
+                             'little-endian 64-bit integers, ' +
+                             f'"{FILE_SIZES_NPY}" for a NumPy array file ' +
+                             'that can be memory-mapped.',
+                        dest='filesizes_format',
+                        choices=[FILE_SIZES_CSV, FILE_SIZES_INT64,
+                                 FILE_SIZES_NPY],
+                        default=FILE_SIZES_CSV)
+    parser.add_argument('--db-diagnostics',
+                        help='Prints how SQLite looks up the rows that ' +
+                             'belong to each system, device and volume, ' +
+                             'and which of those lookups scan a whole table ' +
+                             'because an index is missing.',
+                        dest='db_diagnostics',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--index-copy',
+                        help='Copies the database to this path, adds the ' +
+                             'missing indexes to the copy and reads the ' +
+                             'copy instead. The copy is reused until the ' +
+                             'database changes.',
+                        dest='index_copy',
+                        default=None)
+    parser.add_argument('--profile',
+                        help='Measures how much time is spent fetching ' +
+                             'rows from SQLite, building files, parsing ' +
+                             'blocks, computing metrics and writing output, ' +
+                             'and records the rows, timings and peak memory ' +
+                             'usage of each volume. The results are written ' +
+                             'to the given path as JSON, or printed to ' +
+                             'stderr if no path is given.',
+                        dest='profile',
+                        nargs='?',
+                        const="",
+                        default=None)
+    parser.add_argument('--profile-memory',
+                        help='Makes --profile trace memory allocations with ' +
+                             'tracemalloc, and record the peak traced memory ' +
+                             'and the largest allocations of each volume. ' +
+                             'This slows everything down considerably.',
+                        dest='profile_memory',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--cprofile',
+                        help='Runs everything under cProfile and dumps the ' +
+                             'stats to this path, for use with pstats or ' +
+                             'snakeviz. Only covers the main process, so ' +
+                             'combine it with "--jobs 1".',
+                        dest='cprofile',
+                        default=None)
+    parser.add_argument('--progress',
+                        help='Shows a progress line on stderr with the ' +
+                             'amount of volumes that are done, the speed ' +
+                             'and the remaining time. The work of each ' +
+                             'volume is estimated in SQLite up front. ' +
+                             'Defaults to showing progress if stderr is a ' +
+                             'terminal that the output doesn\'t go to. ' +
+                             f'Only used by "{MODE_STATISTICS}", ' +
+                             f'"{MODE_CSV}" and "{MODE_FREE_SPACE}".',
+                        dest='progress',
+                        action=argparse.BooleanOptionalAction,
+                        default=None)
+    # The options that select volumes. Volumes that don't match are left out
+    # of the queries, so their files are never read. These aren't used by
+    # MODE_COMPILE, because an extract always has every volume.
+    parser.add_argument('--fs-type',
+                        help='Only looks at volumes with this file system, ' +
+                             'like "ntfs".',
+                        dest='fs_type',
+                        default=None)
+    parser.add_argument('--min-size',
+                        help='Only looks at volumes of at least this many ' +
+                             'bytes.',
+                        dest='min_size',
+                        type=int,
+                        default=None)
+    parser.add_argument('--max-size',
+                        help='Only looks at volumes of at most this many ' +
+                             'bytes.',
+                        dest='max_size',
+                        type=int,
+                        default=None)
+    drive_type = parser.add_mutually_exclusive_group()
+    drive_type.add_argument('--hdd',
+                            help='Only looks at volumes on HDDs.',
+                            dest='rotational',
+                            action='store_const',
+                            const=True,
+                            default=None)
+    drive_type.add_argument('--ssd',
+                            help='Only looks at volumes on SSDs.',
+                            dest='rotational',
+                            action='store_const',
+                            const=False,
+                            default=None)
+    parser.add_argument('--system',
+                        help='Only looks at the systems with these ids. ' +
+                             'With several databases, this applies to the ' +
+                             'ids within each database.',
+                        dest='system_ids',
+                        type=int,
+                        nargs='+',
+                        default=None)
+    parser.add_argument('--volume',
+                        help='Only looks at the volumes with these ids. ' +
+                             'With several databases, this applies to the ' +
+                             'ids within each database.',
+                        dest='volume_ids',
+                        type=int,
+                        nargs='+',
+                        default=None)
+    parser.add_argument('--min-fullness',
+                        help='Only looks at volumes of which at least this ' +
+                             'fraction is used, from 0 to 1.',
+                        dest='min_fullness',
+                        type=float,
+                        default=None)
+    # The options that only look at a sample of the files of each volume
+    sample_size = parser.add_mutually_exclusive_group()
+    sample_size.add_argument('--sample',
+                             help='Only looks at this fraction of the files ' +
+                                  'of each volume, from 0 to 1. The files ' +
+                                  'are sampled in SQLite, so the others ' +
+                                  'are never converted. The ratios are ' +
+                                  'reported with a ' +
+                                  f'{CONFIDENCE:.0%} confidence interval. ' +
+                                  f'Only used by "{MODE_STATISTICS}" and ' +
+                                  f'"{MODE_CSV}".',
+                             dest='sample_rate',
+                             type=float,
+                             default=None)
+    sample_size.add_argument('--sample-files',
+                             help='Like --sample, but looks at about this ' +
+                                  'many files of each volume.',
+                             dest='sample_files',
+                             type=int,
+                             default=None)
+    parser.add_argument('--sample-seed',
+                        help='Draws a different sample of the files. The ' +
+                             'same seed always draws the same sample.',
+                        dest='sample_seed',
+                        type=int,
+                        default=0)
+    args = parser.parse_args()
+
+    if args.pushdown and args.filestats:
+        parser.error("--pushdown can't be combined with --filestats")
+    if args.store is not None and args.filestats:
+        parser.error("--store can't be combined with --filestats, because " +
+                     "filetype statistics aren't kept in the result store")
+    if args.profile_memory and args.profile is None:
+        parser.error("--profile-memory can only be used with --profile")
+    if args.sample_rate is not None or args.sample_files is not None:
+        if args.mode not in (MODE_STATISTICS, MODE_CSV):
+            parser.error(f"--sample can only be used by \"{MODE_STATISTICS}\" " +
+                         f"and \"{MODE_CSV}\"")
+        if args.sample_rate is not None and not 0 < args.sample_rate <= 1:
+            parser.error("--sample must be more than 0 and at most 1")
+        if args.sample_files is not None and args.sample_files < 1:
+            parser.error("--sample-files must be at least 1")
+        if args.pushdown:
+            parser.error("--sample can't be combined with --pushdown")
+        if args.store is not None:
+            parser.error("--sample can't be combined with --store, because " +
+                         "the result store only keeps exact results")
+        if args.extract is not None:
+            parser.error("--sample can't be combined with --extract, " +
+                         "because an extract can only load every file")
+
+    args.dbfiles = expand_db_paths(args.dbfiles)
+    if len(args.dbfiles) == 0:
+        parser.error("no database files match the given paths")
+    if len(args.dbfiles) > 1:
+        if args.extract is not None:
+            parser.error("--extract can only be used with a single database")
+        if args.index_copy is not None:
+            parser.error("--index-copy can only be used with a single " +
+                         "database")
+        if args.store not in (None, ""):
+            parser.error("a --store path can only be given for a single " +
+                         "database")
+
+    # The progress line would get mixed up with the statistics if they're
+    # printed to the same terminal.
+    if args.progress is None:
+        args.progress = sys.stderr.isatty() and \
+            not (args.mode == MODE_STATISTICS and sys.stdout.isatty())
+
+    return args
+
+
+def make_volume_filter():
+    """ :returns a VolumeFilter with the options that select volumes """
+    return VolumeFilter(args.fs_type, args.min_size, args.max_size,
+                        args.rotational, args.system_ids, args.volume_ids,
+                        args.min_fullness)
+
+
+def is_sampling():
+    return args.sample_rate is not None or args.sample_files is not None
+
+
+def make_file_sample():
+    """ :returns a FileSample with the options that sample the files, or None
+                 if every file should be looked at """
+    if not is_sampling():
+        return None
+    return FileSample(args.sample_rate, args.sample_files, args.sample_seed)
+
+
+def expand_db_paths(paths):
+    """ Expand the patterns in the given database paths.
+        :returns each path once, in the given order """
+    expanded = []
+    for path in paths:
+        if any(character in path for character in "*?["):
+            expanded += sorted(glob.glob(path))
+        else:
+            expanded.append(path)
+    return list(dict.fromkeys(expanded))
+
+
+def get_database_names(paths):
+    """ Name each database after its file, without the folder and extension,
+        or after its whole path if that's not unique. """
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    if len(set(names)) != len(names):
+        return list(paths)
+    return names
+
+
+def is_merging_databases():
+    return len(args.dbfiles) > 1
+
+
+def add_database_to_header(header):
+    """ Add a "database" column to a CSV header, if several databases are
+        merged. """
+    if not is_merging_databases():
+        return header
+    return ["database"] + header
+
+
+def add_database_to_row(wildfrag, row):
+    """ Add the name of the database to a CSV row, if several databases are
+        merged. The first three columns of the row must be the volume, system
+        and device ids, which are prefixed with the name so they're unique
+        across databases. """
+    if not is_merging_databases():
+        return row
+    name = database_names[wildfrag.db_path]
+    return [name] + [f"{name}:{id}" for id in row[:3]] + row[3:]
+
+
+def open_databases(use_extract=True, use_volume_filter=True):
+    """ Open each database that was given on the commandline.
+        :param use_volume_filter: Whether to only look at the volumes that
+                                  match the options that select volumes """
+    wildfrags = []
+    for db_file, name in zip(args.dbfiles, get_database_names(args.dbfiles)):
+        if is_merging_databases() and args.db_diagnostics:
+            print(f"Database \"{db_file}\":", file=sys.stderr)
+        wildfrag = open_database(db_file, use_extract, use_volume_filter)
+        database_names[wildfrag.db_path] = name
+        database_files[wildfrag.db_path] = db_file
+        wildfrags.append(wildfrag)
+    return wildfrags
+
+
+def open_database(db_file, use_extract=True, use_volume_filter=True):
+    """ Open the given database, or its indexed copy if --index-copy was
+        used. """
+    db_path = db_file
+    if args.index_copy is not None:
+        db_path = args.index_copy
+        if not os.path.isfile(db_path) or \
+                os.path.getmtime(db_path) < os.path.getmtime(db_file):
+            print(f"Building the indexed copy \"{db_path}\"...",
+                  file=sys.stderr)
+            WildFrag(db_file, use_extract=False).make_indexed_copy(db_path)
+
+    volume_filter = None
+    if use_volume_filter:
+        volume_filter = make_volume_filter()
+    wildfrag = WildFrag(db_path, extract_path=args.extract,
+                        use_extract=use_extract, volume_filter=volume_filter,
+                        file_sample=make_file_sample())
+
+    # Scanning the small tables is harmless, but scanning the Files table
+    # for every volume is not.
+    if args.db_diagnostics:
+        print_db_diagnostics(wildfrag)
+    elif "retrieve files" in wildfrag.find_unindexed_lookups():
+        print(f"Note: The files of each volume in \"{db_file}\" are " +
+              "looked up without an " +
+              "index, which scans the whole Files table. Use " +
+              "--db-diagnostics for details, or --index-copy to read from " +
+              "a copy that has the indexes.", file=sys.stderr)
+
+    return wildfrag
+
+
+def print_db_diagnostics(wildfrag):
+    unindexed = wildfrag.find_unindexed_lookups()
+
+    for query_name, plan in wildfrag.explain_query_plans().items():
+        status = "SCAN" if query_name in unindexed else "indexed"
+        print(f"{query_name}: {status}", file=sys.stderr)
+        for line in plan:
+            print(f"    {line}", file=sys.stderr)
+
+
+def estimate_work(wildfrags):
+    """ Estimate the work of each volume up front, if it's needed for the
+        progress line or for scheduling the jobs.
+        :returns the WorkEstimate of each (database path, volume id) and the
+                 costs of each database path (see
+                 `map_each_volume_in_databases`), or None and None if the
+                 estimates aren't needed """
+    if not args.progress and args.jobs <= 1:
+        return None, None
+
+    estimates = {}
+    costs = {}
+    for wildfrag in wildfrags:
+        costs[wildfrag.db_path] = {}
+        for volume_id, estimate in wildfrag.retrieve_work_estimates().items():
+            estimates[wildfrag.db_path, volume_id] = estimate
+            costs[wildfrag.db_path][volume_id] = estimate.cost()
+    return estimates, costs
+
+
+def show_progress(wildfrags, each_volume, estimates):
+    """ Pass through the tuples of `map_each_volume_in_databases`, with a
+        progress line if --progress is enabled. """
+    if not args.progress:
+        return each_volume
+    volume_count = sum(len(wildfrag.retrieve_volume_ids().fetchall())
+                       for wildfrag in wildfrags)
+    return report_progress(each_volume, estimates, volume_count)
+
+
+def get_each_report(wildfrags, with_filetype_stats, skip=None):
+    """ Call `get_each_volume_report_in_databases` with the options that were
+        given on the commandline. """
+    estimates, costs = estimate_work(wildfrags)
+    return show_progress(
+        wildfrags,
+        get_each_volume_report_in_databases(wildfrags, args.jobs,
+                                            with_filetype_stats,
+                                            args.pushdown, skip, costs,
+                                            args.top_extensions,
+                                            args.prefetch_memory * 1_000_000),
+        estimates
+    )
 
 
 def draw_many_disk_allocation_charts(
@@ -62,93 +516,63 @@ def draw_many_disk_allocation_charts(
 
     for i, volume in enumerate(volumes):
         allocs = get_disk_allocations(volume)
-        figure = draw_sampled_disk_allocation_chart(allocs, volume.size, 2000)
 
         if i < len(names):
             name = names[i]
         else:
             name = f"chart_{i}"
 
-        file = f"{folder}/{name}"
-
-        pyplot.savefig(file)
-
+        file = f"{folder}/{name}.png"
 
-def calc_aggregate_layout_score_2(stats: VolumeStats):
-    # Note: `_2` to prevent collision with the function in `layout_score.py`
-    if stats.total_blocks <= stats.files_with_blocks:
-        return 1
-    return 1.0 - (stats.num_gaps / (stats.total_blocks - stats.files_with_blocks))
+        save_raster_disk_allocation_chart(allocs, volume.size, file, 2000)
 
 
-def calc_aggregate_out_of_orderness(stats: VolumeStats):
-    if stats.num_gaps == 0:
-        return 0
-    return stats.backwards_gaps / stats.num_gaps
-
-
-def calc_avg_out_of_orderness(files: list):
-    sum_ooo = 0
-    fragmented_files = 0
-
-    for file in files:
-        if file.num_gaps is not None and file.num_gaps > 1:
-            fragmented_files += 1
-            ooo = file.num_backward / file.num_gaps
-            sum_ooo += ooo
-
-    if fragmented_files == 0:
-        return 0
-
-    return sum_ooo / fragmented_files
-
-
-def derive_fullness(volume):
-    # We used to estimate the fullness when volume.used was None, but the
-    # estimates turned out to be rather inaccurate (4 GB inaccurate on average)
-    assert volume.used is not None
-    return volume.used / volume.size
-
-
-def print_statistics(wildfrag):
+def print_statistics(wildfrags):
     """ Print a bunch of statistics on the commandline.
         If you want to import the outputs into Excel or Calc you should
         paste it into a code editor and run a regex to filter out
         the variable names. """
-    for volume, _, _, i_vol, i_sys, i_dev in get_each_volume(wildfrag):
-        size_in_GB = volume.size / 1_000_000_000
+    previous_wildfrag = None
+    for wildfrag, volume, _, _, i_vol, i_sys, i_dev, report in \
+            get_each_report(wildfrags, is_measuring_filetype_stats):
+        if is_merging_databases() and wildfrag is not previous_wildfrag:
+            print(f"Database {database_names[wildfrag.db_path]}")
+        previous_wildfrag = wildfrag
+
+        size_in_GB = report.size_in_GB
 
         fullness = None
         if volume.used:
-            fullness = derive_fullness(volume)
-
-        # Generate statistics...
-        general_stats, filetype_stats = calc_various_stats(volume.files)
-        layout_score = calc_aggregate_layout_score_2(general_stats)
-        aggregate_ooo = calc_aggregate_out_of_orderness(general_stats)
-        average_ooo = calc_avg_out_of_orderness(volume.files)
-        avg_internal_frag = calc_avg_internal_frag(volume.files)
-
-        gap_size_avg = 0
-        if general_stats.num_gaps != 0:
-            gap_size_avg = general_stats.sum_gap_sizes / general_stats.num_gaps
-
-        assert volume.size != 0
-        normalized_gap_size_avg = gap_size_avg / volume.size
-
-        print(f"Volume {i_vol} (System {i_sys}, device {i_dev})")
-        print(f"{size_in_GB=}")
-        print(f"{fullness=}")
-        print(f"{layout_score=}")
-        print(f"{aggregate_ooo=}")
-        print(f"{normalized_gap_size_avg=}")
-        print(f"{average_ooo=}")
-        print(f"{avg_internal_frag=}")
-
-        print(general_stats.pretty_print())
-        if is_measuring_filetype_stats:
-            for filetype, stats in filetype_stats.items():
-                print(stats.pretty_print())
+            fullness = report.fullness
+
+        layout_score = report.layout_score
+        aggregate_ooo = report.aggregate_ooo
+        normalized_gap_size_avg = report.normalized_gap_size_avg
+        average_ooo = report.average_ooo
+        avg_internal_frag = report.avg_internal_frag
+        general_stats = report.general_stats
+        filetype_stats = report.filetype_stats
+
+        with profiling.stage(profiling.STAGE_OUTPUT):
+            print(f"Volume {i_vol} (System {i_sys}, device {i_dev})")
+            print(f"{size_in_GB=}")
+            print(f"{fullness=}")
+            print(f"{layout_score=}")
+            print(f"{aggregate_ooo=}")
+            print(f"{normalized_gap_size_avg=}")
+            print(f"{average_ooo=}")
+            print(f"{avg_internal_frag=}")
+            if report.sample_rate is not None:
+                sample_rate = report.sample_rate
+                confidence_intervals = report.confidence_intervals
+                print(f"{sample_rate=}")
+                print(f"{confidence_intervals=}")
+
+            print(general_stats.pretty_print())
+            if is_measuring_filetype_stats:
+                for filetype, stats in filetype_stats.items():
+                    print(f"{filetype=}")
+                    print(stats.pretty_print())
 
         gc.collect()
 
@@ -162,103 +586,290 @@ def generate_uid():
     return f"{datetime.datetime.now():%y-%-m-%-d-%-H-%M-%S}"
 
 
-def generate_csv_files(wildfrag):
+def generate_csv_files(wildfrags):
     main_dir = f"./results/{generate_uid()}/"
     makedirs(main_dir, exist_ok=True)
-    # Todo: filetype statistics
 
     main_csv_path = f"{main_dir}/main.csv"
     misc_csv_path = f"{main_dir}/misc.csv"
+    filetypes_csv_path = f"{main_dir}/filetypes.csv"
+    quantiles_csv_path = f"{main_dir}/quantiles.csv"
 
     with open(main_csv_path, 'w') as main_csv_file, \
-         open(misc_csv_path, 'w') as misc_csv_file:
+         open(misc_csv_path, 'w') as misc_csv_file, \
+         open(quantiles_csv_path, 'w') as quantiles_csv_file, \
+         ExitStack() as optional_files:
         main_csv = csv.writer(main_csv_file)
 
-        main_csv.writerow(["volume", "system", "device", "HDD", "fs type",
+        # The filetype statistics have a row for each extension of each
+        # volume...
+        filetypes_csv = None
+        if is_measuring_filetype_stats:
+            filetypes_csv = csv.writer(optional_files.enter_context(
+                open(filetypes_csv_path, 'w')
+            ))
+            filetypes_csv.writerow(add_database_to_header(
+                ["volume", "system", "device", "extension"]
+                + [stats_field.name for stats_field in fields(VolumeStats)]
+            ))
+
+        main_csv.writerow(add_database_to_header(
+                          ["volume", "system", "device", "HDD", "fs type",
                            "size in GB", "used space in GB", "fullness",
                            "aggregate layout score", "aggregate out of orderness",
                            "gap size average",
                            "normalized gap size average",
                            "average internal fragmentation",
-                           "average out of orderness"])
+                           "average out of orderness"] + quantile_header()
+                          + (sample_header() if is_sampling() else [])))
 
         misc_stats_list = []
-
-        for volume, system, device, _, _, _ in get_each_volume(wildfrag):
-            # Generate statistics...
-            size_in_GB = volume.size / 1_000_000_000
-
-            used_space_in_GB = None
-            fullness = None
-            if volume.used is not None:
-                used_space_in_GB = volume.used / 1_000_000_000
-                fullness = derive_fullness(volume)
-
-            misc_stats, filetype_stats = calc_various_stats(volume.files)
-            layout_score = calc_aggregate_layout_score_2(misc_stats)
-            aggregate_ooo = calc_aggregate_out_of_orderness(misc_stats)
-            average_ooo = calc_avg_out_of_orderness(volume.files)
-            avg_internal_frag = calc_avg_internal_frag(volume.files)
-
-            gap_size_avg = 0
-            if misc_stats.num_gaps != 0:
-                gap_size_avg = misc_stats.sum_gap_sizes / misc_stats.num_gaps
-
-            assert volume.size != 0
-            normalized_gap_size_avg = gap_size_avg / volume.size
-
-            is_hdd = (device.rotational == 1)
-
-            # Store data...
-            main_csv.writerow(
-                (volume.id, system.id, device.id, is_hdd, volume.fs_type,
-                 size_in_GB, used_space_in_GB, fullness, layout_score,
-                 aggregate_ooo, gap_size_avg, normalized_gap_size_avg,
-                 avg_internal_frag, average_ooo)
+        # The sketches of all volumes together, for the fleet-wide quantiles
+        fleet_sketches = make_sketches()
+
+        if args.store is None:
+            for wildfrag, volume, system, device, _, _, _, report in \
+                    get_each_report(wildfrags, is_measuring_filetype_stats):
+                # Store data...
+                with profiling.stage(profiling.STAGE_OUTPUT):
+                    main_csv.writerow(add_database_to_row(
+                        wildfrag,
+                        make_main_csv_row(volume, system, device, report)
+                    ))
+                    if filetypes_csv is not None:
+                        filetypes_csv.writerows(
+                            add_database_to_row(wildfrag, row) for row in
+                            make_filetype_csv_rows(volume, system, device,
+                                                   report)
+                        )
+                misc_stats_list.append(report.general_stats)
+                merge_sketches(fleet_sketches, report.sketches)
+        else:
+            for wildfrag, main_row, general_stats, sketches in \
+                    get_each_stored_result(wildfrags):
+                with profiling.stage(profiling.STAGE_OUTPUT):
+                    main_csv.writerow(add_database_to_row(wildfrag, main_row))
+                misc_stats_list.append(general_stats)
+                merge_sketches(fleet_sketches, sketches)
+
+        with profiling.stage(profiling.STAGE_OUTPUT):
+            misc_csv = DataclassWriter(misc_csv_file, misc_stats_list,
+                                       VolumeStats)
+            misc_csv.write()
+
+            # The same quantiles as in the main CSV, but of all volumes
+            # together...
+            quantiles_csv = csv.writer(quantiles_csv_file)
+            quantiles_csv.writerow(["volumes"] + quantile_header())
+            quantiles_csv.writerow([len(misc_stats_list)]
+                                   + quantile_row(fleet_sketches))
+
+
+def make_main_csv_row(volume, system, device, report):
+    is_hdd = (device.rotational == 1)
+    return [volume.id, system.id, device.id, is_hdd, volume.fs_type,
+            report.size_in_GB, report.used_space_in_GB, report.fullness,
+            report.layout_score, report.aggregate_ooo,
+            report.gap_size_avg, report.normalized_gap_size_avg,
+            report.avg_internal_frag, report.average_ooo] + \
+        quantile_row(report.sketches) + \
+        (sample_row(report) if is_sampling() else [])
+
+
+def sample_header():
+    """ The names of the columns of `sample_row` """
+    return ["sample rate", FRAGMENTED_FRACTION] + \
+        [f"{name} {end}" for name in RATIO_METRICS for end in ("low", "high")]
+
+
+def sample_row(report):
+    """ The sample rate and the confidence interval of each of the
+        RATIO_METRICS of a report that was derived from a sample """
+    stats = report.general_stats
+    fragmented_fraction = None
+    if stats.total_files != 0:
+        fragmented_fraction = stats.fragmented_files / stats.total_files
+    return [report.sample_rate, fragmented_fraction] + \
+        [end for name in RATIO_METRICS
+         for end in report.confidence_intervals.get(name, (None, None))]
+
+
+def make_filetype_csv_rows(volume, system, device, report):
+    return [[volume.id, system.id, device.id, filetype,
+             *astuple(stats)]
+            for filetype, stats in report.filetype_stats.items()]
+
+
+def get_each_stored_result(wildfrags):
+    """ Bring the result store of each database up to date, then iterate
+        through the WildFrag, main CSV row, VolumeStats and QuantileSketches
+        of each volume from the stores. Volumes whose stored results are up to date are not
+        measured again. """
+    stores = {}
+    fingerprints = {}
+    for wildfrag in wildfrags:
+        store_path = args.store
+        if store_path == "":
+            store_path = default_result_store_path(
+                database_files[wildfrag.db_path]
+            )
+        stores[wildfrag.db_path] = ResultStore(store_path)
+        fingerprints[wildfrag.db_path] = wildfrag.retrieve_file_fingerprints()
+
+    def get_fingerprint(wildfrag, volume):
+        return fingerprints[wildfrag.db_path].get(volume.id, (0, None))
+
+    def is_stored(wildfrag, volume):
+        return stores[wildfrag.db_path].is_up_to_date(
+            volume.id, get_fingerprint(wildfrag, volume)
+        )
+
+    # Each volume is committed to the store as soon as it's measured, so an
+    # interrupted run loses at most the volumes that were in progress...
+    volumes = []
+    for wildfrag, volume, system, device, _, _, _, report in get_each_report(
+            wildfrags, False, is_stored):
+        if report is not None:
+            stores[wildfrag.db_path].store(
+                volume.id, get_fingerprint(wildfrag, volume),
+                make_main_csv_row(volume, system, device, report),
+                report.general_stats, report.sketches
             )
-            misc_stats_list.append(misc_stats)
+        volumes.append((wildfrag, volume.id))
 
-        misc_csv = DataclassWriter(misc_csv_file, misc_stats_list, VolumeStats)
-        misc_csv.write()
+    for wildfrag, volume_id in volumes:
+        yield wildfrag, *stores[wildfrag.db_path].load(volume_id)
+    for store in stores.values():
+        store.close()
 
 
-def generate_file_sizes_csv(wildfrag):
-    """ Generate a CSV file that contains a huge list of all file sizes in the
-        given database. """
+def generate_free_space_csv(wildfrags):
+    """ Generate a CSV file with statistics about the free space extents of
+        each volume. See `calc_free_space_stats`. """
     main_dir = f"./results/{generate_uid()}/"
     makedirs(main_dir, exist_ok=True)
-    csv_path = f"{main_dir}/filesizes.csv"
+    csv_path = f"{main_dir}/freespace.csv"
+
+    category_names = get_free_space_category_names()
 
     with open(csv_path, 'w') as csv_file:
         csv_writer = csv.writer(csv_file)
-        csv_writer.writerow(["filesize"])
-
-        for volume, _, _, _, _, _ in get_each_volume(wildfrag):
-            for file in volume.files:
-                if file.size is not None:
-                    csv_writer.writerow([file.size])
+        csv_writer.writerow(add_database_to_header(
+            ["volume", "system", "device", "HDD", "fs type", "size in GB",
+             "free extents", "free bytes", "largest free extent"]
+            + [f"extents {name}" for name in category_names]
+            + [f"bytes in extents {name}" for name in category_names]
+        ))
+
+        estimates, costs = estimate_work(wildfrags)
+        each_volume = map_each_volume_in_databases(
+            wildfrags, calc_volume_free_space_stats, args.jobs, costs=costs
+        )
+
+        for wildfrag, volume, system, device, _, _, _, stats in show_progress(
+                wildfrags, each_volume, estimates):
+            is_hdd = (device.rotational == 1)
+            with profiling.stage(profiling.STAGE_OUTPUT):
+                csv_writer.writerow(add_database_to_row(
+                    wildfrag,
+                    [volume.id, system.id, device.id, is_hdd, volume.fs_type,
+                     volume.size / 1_000_000_000, stats.free_extents,
+                     stats.free_bytes, stats.largest_free_extent]
+                    + stats.extent_counts + stats.extent_bytes
+                ))
+
+
+def generate_file_sizes_file(wildfrags, format=FILE_SIZES_CSV):
+    """ Generate a file that contains a huge list of all file sizes in the
+        given databases. The sizes are streamed straight from the Files table
+        of each database, so they are in the order of those tables. """
+    main_dir = f"./results/{generate_uid()}/"
+    makedirs(main_dir, exist_ok=True)
 
+    if format == FILE_SIZES_CSV:
+        with open(f"{main_dir}/filesizes.csv", 'w') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(["filesize"])
+
+            for wildfrag in wildfrags:
+                for rows in wildfrag.retrieve_file_sizes():
+                    csv_writer.writerows(rows)
+    elif format == FILE_SIZES_INT64:
+        with open(f"{main_dir}/filesizes.int64", 'wb') as binary_file:
+            for wildfrag in wildfrags:
+                for rows in wildfrag.retrieve_file_sizes():
+                    binary_file.write(np.array(rows, dtype="<i8").tobytes())
+    elif format == FILE_SIZES_NPY:
+        # The array has to be created with its final size, so the sizes are
+        # counted first.
+        sizes = np.lib.format.open_memmap(
+            f"{main_dir}/filesizes.npy", mode='w+', dtype="<i8",
+            shape=(sum(wildfrag.count_file_sizes() for wildfrag in wildfrags),)
+        )
+        i = 0
+        for wildfrag in wildfrags:
+            for rows in wildfrag.retrieve_file_sizes():
+                sizes[i:i + len(rows)] = np.array(rows, dtype="<i8").ravel()
+                i += len(rows)
+        assert (i == len(sizes))
+        sizes.flush()
+
+
+def write_profile(profiler: Profiler):
+    """ Write the summary of the profiler to the path given with --profile,
+        or to stderr if no path was given. """
+    summary = json.dumps(profiler.summary(), indent=4)
+    if args.profile == "":
+        print(summary, file=sys.stderr)
+    else:
+        with open(args.profile, 'w') as profile_file:
+            profile_file.write(summary)
 
-if __name__ == '__main__':
-    args = parse_args()
-    is_measuring_filetype_stats = args.filestats
 
+def run_mode():
     if args.mode == MODE_STATISTICS:
-        # Note: simplifying this code by moving the "wildfrag = ..." line up is
+        # Note: simplifying this code by moving the "wildfrags = ..." line up is
         # not desirable, because then an "invalid database file" error could
         # be shown when there's be an "invalid mode of operation" error.
         # I'd prefer to show "invalid mode" first and "invalid database" second.
-        wildfrag = WildFrag(args.dbfile)
-        print_statistics(wildfrag)
+        wildfrags = open_databases()
+        print_statistics(wildfrags)
     elif args.mode == MODE_CSV:
-        wildfrag = WildFrag(args.dbfile)
-        generate_csv_files(wildfrag)
+        wildfrags = open_databases()
+        generate_csv_files(wildfrags)
+    elif args.mode == MODE_COMPILE:
+        for wildfrag in open_databases(use_extract=False,
+                                       use_volume_filter=False):
+            extract_path = args.extract
+            if extract_path is None:
+                extract_path = default_extract_path(wildfrag.db_path)
+            compile_extract(wildfrag, extract_path)
+    elif args.mode == MODE_FREE_SPACE:
+        wildfrags = open_databases()
+        generate_free_space_csv(wildfrags)
     elif args.mode == MODE_FILE_SIZES:
         # Secret mode of operation. See the comment near MODE_FILE_SIZES.
-        wildfrag = WildFrag(args.dbfile)
-        generate_file_sizes_csv(wildfrag)
+        wildfrags = open_databases()
+        generate_file_sizes_file(wildfrags, args.filesizes_format)
     else:
         print("Error: You did not provide a valid argument for the mode of " +
               "operation.")
         print("Use \"-h\" as an argument for help.")
 
+
+if __name__ == '__main__':
+    args = parse_args()
+    is_measuring_filetype_stats = args.filestats
+
+    if args.profile is not None:
+        profiling.enable(Profiler(args.profile_memory))
+
+    if args.cprofile is not None:
+        c_profile = cProfile.Profile()
+        c_profile.runcall(run_mode)
+        c_profile.dump_stats(args.cprofile)
+    else:
+        run_mode()
+
+    if profiling.get_profiler() is not None:
+        write_profile(profiling.get_profiler())
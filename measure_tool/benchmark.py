@@ -0,0 +1,166 @@
+"""
+Times the main stages of the measure tool on synthetic databases (see
+`generate_synthetic_db.py`) and compares the timings with the baselines in
+`benchmark_baselines.json`.
+
+Usage: python3 benchmark.py [--scale 10k 1m 10m] [--record]
+
+The synthetic databases are generated once and kept in --db-folder, because
+generating the larger ones takes a while. Use --record to store the timings
+of this run as the new baselines.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from wildfrag.util import get_each_volume, parse_and_normalize_block_ranges, \
+    parse_block_ranges_batch
+from wildfrag.wildfrag import WildFrag
+from metrics.disk_allocations import get_disk_allocations
+from metrics.free_space_extents import calc_free_space_stats
+from metrics.percentage_stats import calc_various_stats
+from graphs.disk_allocation_chart import save_raster_disk_allocation_chart
+from generate_synthetic_db import SyntheticDbConfig, generate_synthetic_db
+from volume_report import calc_volume_report
+
+
+# Each volume gets between half of `files_per_volume` and `files_per_volume`
+# files, so the average is 3/4 of it.
+SCALES = {
+    "10k": SyntheticDbConfig(systems=2, devices_per_system=1,
+                             volumes_per_device=5, files_per_volume=1_333),
+    "1m": SyntheticDbConfig(systems=4, devices_per_system=1,
+                            volumes_per_device=5, files_per_volume=66_667),
+    "10m": SyntheticDbConfig(systems=10, devices_per_system=1,
+                             volumes_per_device=5, files_per_volume=266_667),
+}
+# `parse_and_normalize_block_ranges` handles one file per call, which is far
+# too slow to run on every file of the larger databases.
+PER_FILE_PARSE_LIMIT = 100_000
+# Timings that are this much slower than their baseline are reported.
+REGRESSION_THRESHOLD = 1.25
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "benchmark_baselines.json")
+
+
+class StageTimer:
+    """ Adds up the time spent in each stage over several volumes. """
+    def __init__(self):
+        self.seconds = {}
+
+    def time(self, stage, function, *args):
+        """ Call the function and add its duration to the given stage.
+            :returns whatever the function returns """
+        start = time.perf_counter()
+        result = function(*args)
+        duration = time.perf_counter() - start
+        self.seconds[stage] = self.seconds.get(stage, 0) + duration
+        return result
+
+
+def get_synthetic_db(scale, db_folder):
+    """ :returns the path to the synthetic database of the given scale,
+                 generating it first if it doesn't exist yet """
+    config = SCALES[scale]
+    path = f"{db_folder}/synthetic_{scale}_seed{config.seed}.db"
+    if not os.path.isfile(path):
+        print(f"Generating \"{path}\"...")
+        os.makedirs(db_folder, exist_ok=True)
+        generate_synthetic_db(path, config)
+    return path
+
+
+def run_benchmark(db_path, chart_folder):
+    """ Run every stage on every volume of the given database.
+        :returns a dict with the amount of seconds spent in each stage """
+    timer = StageTimer()
+    wildfrag = timer.time("open database", WildFrag, db_path, True, None,
+                          False)
+    each_volume = timer.time("load volumes", list, get_each_volume(wildfrag))
+    parsed_files = 0
+
+    for volume, _, _, _, _, _ in each_volume:
+        files = timer.time("load files", volume.file_loader, volume.id)
+        blocks_strs = [file.blocks for file in files]
+
+        per_file = blocks_strs[:PER_FILE_PARSE_LIMIT - parsed_files]
+        parsed_files += len(per_file)
+        timer.time("parse_and_normalize_block_ranges", list,
+                   map(parse_and_normalize_block_ranges,
+                       ["" if blocks is None else blocks
+                        for blocks in per_file]))
+        timer.time("parse_block_ranges_batch", parse_block_ranges_batch,
+                   blocks_strs)
+        timer.time("calc_various_stats", calc_various_stats, files)
+        del files, blocks_strs
+
+        timer.time("load frame", volume.get_frame)
+        timer.time("calc_volume_report", calc_volume_report, volume)
+        allocations = timer.time("get_disk_allocations",
+                                 get_disk_allocations, volume)
+        timer.time("free space extents", calc_free_space_stats, allocations,
+                   volume.size)
+        timer.time("chart rendering", save_raster_disk_allocation_chart,
+                   allocations, volume.size,
+                   f"{chart_folder}/volume_{volume.id}.png", 2000)
+        volume.release_files()
+
+    return timer.seconds
+
+
+def compare_with_baselines(timings, baselines):
+    """ Print a table of the timings next to their baselines. """
+    print(f"{'stage':<36}{'seconds':>10}{'baseline':>10}{'ratio':>8}")
+    for stage, seconds in timings.items():
+        baseline = baselines.get(stage)
+        if baseline is None:
+            print(f"{stage:<36}{seconds:>10.3f}{'-':>10}")
+            continue
+        ratio = seconds / baseline if baseline != 0 else float("inf")
+        warning = "  <-- slower" if ratio > REGRESSION_THRESHOLD else ""
+        print(f"{stage:<36}{seconds:>10.3f}{baseline:>10.3f}{ratio:>8.2f}"
+              f"{warning}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale',
+                        help='The scales to benchmark.',
+                        dest='scales',
+                        nargs='+',
+                        choices=list(SCALES),
+                        default=["10k"])
+    parser.add_argument('--db-folder',
+                        help='Where the synthetic databases are kept.',
+                        dest='db_folder',
+                        default=f"{tempfile.gettempdir()}/measure_tool_bench")
+    parser.add_argument('--record',
+                        help='Stores the timings of this run as the new ' +
+                             'baselines.',
+                        dest='record',
+                        action='store_true',
+                        default=False)
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.isfile(BASELINES_PATH):
+        with open(BASELINES_PATH) as baselines_file:
+            baselines = json.load(baselines_file)
+
+    for scale in args.scales:
+        db_path = get_synthetic_db(scale, args.db_folder)
+        with tempfile.TemporaryDirectory() as chart_folder:
+            timings = run_benchmark(db_path, chart_folder)
+
+        print(f"Scale {scale}:")
+        compare_with_baselines(timings, baselines.get(scale, {}))
+        print()
+        baselines[scale] = {stage: round(seconds, 4)
+                            for stage, seconds in timings.items()}
+
+    if args.record:
+        with open(BASELINES_PATH, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=4)
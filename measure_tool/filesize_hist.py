@@ -1,28 +1,88 @@
 import argparse
-import csv
 
-from wildfrag.util import *
+import numpy as np
+
 from wildfrag.wildfrag import WildFrag
+from wildfrag.volume_filter import VolumeFilter
 from metrics.bins import *
 
 
+DEFAULT_BIN_EDGES = [0.001] + [2**i for i in range(9, 40)]
+
+
+def calc_filesize_histograms(wildfrag, volume_filter: VolumeFilter,
+                             bin_edges):
+    """ Make a histogram of the file sizes of each volume that matches the
+        given filter. Only the sizes are read from the database.
+        :returns a dict with a Histogram for each volume id """
+    histograms = {}
+
+    for rows in wildfrag.retrieve_filtered_file_sizes(volume_filter):
+        rows = np.array(rows, dtype=np.int64)
+        volume_ids = rows[:, 0]
+        sizes = rows[:, 1]
+
+        # A batch usually covers only one or two volumes, because the rows
+        # come out of the database grouped by volume.
+        for volume_id in np.unique(volume_ids).tolist():
+            if volume_id not in histograms:
+                histograms[volume_id] = Histogram(bin_edges)
+            histograms[volume_id].add_many(sizes[volume_ids == volume_id])
+
+    return histograms
+
+
+def average_normalized_histograms(histograms):
+    """ Normalize each histogram so that its bins add up to 1, then average
+        them. This way each volume weighs equally, no matter how many files
+        it has.
+        :returns the averaged fraction of files in each bin """
+    fractions = [histogram.count / histogram.count.sum()
+                 for histogram in histograms]
+    return np.mean(fractions, axis=0)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('dbfile')
+    parser.add_argument('--fs-type',
+                        help='Only look at volumes with this file system. ' +
+                             'Use "any" to look at all volumes.',
+                        dest='fs_type',
+                        default="ntfs")
+    parser.add_argument('--min-size',
+                        help='Only look at volumes of at least this many ' +
+                             'bytes.',
+                        dest='min_size',
+                        type=int,
+                        default=25_000_000_000)
+    parser.add_argument('--max-size',
+                        help='Only look at volumes of at most this many bytes.',
+                        dest='max_size',
+                        type=int,
+                        default=None)
+    parser.add_argument('--bin-edges',
+                        help='The upper bound (exclusive) of each bin. Sizes ' +
+                             'beyond the last bound go in the last bin. ' +
+                             'Defaults to 0.001 followed by the powers of ' +
+                             'two from 2^9 to 2^39.',
+                        dest='bin_edges',
+                        type=float,
+                        nargs='+',
+                        default=DEFAULT_BIN_EDGES)
     args = parser.parse_args()
-    wildfrag = WildFrag(args.dbfile)
-    sizes = [0.001] + [2**i for i in range(9, 40)]
-
-    amount_of_volumes = 0
-    filesize_bins = CounterBins(sizes)
-
-    for volume, _, _, _, _, _ in get_each_volume(wildfrag):
-        if volume.size > 25_000_000_000 and volume.fs_type == "ntfs":
-            amount_of_volumes += 1
-            for file in volume.files:
-                if file.size is not None:
-                    filesize_bins.add(file.size)
-
-    for bin in filesize_bins:
-        filesize_bins.bins[bin][0] /= amount_of_volumes
-    print(filesize_bins.pretty_print())
+
+    fs_type = None if args.fs_type == "any" else args.fs_type
+    volume_filter = VolumeFilter(fs_type, args.min_size, args.max_size)
+
+    wildfrag = WildFrag(args.dbfile, read_only=True, use_extract=False)
+    histograms = calc_filesize_histograms(wildfrag, volume_filter,
+                                          args.bin_edges)
+
+    # Volumes without any file sizes can't be normalized, so they're left out.
+    print(f"Averaged over {len(histograms)} volumes")
+    if len(histograms) != 0:
+        bin_edges = Histogram(args.bin_edges).categories()
+        for bin, fraction in zip(bin_edges, average_normalized_histograms(
+                histograms.values())):
+            print(f"{bin}: \t{fraction}")
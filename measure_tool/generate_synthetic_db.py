@@ -0,0 +1,296 @@
+"""
+Generates a synthetic database with the same schema as the databases that
+PriFiwalk makes. The contents are random but internally consistent: the
+`num_gaps`, `num_backward` and `sum_gaps_bytes` of each file match its
+`blocks` string, just like in a real database. This is useful for testing and
+benchmarking the measure tool without access to the real WildFrag database.
+
+Usage: python3 generate_synthetic_db.py <output.db> [options]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+from dataclasses import dataclass
+import unittest
+
+from wildfrag.util import get_each_volume
+from wildfrag.wildfrag import WildFrag
+
+
+SCHEMA = """
+    CREATE TABLE Systems(id INTEGER PRIMARY KEY, start_run TEXT, end_run TEXT,
+        os TEXT);
+    CREATE TABLE StorageDevices(id INTEGER PRIMARY KEY, system_id INT,
+        model TEXT, hwid TEXT, size INT, rotational INT, hotplug INT);
+    CREATE TABLE Volumes(id INTEGER PRIMARY KEY, storage_device_id INT,
+        fs_type TEXT, size INT, used INT, free INT, block_size INT,
+        flags TEXT);
+    CREATE TABLE VolumeNotes(id INTEGER PRIMARY KEY, volume_id INT, note TEXT);
+    CREATE TABLE Files(id INTEGER PRIMARY KEY, volume_id INT, extension TEXT,
+        extension_len INT, mtime TEXT, ctime TEXT, atime TEXT, crtime TEXT,
+        size INT, blocks TEXT, num_blocks INT, num_gaps INT,
+        sum_gaps_bytes INT, sum_gaps_blocks INT, fragmented INT, backward INT,
+        num_backward INT, resident INT, fs_compressed INT, sparse INT,
+        linearconsecutive INT, hardlink_id INT, num_hardlink INT, fs_seq INT,
+        fs_nlink INT, fs_inode INT);
+"""
+INDEXES = """
+    CREATE INDEX files_vol ON Files(volume_id);
+    CREATE INDEX devices_sys ON StorageDevices(system_id);
+    CREATE INDEX volumes_dev ON Volumes(storage_device_id);
+    CREATE INDEX notes_vol ON VolumeNotes(volume_id);
+"""
+
+EXTENSIONS = ["txt", "dll", "exe", "jpg", "png", "log", "", "py", "c", "h",
+              "mp4", "pdf", "json", "xml", "html", "zip", "so", "db"]
+# The amount of blocks of a file is picked from this list
+BLOCK_COUNTS = [0, 1, 1, 1, 2, 3, 5, 10, 30, 100, 1000]
+INSERT_BATCH_SIZE = 100_000
+
+
+@dataclass
+class SyntheticDbConfig:
+    systems: int = 3
+    devices_per_system: int = 2
+    volumes_per_device: int = 2
+    # Each volume gets between half of this and this many files
+    files_per_volume: int = 2000
+    # The chance that a file of more than one block is split into fragments
+    fragmentation_rate: float = 0.2
+    # The chance that a fragmented file has its fragments in a shuffled order
+    # on disk, which gives it backward gaps
+    backward_gap_rate: float = 0.3
+    # The maximum amount of fragments of a file. This also determines how
+    # long the `blocks` strings get.
+    max_fragments: int = 6
+    # The chance that a range in a `blocks` string is split into contiguous
+    # pieces, which the measure tool has to fuse back together
+    split_rate: float = 0.2
+    # The chance that a fragment is placed on top of space that was already
+    # allocated to another file (this actually occurs in WildFrag)
+    overlap_rate: float = 0.001
+    block_size: int = 4096
+    seed: int = 1
+
+
+def generate_synthetic_db(path, config=SyntheticDbConfig(), index=True):
+    """ Write a synthetic database to `path`, replacing any existing file.
+        :param index: Whether to create indexes on the foreign keys. """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(config.seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+
+    volume_id = 0
+    for system_id in range(1, config.systems + 1):
+        connection.execute("INSERT INTO Systems VALUES (?, ?, ?, ?);",
+                           (system_id, "2021-01-01 12:00:00",
+                            "2021-01-01 13:00:00", rng.choice(["windows",
+                                                               "linux"])))
+
+        for i_device in range(config.devices_per_system):
+            device_id = system_id * 100 + i_device
+            connection.execute(
+                "INSERT INTO StorageDevices VALUES (?, ?, ?, ?, ?, ?, ?);",
+                (device_id, system_id, "Synthetic disk", f"hw{device_id}",
+                 10**12, rng.random() < 0.5, 0)
+            )
+
+            for _ in range(config.volumes_per_device):
+                volume_id += 1
+                __generate_volume(connection, rng, config, volume_id,
+                                  device_id)
+
+    if index:
+        connection.executescript(INDEXES)
+    connection.commit()
+    connection.close()
+
+
+def __generate_volume(connection, rng, config, volume_id, device_id):
+    file_count = rng.randint(config.files_per_volume // 2,
+                             config.files_per_volume)
+    # The first block that hasn't been allocated yet
+    cursor = 0
+    rows = []
+
+    for i_file in range(file_count):
+        block_count = rng.choice(BLOCK_COUNTS)
+        fragments, cursor = __place_file(rng, config, block_count, cursor)
+        rows.append(__make_file_row(rng, config, volume_id, i_file,
+                                    block_count, fragments))
+
+        if len(rows) == INSERT_BATCH_SIZE:
+            __insert_files(connection, rows)
+            rows = []
+    __insert_files(connection, rows)
+
+    # Leave some free space at the end of the volume...
+    used = cursor * config.block_size
+    size = int(cursor * rng.uniform(1.1, 2.0) + 1) * config.block_size
+    connection.execute(
+        "INSERT INTO Volumes VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+        (volume_id, device_id, rng.choice(["ntfs", "ext4"]), size, used,
+         size - used, config.block_size, "")
+    )
+    connection.execute("INSERT INTO VolumeNotes VALUES (NULL, ?, ?);",
+                       (volume_id, "Synthetic volume"))
+
+
+def __place_file(rng, config, block_count, cursor):
+    """ Pick where the blocks of a file go on disk.
+        :returns the (first block, block count) of each fragment in file order,
+                 and the new cursor """
+    if block_count == 0:
+        return [], cursor
+
+    fragment_count = 1
+    if block_count > 1 and rng.random() < config.fragmentation_rate:
+        fragment_count = rng.randint(2, min(block_count, config.max_fragments))
+
+    # Split the blocks over the fragments...
+    cuts = sorted(rng.sample(range(1, block_count), fragment_count - 1))
+    lengths = [end - begin for begin, end in
+               zip([0] + cuts, cuts + [block_count])]
+
+    # Place the fragments one after another, with a few free blocks between
+    # them if the file is fragmented...
+    fragments = []
+    for length in lengths:
+        if fragment_count > 1:
+            cursor += rng.randint(1, 8)
+        if cursor > length and rng.random() < config.overlap_rate:
+            fragments.append((rng.randint(0, cursor - length), length))
+        else:
+            fragments.append((cursor, length))
+            cursor += length
+
+    # A file has backward gaps if its fragments aren't in the same order on
+    # disk as they are in the file...
+    if fragment_count > 1 and rng.random() < config.backward_gap_rate:
+        rng.shuffle(fragments)
+
+    return fragments, cursor
+
+
+def __make_file_row(rng, config, volume_id, i_file, block_count, fragments):
+    block_size = config.block_size
+
+    # The ranges in a `blocks` string are inclusive byte ranges...
+    byte_ranges = [(start * block_size, (start + length) * block_size - 1)
+                   for start, length in fragments]
+    pieces = []
+    for begin, end in byte_ranges:
+        if end - begin > 2 * block_size and rng.random() < config.split_rate:
+            middle = begin + block_size - 1
+            pieces += [(begin, middle), (middle + 1, end)]
+        else:
+            pieces.append((begin, end))
+    blocks = " ".join(f"{begin} - {end}" for begin, end in pieces)
+
+    # Derive the gap statistics the way PriFiwalk does, from the fused
+    # ranges...
+    fused = []
+    for begin, end in byte_ranges:
+        if len(fused) != 0 and fused[-1][1] + 1 == begin:
+            fused[-1] = (fused[-1][0], end)
+        else:
+            fused.append((begin, end))
+    gaps = list(zip(fused[:-1], fused[1:]))
+    num_gaps = len(gaps)
+    num_backward = sum(1 for prev, this in gaps if this[0] < prev[1])
+    sum_gaps_bytes = sum(abs(this[0] - prev[1]) for prev, this in gaps)
+
+    resident = 0
+    size = None
+    if block_count != 0:
+        size = block_count * block_size - rng.randint(0, block_size - 1)
+    else:
+        resident = int(rng.random() < 0.5)
+        size = rng.choice([0, 0, 100, 700, None])
+        # Files without blocks sometimes have NULLs instead of empty values
+        if rng.random() < 0.5:
+            blocks = None
+            block_count = None
+
+    extension = rng.choice(EXTENSIONS)
+    timestamp = datetime.datetime(2020, 1, 1) + \
+        datetime.timedelta(seconds=rng.randint(0, 10**8))
+    timestamp = f"{timestamp:%Y-%m-%d %H:%M:%S}.{rng.randint(0, 999999):06}"
+    hardlink_id = rng.randint(1, 1000) if rng.random() < 0.05 else None
+
+    return (None, volume_id, extension, len(extension), timestamp, timestamp,
+            timestamp, timestamp, size, blocks, block_count, num_gaps,
+            sum_gaps_bytes, sum_gaps_bytes // block_size, int(num_gaps != 0),
+            int(num_backward != 0), num_backward, resident,
+            int(rng.random() < 0.05), int(rng.random() < 0.02),
+            int(num_gaps == 0), hardlink_id,
+            2 if hardlink_id is not None else None, 1, 1, i_file + 1000)
+
+
+def __insert_files(connection, rows):
+    connection.executemany(
+        "INSERT INTO Files VALUES (" + ", ".join(["?"] * 26) + ");", rows
+    )
+
+
+class __Tests(unittest.TestCase):
+    def test__gaps_match_blocks(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config = SyntheticDbConfig(systems=1, devices_per_system=1,
+                                       volumes_per_device=2,
+                                       files_per_volume=200,
+                                       fragmentation_rate=0.5)
+            generate_synthetic_db(f"{folder}/synthetic.db", config)
+
+            wildfrag = WildFrag(f"{folder}/synthetic.db")
+            for volume, _, _, _, _, _ in get_each_volume(wildfrag):
+                frame = volume.frame
+                has_blocks = frame["num_blocks"] != 0
+                self.assertEqual(
+                    (frame["num_gaps"] + 1)[has_blocks].tolist(),
+                    frame.block_ranges.counts()[has_blocks].tolist()
+                )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output',
+                        help='Where to write the database. An existing file ' +
+                             'is replaced.')
+    defaults = SyntheticDbConfig()
+    parser.add_argument('--systems', type=int, default=defaults.systems)
+    parser.add_argument('--devices-per-system', dest='devices_per_system',
+                        type=int, default=defaults.devices_per_system)
+    parser.add_argument('--volumes-per-device', dest='volumes_per_device',
+                        type=int, default=defaults.volumes_per_device)
+    parser.add_argument('--files-per-volume', dest='files_per_volume',
+                        type=int, default=defaults.files_per_volume)
+    parser.add_argument('--fragmentation-rate', dest='fragmentation_rate',
+                        type=float, default=defaults.fragmentation_rate)
+    parser.add_argument('--backward-gap-rate', dest='backward_gap_rate',
+                        type=float, default=defaults.backward_gap_rate)
+    parser.add_argument('--max-fragments', dest='max_fragments',
+                        type=int, default=defaults.max_fragments)
+    parser.add_argument('--split-rate', dest='split_rate',
+                        type=float, default=defaults.split_rate)
+    parser.add_argument('--overlap-rate', dest='overlap_rate',
+                        type=float, default=defaults.overlap_rate)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--no-index',
+                        help='Leaves out the indexes on the foreign keys.',
+                        dest='index',
+                        action='store_false',
+                        default=True)
+    args = parser.parse_args()
+
+    config = SyntheticDbConfig(**{
+        name: value for name, value in vars(args).items()
+        if name not in ("output", "index")
+    })
+    generate_synthetic_db(args.output, config, args.index)
@@ -1,15 +1,11 @@
 import matplotlib.pyplot as pyplot
-from metrics.bins import Bins
+from metrics.bins import Bins, Histogram
 from matplotlib.ticker import PercentFormatter
 
 
-def draw_free_space_graph(free_space_section_bins: Bins):
+def draw_free_space_graph(free_space_section_bins: Bins | Histogram):
     # Determine the total size of the sections in each bin...
-    bin_sizes = [0 for _ in free_space_section_bins]
-
-    for bin_number, bin_threshold in enumerate(free_space_section_bins):
-        section_sizes = free_space_section_bins[bin_threshold]
-        bin_sizes[bin_number] = sum(section_sizes)
+    bin_sizes = free_space_section_bins.sums()
 
     total_free_space = sum(bin_sizes)
     space_fractions = [bin_size / total_free_space for bin_size in bin_sizes]
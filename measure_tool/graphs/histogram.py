@@ -1,12 +1,12 @@
 import matplotlib.pyplot as pyplot
 import csv
-from metrics.bins import Bins
+from metrics.bins import Bins, Histogram
 from matplotlib.ticker import PercentFormatter
 
 
-def export_histogram_to_csv(bins: Bins, filename):
-    keys = [key for key in bins.bins.keys()]
-    bin_sizes = [len(bin) for bin in bins.bins.values()]
+def export_histogram_to_csv(bins: Bins | Histogram, filename):
+    keys = bins.categories()
+    bin_sizes = bins.counts()
     total_size = sum(bin_sizes)
     size_fractions = [bin_size / total_size for bin_size in bin_sizes]
 
@@ -16,9 +16,9 @@ def export_histogram_to_csv(bins: Bins, filename):
             writer.writerow((keys[i], size_fractions[i], bin_sizes[i]))
 
 
-def draw_histogram(bins: Bins, title=None):
-    keys = [key for key in bins.bins.keys()]
-    bin_sizes = [len(bin) for bin in bins.bins.values()]
+def draw_histogram(bins: Bins | Histogram, title=None):
+    keys = bins.categories()
+    bin_sizes = bins.counts()
     total_size = sum(bin_sizes)
     size_fractions = [bin_size / total_size for bin_size in bin_sizes]
 
@@ -1,3 +1,6 @@
+import math
+
+import numpy as np
 from sortedcontainers import SortedDict, SortedKeysView
 import unittest
 
@@ -35,6 +38,17 @@ class Bins:
         # Put the value in the bin...
         self.bins.peekitem(index=key_index)[1].append(value)
 
+    def categories(self):
+        return list(self.bins.keys())
+
+    def counts(self):
+        """ The amount of values in each bin """
+        return [len(values) for values in self.bins.values()]
+
+    def sums(self):
+        """ The sum of the values in each bin """
+        return [sum(values) for values in self.bins.values()]
+
     def pretty_print(self):
         result = ""
 
@@ -71,6 +85,13 @@ class CounterBins:
         # Put the value in the bin...
         self.bins.peekitem(index=key_index)[1][0] += 1
 
+    def categories(self):
+        return list(self.bins.keys())
+
+    def counts(self):
+        """ The amount of values in each bin """
+        return [count[0] for count in self.bins.values()]
+
     def pretty_print(self):
         result = ""
 
@@ -80,6 +101,212 @@ class CounterBins:
         return result
 
 
+class Histogram:
+    """
+    Groups numbers into bins the same way as Bins does, but only keeps the
+    amount of values and the sum of the values in each bin. Both are stored in
+    NumPy arrays, so the memory use doesn't depend on the amount of values and
+    many values can be added at once with `add_many`.
+    """
+
+    # The maximum value + 1 of each bin, like the keys of Bins.bins
+    edges: np.ndarray
+    count: np.ndarray
+    sum: np.ndarray
+
+    def __init__(self, bin_categories: list):
+        self.edges = np.array(sorted(bin_categories))
+        self.count = np.zeros(len(self.edges), dtype=np.int64)
+        self.sum = np.zeros(len(self.edges), dtype=np.float64)
+
+    def __iter__(self):
+        return iter(self.edges.tolist())
+
+    def __getitem__(self, key):
+        """ The amount of values in the bin of the given category """
+        return int(self.count[np.searchsorted(self.edges, key)])
+
+    def __bin_indices(self, values):
+        # np.digitize finds the first edge that is larger than each value,
+        # just like bisect_right. Values beyond the last edge go in the last
+        # bin, like they do in Bins.
+        indices = np.digitize(values, self.edges)
+        return np.minimum(indices, len(self.edges) - 1)
+
+    def add(self, value):
+        self.add_many(np.array([value]))
+
+    def add_many(self, values):
+        values = np.asarray(values)
+        indices = self.__bin_indices(values)
+        self.count += np.bincount(indices, minlength=len(self.edges))
+        self.sum += np.bincount(indices, weights=values,
+                                minlength=len(self.edges))
+
+    def merge(self, other: "Histogram"):
+        """ Add the values of another histogram with the same categories to
+            this one. """
+        assert (np.array_equal(self.edges, other.edges))
+        self.count += other.count
+        self.sum += other.sum
+        return self
+
+    def categories(self):
+        return self.edges.tolist()
+
+    def counts(self):
+        """ The amount of values in each bin """
+        return self.count.tolist()
+
+    def sums(self):
+        """ The sum of the values in each bin """
+        return self.sum.tolist()
+
+    def pretty_print(self):
+        result = ""
+
+        for category, count, sum in zip(self.edges, self.count, self.sum):
+            result += f"{category} | {count} |   {sum}\n"
+
+        return result
+
+
+class QuantileSketch:
+    """
+    Estimates quantiles of non-negative numbers without remembering them, like
+    an HDR histogram or DDSketch. The numbers are counted in logarithmically
+    sized buckets, so that every estimate is within `relative_accuracy` of a
+    number that was actually added. Numbers below `min_value` are counted as
+    0, and numbers above `max_value` are counted in the last bucket.
+
+    The memory use only depends on the parameters, and sketches with the same
+    parameters can be merged, so the sketches of many volumes can be combined
+    into one for all of them.
+    """
+
+    relative_accuracy: float
+    min_value: float
+    max_value: float
+    # Whether the numbers are integers, so the estimates can be rounded
+    integers: bool
+    # counts[0] is the amount of numbers below `min_value`, counts[i] is the
+    # amount in [min_value * gamma^(i - 1), min_value * gamma^i).
+    counts: np.ndarray
+    # The smallest and largest number that was added, or None
+    min: float = None
+    max: float = None
+
+    def __init__(self, relative_accuracy=0.01, min_value=1, max_value=2 ** 63,
+                 integers=False):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.integers = integers
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.bucket_count = \
+            2 + math.ceil(math.log(max_value / min_value, self.gamma))
+        self.counts = np.zeros(self.bucket_count, dtype=np.int64)
+        self.min = None
+        self.max = None
+
+    def __bucket_indices(self, values):
+        indices = np.zeros(len(values), dtype=np.int64)
+        is_counted = values >= self.min_value
+        indices[is_counted] = 1 + np.floor(
+            np.log(values[is_counted] / self.min_value) / np.log(self.gamma)
+        ).astype(np.int64)
+        return np.minimum(indices, self.bucket_count - 1)
+
+    def add(self, value):
+        self.add_many([value])
+
+    def add_many(self, values, weights=None):
+        """ :param weights: How many times each value is added, defaults to
+                            once """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        if weights is None:
+            weights = np.ones(len(values), dtype=np.int64)
+        # np.add.at instead of a weighted bincount, because the weights of a
+        # bincount are floats.
+        np.add.at(self.counts, self.__bucket_indices(values),
+                  np.asarray(weights, dtype=np.int64))
+        self.__add_extremes(float(values.min()), float(values.max()))
+
+    def __add_extremes(self, smallest, largest):
+        if self.min is None or smallest < self.min:
+            self.min = smallest
+        if self.max is None or largest > self.max:
+            self.max = largest
+
+    def merge(self, other: "QuantileSketch"):
+        """ Add the numbers of another sketch with the same parameters to
+            this one. """
+        assert (self.bucket_count == other.bucket_count
+                and self.min_value == other.min_value)
+        self.counts += other.counts
+        if other.min is not None:
+            self.__add_extremes(other.min, other.max)
+        return self
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        """ Estimate the `q` quantile, the number below which a fraction `q`
+            of the numbers fall. This uses the nearest rank, like
+            `np.quantile` with method="inverted_cdf", so it's always (an
+            estimate of) one of the numbers.
+            :returns the estimate, or None if nothing was added """
+        count = self.count()
+        if count == 0:
+            return None
+
+        # The index of the number in the sorted numbers. The rounding keeps
+        # 0.9 * 10 from becoming 9.000000000000002.
+        index = max(math.ceil(round(q * count, 9)) - 1, 0)
+        i = int(np.searchsorted(np.cumsum(self.counts), index, side="right"))
+        value = 0.0
+        if i != 0:
+            # The middle of the bucket, which is at most relative_accuracy
+            # away from both of its ends
+            value = self.min_value * self.gamma ** (i - 1) * \
+                (1 + self.gamma) / 2
+
+        value = min(max(value, self.min), self.max)
+        if self.integers:
+            value = float(round(value))
+        return value
+
+    def to_dict(self):
+        """ :returns a dict that can be written as JSON and read back with
+                     `from_dict`. Only the buckets with numbers are kept. """
+        nonzero = np.flatnonzero(self.counts)
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "integers": self.integers,
+            "buckets": dict(zip(nonzero.tolist(),
+                                self.counts[nonzero].tolist())),
+            "min": self.min,
+            "max": self.max
+        }
+
+    @staticmethod
+    def from_dict(values):
+        sketch = QuantileSketch(values["relative_accuracy"],
+                                values["min_value"], values["max_value"],
+                                values["integers"])
+        for i, count in values["buckets"].items():
+            # JSON turns the keys into strings
+            sketch.counts[int(i)] = count
+        sketch.min = values["min"]
+        sketch.max = values["max"]
+        return sketch
+
+
 class __Tests(unittest.TestCase):
     bins: Bins
 
@@ -106,3 +333,41 @@ class __Tests(unittest.TestCase):
 40 | 2 |   [12, 39]
 50 | 2 |   [50, 100]
 """)
+
+    def test__histogram(self):
+        histogram = Histogram([5, 10, 12, 40, 50])
+        histogram.add_many([4, 11, 4, 12, 39, 50, 100])
+        histogram.add(-100)
+        histogram.add(0)
+
+        self.assertEqual(self.bins.categories(), histogram.categories())
+        self.assertEqual(self.bins.counts(), histogram.counts())
+        self.assertEqual(self.bins.sums(), histogram.sums())
+
+    def test__histogram_merge(self):
+        first = Histogram([5, 10])
+        first.add_many([1, 7])
+        second = Histogram([5, 10])
+        second.add_many([2, 20])
+
+        first.merge(second)
+        self.assertEqual([2, 2], first.counts())
+        self.assertEqual([3, 27], first.sums())
+
+    def test__quantile_sketch(self):
+        values = np.random.default_rng(1).lognormal(10, 3, 10_000).round()
+        sketch = QuantileSketch()
+        sketch.add_many(values[:5_000])
+        other = QuantileSketch()
+        other.add_many(values[5_000:])
+        sketch.merge(other)
+
+        self.assertEqual(10_000, sketch.count())
+        for q in (0, 0.5, 0.9, 0.99, 0.999, 1):
+            exact = np.quantile(values, q, method="inverted_cdf")
+            self.assertLessEqual(abs(sketch.quantile(q) - exact),
+                                 0.01 * exact + 0.5)
+
+        copy = QuantileSketch.from_dict(sketch.to_dict())
+        self.assertEqual(sketch.counts.tolist(), copy.counts.tolist())
+        self.assertIsNone(QuantileSketch().quantile(0.5))
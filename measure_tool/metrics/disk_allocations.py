@@ -1,13 +1,17 @@
 from collections import namedtuple
+import numpy as np
 from sortedcontainers import SortedDict
 from wildfrag.data import Volume
-from wildfrag.util import parse_and_normalize_block_ranges
+from wildfrag.util import BlockRanges, parse_block_ranges_batch
 import unittest
 
 
 Allocation = namedtuple("Allocation", ["end", "file", "part", "alloc_type"])
 ALLOC_FILE = 1
 
+# The columns of the Files table that `get_disk_allocations` reads.
+DISK_ALLOCATION_COLUMNS = ["blocks"]
+
 
 class DiskAllocations:
     """ A class to help keep track of the placement of files on a disk. """
@@ -80,21 +84,158 @@ class DiskAllocations:
         return self.find_in_range(range_begin, range_end) is not None
 
 
-def get_disk_allocations(volume: Volume):
-    """ Create a DiskAllocations datastructure from a given Volume """
-    allocs = DiskAllocations()
+class ArrayDiskAllocations:
+    """
+    A read-only alternative to DiskAllocations that keeps the allocations in
+    NumPy arrays sorted by their start, instead of in a SortedDict.
+    It is built in bulk by `from_block_ranges` and supports the same lookups
+    as DiskAllocations, plus batch versions that answer many queries at once.
+    """
+    starts: np.ndarray
+    ends: np.ndarray
+    files: np.ndarray
+    parts: np.ndarray
+
+    def __init__(self, starts, ends, files, parts):
+        """ The arrays must already be sorted by `starts` and must not
+            contain any overlapping allocations. """
+        self.starts = starts
+        self.ends = ends
+        self.files = files
+        self.parts = parts
+
+    @staticmethod
+    def from_block_ranges(block_ranges: BlockRanges):
+        """
+        Create the allocations of the given block ranges. Block range `j` of
+        file `i` becomes an allocation with `file=i` and `part=j`.
+        Just like `DiskAllocations.add` would, this skips empty ranges and
+        ranges that overlap an allocation of an earlier file (or an earlier
+        part of the same file).
+        """
+        owners = block_ranges.owners()
+        parts = np.arange(len(owners)) - block_ranges.offsets[owners]
+        starts = np.asarray(block_ranges.starts)
+        ends = np.asarray(block_ranges.ends)
+
+        # Skip empty byte ranges (this actually occurs in WildFrag)...
+        candidates = np.flatnonzero(starts < ends)
+        order = candidates[np.argsort(starts[candidates], kind="stable")]
+        starts, ends = starts[order], ends[order]
 
-    for file_id, file in enumerate(volume.files):
-        byte_ranges = parse_and_normalize_block_ranges(file.blocks)
-        for part_number, byte_range in enumerate(byte_ranges):
-            # Skip empty byte ranges (this actually occurs in WildFrag) and
-            # skip ranges that are already occupied (this also actually occurs).
-            # Examples of overlapping ranges: file 13005187 and 13171573
-            if byte_range[0] != byte_range[1]\
-               and not allocs.is_range_occupied(byte_range[0], byte_range[1]):
-                allocs.add(byte_range[0], byte_range[1], file_id, part_number)
+        # Sweep over the sorted ranges to find clusters of ranges that overlap
+        # each other. A range starts a new cluster if it begins after every
+        # earlier range has ended.
+        reach = np.maximum.accumulate(ends)
+        is_cluster_start = np.ones(len(order), dtype=bool)
+        is_cluster_start[1:] = starts[1:] >= reach[:-1]
+        cluster_starts = np.flatnonzero(is_cluster_start)
+        cluster_ends = np.append(cluster_starts[1:], len(order))
 
-    return allocs
+        # Skip ranges that are already occupied (this also actually occurs).
+        # Examples of overlapping ranges: file 13005187 and 13171573
+        # This is rare, so the overlapping clusters are resolved one by one
+        # with a DiskAllocations, giving priority to the earliest range in the
+        # original order.
+        is_kept = np.ones(len(order), dtype=bool)
+        overlapping = np.flatnonzero(cluster_ends - cluster_starts > 1)
+        for cluster in overlapping:
+            begin, end = cluster_starts[cluster], cluster_ends[cluster]
+            allocs = DiskAllocations()
+            for i in sorted(range(begin, end), key=lambda i: order[i]):
+                if allocs.is_range_occupied(starts[i], ends[i]):
+                    is_kept[i] = False
+                else:
+                    allocs.add(starts[i], ends[i], 0, 0)
+
+        kept = order[is_kept]
+        return ArrayDiskAllocations(starts[is_kept], ends[is_kept],
+                                    owners[kept], parts[kept])
+
+    @staticmethod
+    def from_disk_allocations(disk_allocations: DiskAllocations):
+        """ Convert a DiskAllocations into an ArrayDiskAllocations. """
+        allocations = disk_allocations.allocations
+        return ArrayDiskAllocations(
+            np.fromiter(allocations.keys(), dtype=np.int64,
+                        count=len(allocations)),
+            np.array([alloc.end for alloc in allocations.values()],
+                     dtype=np.int64),
+            np.array([alloc.file for alloc in allocations.values()],
+                     dtype=np.int64),
+            np.array([alloc.part for alloc in allocations.values()],
+                     dtype=np.int64)
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(self.starts.tolist())
+
+    def __getitem__(self, alloc_start):
+        index = np.searchsorted(self.starts, alloc_start)
+        if index == len(self.starts) or self.starts[index] != alloc_start:
+            return None
+        return self.__allocation(index)
+
+    def __allocation(self, index):
+        return Allocation(int(self.ends[index]), int(self.files[index]),
+                          int(self.parts[index]), ALLOC_FILE)
+
+    def __item(self, index):
+        if index == -1:
+            return None
+        return int(self.starts[index]), self.__allocation(index)
+
+    def find_allocation(self, byte: int):
+        """ Find the allocation that the parameter `byte` is inside of. """
+        return self.__item(self.find_allocations(np.array([byte]))[0])
+
+    def find_in_range(self, range_begin, range_end):
+        """ Find an allocation within the given range.
+        Returns None or the last allocation within the range.
+        """
+        found = self.find_in_ranges(np.array([range_begin]),
+                                    np.array([range_end]))
+        return self.__item(found[0])
+
+    def find_allocations(self, bytes: np.ndarray):
+        """ Does the same as `find_allocation` for each of the given bytes.
+            :returns the index of each found allocation, or -1 if a byte is
+                     not inside of any allocation """
+        if len(self.starts) == 0:
+            return np.full(len(bytes), -1)
+        found = np.searchsorted(self.starts, bytes, side="right") - 1
+        is_inside = (found != -1) & (bytes < self.ends[found])
+        return np.where(is_inside, found, -1)
+
+    def find_in_ranges(self, range_begins: np.ndarray, range_ends: np.ndarray):
+        """ Does the same as `find_in_range` for each of the given ranges.
+            :returns the index of each found allocation, or -1 if a range
+                     doesn't overlap any allocation """
+        if len(self.starts) == 0:
+            return np.full(len(range_begins), -1)
+        found = np.searchsorted(self.starts, range_ends, side="left") - 1
+        is_outside = (self.starts[found] < range_begins) \
+            & (self.ends[found] <= range_begins)
+        return np.where((found != -1) & ~is_outside, found, -1)
+
+    def is_allocated(self, byte: int):
+        """ Check whether the parameter `byte` is already allocated. """
+        return self.find_allocation(byte) is not None
+
+    def is_range_occupied(self, range_begin, range_end):
+        """ Check if the parameter range is already (partially) allocated """
+        return self.find_in_range(range_begin, range_end) is not None
+
+
+def get_disk_allocations(volume: Volume):
+    """ Create a DiskAllocations datastructure from a given Volume.
+        This returns an ArrayDiskAllocations, which supports the same lookups
+        as DiskAllocations. """
+    frame = volume.get_frame(DISK_ALLOCATION_COLUMNS)
+    return ArrayDiskAllocations.from_block_ranges(frame.block_ranges)
 
 
 class __Tests(unittest.TestCase):
@@ -123,4 +264,34 @@ class __Tests(unittest.TestCase):
         found = allocs.find_in_range(1, 20)
         self.assertEqual(2, found[1].file)
 
+    def test__array_disk_allocations(self):
+        block_ranges = parse_block_ranges_batch(
+            ["0 - 10 20 - 25", "10 - 20 5 - 8 26 - 27", "30 - 30 24 - 40"]
+        )
+        allocs = ArrayDiskAllocations.from_block_ranges(block_ranges)
+
+        # The same allocations as in setUp, minus the empty and overlapping
+        # ranges...
+        self.assertEqual([0, 10, 20, 26], list(allocs))
+        self.assertEqual(Allocation(20, 1, 0, ALLOC_FILE), allocs[10])
+
+        for byte in range(-1, 30):
+            expected = self.allocs.find_allocation(byte)
+            found = allocs.find_allocation(byte)
+            if expected is None:
+                self.assertIsNone(found)
+            else:
+                self.assertEqual((expected[0], expected[1].end),
+                                 (found[0], found[1].end))
+        self.assertEqual(1, allocs.find_in_range(1, 20)[1].file)
+        self.assertFalse(allocs.is_range_occupied(25, 26))
+        self.assertTrue(allocs.is_range_occupied(25, 27))
+
+    def test__find_allocations(self):
+        allocs = ArrayDiskAllocations.from_block_ranges(
+            parse_block_ranges_batch(["0 - 10 20 - 25", "10 - 20"])
+        )
+        found = allocs.find_allocations(np.array([-1, 0, 15, 24, 25]))
+        self.assertEqual([-1, 0, 1, 2, -1], found.tolist())
+
 
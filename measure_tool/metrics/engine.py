@@ -0,0 +1,192 @@
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+import numpy as np
+from wildfrag.frame import FRAME_COLUMNS, VolumeFrame
+from wildfrag.util import parse_and_normalize_block_ranges, \
+    parse_block_ranges_batch
+import profiling
+import unittest
+
+
+class Accumulator(ABC):
+    """
+    A metric that is derived from the files of a volume, one file at a time.
+    `update` is called once for each file and `finish` returns the result
+    afterwards.
+
+    Accumulators that need the block ranges of a file should get them through
+    `self.block_ranges(file)`. When the accumulator is part of a MetricEngine,
+    the block ranges of each file are only parsed once, no matter how many
+    accumulators ask for them.
+
+    `columns` lists the columns of the Files table that the accumulator reads.
+    Only those columns are retrieved from the database (see
+    `MetricEngine.columns`), so the others are None or missing.
+
+    Accumulators can also have an `update_frame(frame)` method, which is the
+    vectorized version of `update` and is given all files of a volume at once
+    as a VolumeFrame. Accumulators without one are given a File for each row
+    of the frame instead (see `MetricEngine.run_frame`).
+    """
+    columns = FRAME_COLUMNS
+
+    @abstractmethod
+    def update(self, file):
+        pass
+
+    @abstractmethod
+    def finish(self):
+        pass
+
+    def block_ranges(self, file):
+        # This is replaced by `MetricEngine.block_ranges` on registration.
+        return parse_and_normalize_block_ranges(file.blocks)
+
+
+class MetricEngine:
+    """
+    Runs several accumulators over the same collection of files, so that the
+    files are traversed once and the block ranges of each file are parsed
+    at most once.
+    The first time an accumulator asks for block ranges during `run`, the
+    block ranges of all files are parsed in one go with
+    `parse_block_ranges_batch`.
+    """
+    accumulators: list
+
+    def __init__(self, accumulators=()):
+        self.accumulators = []
+        self.__parsed_file = None
+        self.__parsed_ranges = None
+        self.__files = None
+        self.__file_index = None
+        self.__batch = None
+
+        for accumulator in accumulators:
+            self.register(accumulator)
+
+    def register(self, accumulator: Accumulator):
+        accumulator.block_ranges = self.block_ranges
+        self.accumulators.append(accumulator)
+        return accumulator
+
+    def columns(self):
+        """ The columns of the Files table that any of the accumulators
+            reads, in table order. """
+        needed = set()
+        for accumulator in self.accumulators:
+            needed.update(accumulator.columns)
+        return [name for name in FRAME_COLUMNS if name in needed]
+
+    def block_ranges(self, file):
+        """ The parsed and normalized block ranges of the given file. """
+        # Accumulators only ever ask for the file they're currently given, so
+        # remembering the last parsed file is enough.
+        if file is self.__parsed_file:
+            return self.__parsed_ranges
+
+        files = self.__files
+        if files is not None and files[self.__file_index] is file:
+            if self.__batch is None:
+                self.__batch = parse_block_ranges_batch(
+                    [f.blocks for f in files]
+                )
+            self.__parsed_ranges = self.__batch[self.__file_index]
+        else:
+            self.__parsed_ranges = parse_and_normalize_block_ranges(file.blocks)
+
+        self.__parsed_file = file
+        return self.__parsed_ranges
+
+    def run(self, files, block_ranges=None):
+        """ Feed each file to each accumulator.
+            :param block_ranges: The BlockRanges of the files, if they were
+                                 already parsed beforehand.
+            :returns a list with the result of each accumulator """
+        with profiling.stage(profiling.STAGE_METRICS):
+            self.__feed(self.accumulators, files, block_ranges)
+            return [accumulator.finish() for accumulator in self.accumulators]
+
+    def run_frame(self, frame: VolumeFrame):
+        """ Like `run`, but for the files in a VolumeFrame. Accumulators that
+            implement `update_frame` are given the whole frame, the others
+            are given a File for each row.
+            :returns a list with the result of each accumulator """
+        with profiling.stage(profiling.STAGE_METRICS):
+            per_file = []
+            for accumulator in self.accumulators:
+                if hasattr(accumulator, "update_frame"):
+                    accumulator.update_frame(frame)
+                else:
+                    per_file.append(accumulator)
+
+            if len(per_file) != 0:
+                self.__feed(per_file, frame.files(), frame.block_ranges)
+            return [accumulator.finish() for accumulator in self.accumulators]
+
+    def __feed(self, accumulators, files, block_ranges):
+        self.__files = files
+        self.__batch = block_ranges
+
+        for self.__file_index, file in enumerate(files):
+            for accumulator in accumulators:
+                accumulator.update(file)
+
+        self.__parsed_file = None
+        self.__parsed_ranges = None
+        self.__files = None
+        self.__file_index = None
+        self.__batch = None
+
+
+def sequential_sum(start, values):
+    """ Add the values to `start` one after the other, like a for-loop would.
+        `np.sum` adds pairwise instead, which rounds differently, so this is
+        used wherever a vectorized metric has to give the exact same result
+        as its per-file version. """
+    if len(values) == 0:
+        return start
+    return float(np.cumsum(np.concatenate(([start], values)))[-1])
+
+
+class __Tests(unittest.TestCase):
+    class RangeCounter(Accumulator):
+        columns = ["blocks"]
+
+        def __init__(self):
+            self.ranges = 0
+
+        def update(self, file):
+            self.ranges += len(self.block_ranges(file))
+
+        def finish(self):
+            return self.ranges
+
+    def test__run(self):
+        files = [SimpleNamespace(blocks="0 - 9 10 - 19 40 - 49"),
+                 SimpleNamespace(blocks="100 - 199")]
+        engine = MetricEngine([self.RangeCounter(), self.RangeCounter()])
+        self.assertEqual([3, 3], engine.run(files))
+
+    def test__run_frame(self):
+        class VectorizedRangeCounter(self.RangeCounter):
+            def update_frame(self, frame):
+                self.ranges += len(frame.block_ranges.starts)
+
+        frame = VolumeFrame.from_row_batches(
+            [[("0 - 9 10 - 19 40 - 49",), ("100 - 199",)]], ["blocks"]
+        )
+        engine = MetricEngine([self.RangeCounter(), VectorizedRangeCounter()])
+        self.assertEqual([3, 3], engine.run_frame(frame))
+
+    def test__columns(self):
+        class SizeCounter(self.RangeCounter):
+            columns = ["size", "id"]
+
+        engine = MetricEngine([self.RangeCounter(), SizeCounter()])
+        self.assertEqual(["id", "size", "blocks"], engine.columns())
+
+    def test__block_ranges_are_shared(self):
+        file = SimpleNamespace(blocks="0 - 9 20 - 29")
+        engine = MetricEngine()
+        self.assertIs(engine.block_ranges(file), engine.block_ranges(file))
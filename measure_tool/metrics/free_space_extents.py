@@ -1,6 +1,14 @@
+from dataclasses import dataclass
+import numpy as np
 from wildfrag.data import *
-from metrics.bins import Bins
-from metrics.disk_allocations import get_disk_allocations
+from metrics.bins import Histogram
+from metrics.disk_allocations import ArrayDiskAllocations, get_disk_allocations
+import unittest
+
+
+# Categories ranging from 8 KiB to 2 GiB, with one last category for even
+# larger sections.
+FREE_SPACE_CATEGORIES = [2**x for x in range(13, 32)]
 
 
 def get_free_space_sections(disk_allocations, volume_size):
@@ -15,6 +23,8 @@ def get_free_space_sections(disk_allocations, volume_size):
         if alloc_start != prev_end:
             yield prev_end, alloc_start
 
+        prev_end = alloc_end
+
     if prev_end != volume_size:
         yield prev_end, volume_size
 
@@ -25,14 +35,95 @@ def get_free_space_extents(volume: Volume):
 
 
 def get_free_space_extents_2(disk_allocations, volume_size):
-    # Categories ranging from 8 KiB to 2 GiB, with one last category for even
-    # larger sections.
-    categories = [2**x for x in range(13, 32)]
-    extents_histogram = Bins(categories)
+    extents_histogram = Histogram(FREE_SPACE_CATEGORIES)
 
-    for section_start, section_end in \
-            get_free_space_sections(disk_allocations, volume_size):
-        section_size = section_end - section_start
-        extents_histogram.add(section_size)
+    if isinstance(disk_allocations, ArrayDiskAllocations):
+        extents_histogram.add_many(
+            get_free_space_extent_sizes(disk_allocations, volume_size)
+        )
+    else:
+        for section_start, section_end in \
+                get_free_space_sections(disk_allocations, volume_size):
+            section_size = section_end - section_start
+            extents_histogram.add(section_size)
 
     return extents_histogram
+
+
+@dataclass
+class FreeSpaceStats:
+    free_extents: int
+    free_bytes: int
+    largest_free_extent: int
+    # The amount of free extents in each of the FREE_SPACE_CATEGORIES, using
+    # the same categorization as Bins
+    extent_counts: list
+    # The total size of the free extents in each category
+    extent_bytes: list
+
+
+def get_free_space_extent_sizes(allocations: ArrayDiskAllocations,
+                                volume_size):
+    """ Does the same as `get_free_space_sections`, but returns the size of
+        each free section as an array. """
+    starts = allocations.starts
+    ends = allocations.ends
+
+    if len(starts) == 0:
+        sizes = np.array([volume_size], dtype=np.int64)
+    else:
+        sizes = np.concatenate((
+            [starts[0]],  # The free space before the first allocation
+            starts[1:] - ends[:-1],
+            [volume_size - ends[-1]]  # The free space after the last one
+        ))
+
+    return sizes[sizes > 0]
+
+
+def calc_free_space_stats(allocations: ArrayDiskAllocations, volume_size,
+                          categories=FREE_SPACE_CATEGORIES):
+    """ Derive statistics about the free extents of a volume. """
+    sizes = get_free_space_extent_sizes(allocations, volume_size)
+
+    histogram = Histogram(categories)
+    histogram.add_many(sizes)
+
+    return FreeSpaceStats(
+        free_extents=len(sizes),
+        free_bytes=int(sizes.sum()),
+        largest_free_extent=int(sizes.max(initial=0)),
+        extent_counts=histogram.counts(),
+        extent_bytes=histogram.sum.astype(np.int64).tolist()
+    )
+
+
+def calc_volume_free_space_stats(wildfrag, volume: Volume):
+    """ Derive the FreeSpaceStats of a volume. This has the signature that
+        `map_each_volume_in_databases` expects. """
+    allocations = get_disk_allocations(volume)
+    return calc_free_space_stats(allocations, volume.size)
+
+
+def get_free_space_category_names(categories=FREE_SPACE_CATEGORIES):
+    """ A name for each category, in the style of the labels of
+        `draw_histogram`. """
+    names = [f"below {category}" for category in categories]
+    names[-1] = f"{categories[-2]} and up"
+    return names
+
+
+class __Tests(unittest.TestCase):
+    def test__calc_free_space_stats(self):
+        allocations = ArrayDiskAllocations(
+            np.array([8192, 10000, 30000]), np.array([10000, 20000, 40000]),
+            np.array([0, 1, 2]), np.array([0, 0, 0])
+        )
+        stats = calc_free_space_stats(allocations, 2**33)
+
+        # The allocations at 10000 are adjacent, so there are only 3 extents
+        self.assertEqual(3, stats.free_extents)
+        self.assertEqual(8192 + 10000 + 2**33 - 40000, stats.free_bytes)
+        self.assertEqual(2**33 - 40000, stats.largest_free_extent)
+        self.assertEqual([0, 2] + [0] * 16 + [1], stats.extent_counts)
+        self.assertEqual(8192 + 10000, stats.extent_bytes[1])
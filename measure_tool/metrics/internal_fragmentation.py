@@ -1,15 +1,72 @@
+from types import SimpleNamespace
+import sqlite3
+import unittest
 from wildfrag.data import *
+from wildfrag.file_sample import FileSample
+from wildfrag.frame import VolumeFrame
+from metrics.engine import Accumulator, MetricEngine, sequential_sum
 
 
-def calc_avg_internal_frag(files: list):
-    file: File
-    sum_internal_frag = 0
-    fraggable_file_count = 0
+class AvgInternalFragAccumulator(Accumulator):
+    """ The average of `num_gaps / (num_blocks - 1)` over all files with more
+        than one block. """
+    columns = ["num_blocks", "num_gaps"]
+
+    def __init__(self):
+        self.sum_internal_frag = 0
+        self.fraggable_file_count = 0
 
-    for file in files:
+    def update(self, file: File):
         if file.num_blocks is not None and file.num_blocks > 1:
-            fraggable_file_count += 1
+            self.fraggable_file_count += 1
             internal_frag = file.num_gaps / (file.num_blocks - 1)
-            sum_internal_frag += internal_frag
+            self.sum_internal_frag += internal_frag
+
+    def update_frame(self, frame):
+        num_blocks = frame["num_blocks"]
+        is_fraggable = ~frame.is_null("num_blocks") & (num_blocks > 1)
+        self.fraggable_file_count += int(is_fraggable.sum())
+        self.sum_internal_frag = sequential_sum(
+            self.sum_internal_frag,
+            frame["num_gaps"][is_fraggable] / (num_blocks[is_fraggable] - 1)
+        )
+
+    def finish(self):
+        # A sample of the files can easily miss every file with more than one
+        # block, even if the volume has some.
+        if self.fraggable_file_count == 0:
+            return 0
+        return self.sum_internal_frag / self.fraggable_file_count
+
+
+def calc_avg_internal_frag(files: list):
+    return MetricEngine([AvgInternalFragAccumulator()]).run(files)[0]
+
+
+class __Tests(unittest.TestCase):
+    def test__sample_without_fraggable_files(self):
+        # A volume of which no file has more than one block...
+        columns = ["id", "num_blocks", "num_gaps"]
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE Files(id INTEGER PRIMARY KEY, " +
+                           "num_blocks INT, num_gaps INT);")
+        connection.executemany(
+            "INSERT INTO Files VALUES (?, ?, ?);",
+            [(i, [0, 1, None][i % 3], 0) for i in range(1, 101)]
+        )
+
+        # ...sampled the same way WildFrag does with --sample-files 3.
+        sample = FileSample(files_per_volume=3, seed=0)
+        condition, parameters = sample.to_sql(sample.get_rate(100))
+        rows = connection.execute(
+            f"SELECT {', '.join(columns)} FROM Files WHERE {condition};",
+            parameters
+        ).fetchall()
+        self.assertLess(0, len(rows))
+        self.assertGreater(100, len(rows))
 
-    return sum_internal_frag / fraggable_file_count
\ No newline at end of file
+        frame = VolumeFrame.from_row_batches([rows], columns)
+        files = [SimpleNamespace(**dict(zip(columns, row))) for row in rows]
+        self.assertEqual(0, calc_avg_internal_frag(files))
+        self.assertEqual(0, MetricEngine([AvgInternalFragAccumulator()])
+                         .run_frame(frame)[0])
@@ -1,12 +1,17 @@
 from wildfrag.data import *
 from wildfrag.util import *
+from metrics.engine import Accumulator, MetricEngine, sequential_sum
+import numpy as np
 import unittest
 
 
-def count_out_of_order_gaps(file: File):
+def count_out_of_order_gaps(file: File, block_ranges=None):
+    """ :param block_ranges: The parsed and normalized block ranges of the
+                             file, if they were already parsed beforehand. """
     # Parse the block ranges...
-    assert (file.blocks is not None)
-    block_ranges = parse_and_normalize_block_ranges(file.blocks)
+    if block_ranges is None:
+        assert (file.blocks is not None)
+        block_ranges = parse_and_normalize_block_ranges(file.blocks)
     assert (len(block_ranges) > 1)
     assert (len(block_ranges) == file.num_gaps + 1)
 
@@ -24,6 +29,16 @@ def count_out_of_order_gaps(file: File):
     return out_of_order_total
 
 
+def count_out_of_order_gaps_batch(block_ranges: BlockRanges):
+    """ Does the same as `count_out_of_order_gaps` for every file of the given
+        BlockRanges at once.
+        :returns an array with the amount of out-of-order gaps of each file """
+    owners = block_ranges.owners()
+    is_out_of_order = (block_ranges.starts[1:] < block_ranges.ends[:-1]) \
+        & (owners[1:] == owners[:-1])
+    return np.bincount(owners[1:][is_out_of_order], minlength=len(block_ranges))
+
+
 def calc_aggregate_out_of_orderness(volume: Volume):
     gaps_total = 0
     out_of_order_gaps_total = 0
@@ -46,6 +61,38 @@ def calc_out_of_orderness(file: File):
     return count_out_of_order_gaps(file) / file.num_gaps
 
 
+class AvgOutOfOrdernessAccumulator(Accumulator):
+    """ The average of `num_backward / num_gaps` over all files with more than
+        one gap, as recorded by PriFiwalk. """
+    columns = ["num_gaps", "num_backward"]
+
+    def __init__(self):
+        self.sum_ooo = 0
+        self.fragmented_files = 0
+
+    def update(self, file):
+        if file.num_gaps is not None and file.num_gaps > 1:
+            self.fragmented_files += 1
+            self.sum_ooo += file.num_backward / file.num_gaps
+
+    def update_frame(self, frame):
+        num_gaps = frame["num_gaps"]
+        has_gaps = ~frame.is_null("num_gaps") & (num_gaps > 1)
+        self.fragmented_files += int(has_gaps.sum())
+        self.sum_ooo = sequential_sum(
+            self.sum_ooo, frame["num_backward"][has_gaps] / num_gaps[has_gaps]
+        )
+
+    def finish(self):
+        if self.fragmented_files == 0:
+            return 0
+        return self.sum_ooo / self.fragmented_files
+
+
+def calc_avg_out_of_orderness(files: list):
+    return MetricEngine([AvgOutOfOrdernessAccumulator()]).run(files)[0]
+
+
 class __Tests(unittest.TestCase):
     def test__count_out_of_order_blocks(self):
         blocks = "10 - 50 160 - 161 120 - 130 85 - 86"
@@ -82,3 +129,10 @@ class __Tests(unittest.TestCase):
 
         self.assertEqual(2, count_out_of_order_gaps(file))
 
+    def test__count_out_of_order_gaps_batch(self):
+        block_ranges = parse_block_ranges_batch(
+            ["10 - 50 160 - 161 120 - 130 85 - 86", "5 - 6", "9 - 10 1 - 2"]
+        )
+        counts = count_out_of_order_gaps_batch(block_ranges)
+        self.assertEqual([2, 0, 1], counts.tolist())
+
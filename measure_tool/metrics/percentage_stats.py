@@ -1,5 +1,11 @@
-from dataclasses import dataclass, field
-from metrics.out_of_orderness import count_out_of_order_gaps
+from dataclasses import dataclass, field, fields
+import numpy as np
+import unittest
+from wildfrag.data import FileAggregates
+from wildfrag.frame import VolumeFrame
+from metrics.engine import Accumulator, MetricEngine
+from metrics.out_of_orderness import count_out_of_order_gaps, \
+    count_out_of_order_gaps_batch
 
 
 @dataclass
@@ -42,20 +48,77 @@ class VolumeStats:
                 f"{self.sum_file_sizes=}\n")
 
 
-def calc_various_stats(files):
-    """ Derives VolumeStats from the given collection of files.
-        Return both a VolumeStats for the whole system and a dictionary
-        of VolumeStats for each individual filetype. """
-    filetypes = {"[filtered]": VolumeStats()}
-    all_files = VolumeStats()
-    all_files.total_files = len(files)
+# The filetype that the files of all extensions beyond the top extensions are
+# counted under. See `VolumeStatsAccumulator`.
+OTHER_EXTENSIONS = "[filtered]"
+
+
+def add_volume_stats(target: VolumeStats, stats: VolumeStats):
+    """ Add each statistic of `stats` to that of `target`. """
+    for stats_field in fields(VolumeStats):
+        name = stats_field.name
+        setattr(target, name, getattr(target, name) + getattr(stats, name))
+
+
+def cap_filetype_stats(filetypes: dict, top_extensions):
+    """ Keep the VolumeStats of the `top_extensions` filetypes with the most
+        files, and add those of the other filetypes to OTHER_EXTENSIONS.
+        OTHER_EXTENSIONS is left out if it has no files.
+        :returns the capped dictionary """
+    other = VolumeStats()
+    ranked = sorted((filetype for filetype in filetypes
+                     if filetype != OTHER_EXTENSIONS),
+                    key=lambda filetype: -filetypes[filetype].total_files)
+
+    capped = {}
+    for i, filetype in enumerate(ranked):
+        if i < top_extensions:
+            capped[filetype] = filetypes[filetype]
+        else:
+            add_volume_stats(other, filetypes[filetype])
+    if OTHER_EXTENSIONS in filetypes:
+        add_volume_stats(other, filetypes[OTHER_EXTENSIONS])
+    if other.total_files != 0:
+        capped[OTHER_EXTENSIONS] = other
+    return capped
 
-    for file in files:
-        filetype = file.extension
-        if filetype not in filetypes or filetypes[filetype] is not VolumeStats:
-            filetypes[filetype] = VolumeStats()
-        this_type = filetypes[filetype]
 
+class VolumeStatsAccumulator(Accumulator):
+    """ Derives VolumeStats from the files it is given.
+        `finish` returns both a VolumeStats for the whole system and a
+        dictionary of VolumeStats for each individual filetype.
+        If `with_filetype_stats` is False, the extensions aren't retrieved and
+        the dictionary of filetypes should be ignored.
+        If `top_extensions` is given, only the filetypes of that many
+        extensions with the most files are kept, and all other files are
+        counted under OTHER_EXTENSIONS. That keeps volumes with many
+        thousands of distinct extensions manageable. `update_frame` never
+        keeps more than `top_extensions + 1` filetypes, but `update` keeps
+        every extension until `finish`, because the top extensions aren't
+        known before all files were seen. """
+    columns = ["size", "blocks", "num_blocks", "num_gaps", "sum_gaps_bytes",
+               "fragmented", "resident", "fs_compressed", "sparse",
+               "hardlink_id"]
+
+    def __init__(self, with_filetype_stats=True, top_extensions=None):
+        self.filetypes = {}
+        self.all_files = VolumeStats()
+        self.with_filetype_stats = with_filetype_stats
+        self.top_extensions = top_extensions
+        if with_filetype_stats:
+            self.columns = self.columns + ["extension"]
+
+    def update(self, file):
+        all_files = self.all_files
+        filetypes = self.filetypes
+
+        # The extensions of Files are interned by WildFrag, which makes this
+        # lookup cheap.
+        this_type = filetypes.get(file.extension)
+        if this_type is None:
+            this_type = filetypes[file.extension] = VolumeStats()
+
+        all_files.total_files += 1
         this_type.total_files += 1
 
         if file.size is not None:
@@ -103,8 +166,175 @@ def calc_various_stats(files):
                 this_type.num_gaps += file.num_gaps
                 all_files.sum_gap_sizes += file.sum_gaps_bytes
                 this_type.sum_gap_sizes += file.sum_gaps_bytes
-                out_of_order_gaps = count_out_of_order_gaps(file)
+                out_of_order_gaps = \
+                    count_out_of_order_gaps(file, self.block_ranges(file))
                 all_files.backwards_gaps += out_of_order_gaps
                 this_type.backwards_gaps += out_of_order_gaps
 
-    return all_files, filetypes
+    def update_frame(self, frame):
+        if not self.with_filetype_stats:
+            add_volume_stats(self.all_files, calc_frame_volume_stats(frame)[0])
+            return
+
+        # The files are grouped by their extension code. With a cap, the
+        # codes beyond the top extensions all go in one extra group, so there
+        # are never more than `top_extensions + 1` VolumeStats.
+        codes = frame.extension_codes
+        extensions = frame.extensions
+        if self.top_extensions is not None and \
+                len(extensions) > self.top_extensions:
+            counts = np.bincount(codes, minlength=len(extensions))
+            ranked = np.argsort(-counts, kind="stable")
+            groups = np.full(len(extensions), self.top_extensions,
+                             dtype=np.int64)
+            groups[ranked[:self.top_extensions]] = \
+                np.arange(self.top_extensions)
+            codes = groups[codes]
+            extensions = [extensions[code]
+                          for code in ranked[:self.top_extensions].tolist()]
+            extensions.append(OTHER_EXTENSIONS)
+
+        # Every file is in exactly one group, so the groups add up to the
+        # statistics of all files.
+        filetype_stats = calc_frame_volume_stats(frame, codes,
+                                                 len(extensions))
+        for stats in filetype_stats:
+            add_volume_stats(self.all_files, stats)
+        for extension, stats in zip(extensions, filetype_stats):
+            if extension in self.filetypes:
+                add_volume_stats(self.filetypes[extension], stats)
+            else:
+                self.filetypes[extension] = stats
+
+    def finish(self):
+        if self.top_extensions is not None:
+            self.filetypes = cap_filetype_stats(self.filetypes,
+                                                self.top_extensions)
+        return self.all_files, self.filetypes
+
+
+def calc_frame_volume_stats(frame: VolumeFrame, groups=None, group_count=1):
+    """ The vectorized version of `VolumeStatsAccumulator.update`.
+        :param groups: The group of each file. Defaults to putting every file
+                       in group 0.
+        :returns a VolumeStats for each group """
+    file_count = len(frame)
+    if groups is None:
+        groups = np.zeros(file_count, dtype=np.int64)
+
+    def count(mask):
+        return np.bincount(groups[mask], minlength=group_count)
+
+    def total(values, mask):
+        # np.add.at instead of a weighted bincount, because the weights of a
+        # bincount are floats and sums of sizes don't always fit in those.
+        totals = np.zeros(group_count, dtype=np.int64)
+        np.add.at(totals, groups[mask], values[mask])
+        return totals
+
+    # NULLs are stored as 0 in a frame, so they're false for the flags just
+    # like None is false in `update`.
+    size = frame["size"]
+    has_size = ~frame.is_null("size")
+    num_blocks = frame["num_blocks"]
+    num_gaps = frame["num_gaps"]
+    has_blocks = (frame["resident"] == 0) & (num_blocks != 0)
+    has_gaps = has_blocks & (num_gaps >= 1)
+
+    backwards_gaps = np.zeros(file_count, dtype=np.int64)
+    if has_gaps.any():
+        block_ranges = frame.block_ranges
+        range_counts = block_ranges.counts()
+        out_of_order_gaps = count_out_of_order_gaps_batch(block_ranges)
+        assert (np.array_equal(range_counts[has_gaps], num_gaps[has_gaps] + 1))
+        backwards_gaps = out_of_order_gaps
+
+    everything = np.ones(file_count, dtype=bool)
+    columns = dict(
+        total_files=count(everything),
+        fraggable_files=count(has_blocks & (num_blocks > 1)),
+        fragmented_files=count(frame["fragmented"] != 0),
+        empty_files=count(has_size & (size == 0)),
+        resident_files=count(frame["resident"] != 0),
+        sparse_files=count(frame["sparse"] != 0),
+        compressed_files=count(frame["fs_compressed"] != 0),
+        hardlinks=count(~frame.is_null("hardlink_id")),
+        files_with_blocks=count(has_blocks),
+        files_without_blocks=count(~has_blocks),
+        total_blocks=total(num_blocks, has_blocks),
+        num_gaps=total(num_gaps, has_gaps),
+        sum_gap_sizes=total(frame["sum_gaps_bytes"], has_gaps),
+        backwards_gaps=total(backwards_gaps, has_gaps),
+        sum_file_sizes=total(size, has_size)
+    )
+    columns = {name: values.tolist() for name, values in columns.items()}
+
+    return [VolumeStats(**{name: values[group]
+                           for name, values in columns.items()})
+            for group in range(group_count)]
+
+
+def calc_various_stats(files):
+    """ Derives VolumeStats from the given collection of files.
+        Return both a VolumeStats for the whole system and a dictionary
+        of VolumeStats for each individual filetype. """
+    return MetricEngine([VolumeStatsAccumulator()]).run(files)[0]
+
+
+def volume_stats_from_aggregates(aggregates: FileAggregates, backwards_gaps):
+    """ Derive the same VolumeStats as `calc_various_stats` from counters that
+        were aggregated inside of SQLite. The amount of backwards gaps can't
+        be counted in SQL, so it has to be given separately. """
+    return VolumeStats(
+        total_files=aggregates.total_files,
+        fraggable_files=aggregates.fraggable_files,
+        fragmented_files=aggregates.fragmented_files,
+        empty_files=aggregates.empty_files,
+        resident_files=aggregates.resident_files,
+        sparse_files=aggregates.sparse_files,
+        compressed_files=aggregates.compressed_files,
+        hardlinks=aggregates.hardlinks,
+        files_with_blocks=aggregates.files_with_blocks,
+        files_without_blocks=
+            aggregates.total_files - aggregates.files_with_blocks,
+        total_blocks=aggregates.total_blocks,
+        num_gaps=aggregates.num_gaps,
+        sum_gap_sizes=aggregates.sum_gap_sizes,
+        backwards_gaps=backwards_gaps,
+        sum_file_sizes=aggregates.sum_file_sizes
+    )
+
+
+class __Tests(unittest.TestCase):
+    def test__filetype_stats(self):
+        columns = ["id", "extension", "size", "blocks", "num_blocks",
+                   "num_gaps", "sum_gaps_bytes", "fragmented", "resident",
+                   "fs_compressed", "sparse", "hardlink_id"]
+        frame = VolumeFrame.from_row_batches([[
+            (1, "txt", 10, "0 - 9", 1, 0, 0, 0, 0, 0, 0, None),
+            (2, "jpg", 20, "20 - 29 10 - 19", 2, 1, 20, 1, 0, 0, 0, None),
+            (3, "txt", 0, None, 0, 0, 0, 0, 1, 0, 0, 7),
+            (4, "exe", 30, "40 - 49", 1, 0, 0, 0, 0, 0, 0, None),
+        ]], columns)
+
+        engine = MetricEngine([VolumeStatsAccumulator()])
+        all_files, filetypes = engine.run(frame.files())[0]
+        self.assertEqual(2, filetypes["txt"].total_files)
+        self.assertEqual(1, filetypes["txt"].resident_files)
+        self.assertEqual(1, filetypes["jpg"].backwards_gaps)
+
+        engine = MetricEngine([VolumeStatsAccumulator()])
+        self.assertEqual((all_files, filetypes), engine.run_frame(frame)[0])
+
+        # Only the extension with the most files is kept...
+        for run in (lambda engine: engine.run(frame.files()),
+                    lambda engine: engine.run_frame(frame)):
+            engine = MetricEngine([VolumeStatsAccumulator(top_extensions=1)])
+            capped = run(engine)[0][1]
+            self.assertEqual({"txt", OTHER_EXTENSIONS}, set(capped))
+            self.assertEqual(2, capped[OTHER_EXTENSIONS].total_files)
+
+        # ...and OTHER_EXTENSIONS is left out when nothing was capped.
+        engine = MetricEngine([VolumeStatsAccumulator(top_extensions=3)])
+        self.assertNotIn(OTHER_EXTENSIONS, engine.run_frame(frame)[0][1])
+        self.assertNotIn(OTHER_EXTENSIONS, filetypes)
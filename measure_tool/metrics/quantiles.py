@@ -0,0 +1,181 @@
+from types import SimpleNamespace
+import numpy as np
+import unittest
+from wildfrag.data import File
+from wildfrag.frame import VolumeFrame
+from metrics.bins import QuantileSketch
+from metrics.engine import Accumulator, MetricEngine
+
+
+# The quantiles that are reported of each sketched metric. For layout scores
+# the tail is at the low end instead, see `estimate_quantile`.
+QUANTILES = [0.5, 0.9, 0.99, 0.999]
+QUANTILE_NAMES = ["p50", "p90", "p99", "p99.9"]
+LOW_QUANTILE_NAMES = ["p50", "p10", "p1", "p0.1"]
+
+# The metrics of which the distribution over the files of a volume is
+# sketched, see `FileQuantilesAccumulator`.
+FILE_SIZE = "file size"
+GAP_SIZE = "gap size"
+GAPS_PER_FILE = "gaps per file"
+FILE_LAYOUT_SCORE = "file layout score"
+SKETCHED_METRICS = [FILE_SIZE, GAP_SIZE, GAPS_PER_FILE, FILE_LAYOUT_SCORE]
+
+# The amount of files that `FileQuantilesAccumulator.update` collects before
+# adding them to the sketches
+UPDATE_BUFFER_SIZE = 10_000
+
+
+def make_sketches():
+    """ :returns an empty QuantileSketch for each of the SKETCHED_METRICS """
+    return {
+        FILE_SIZE: QuantileSketch(integers=True),
+        GAP_SIZE: QuantileSketch(integers=True),
+        GAPS_PER_FILE: QuantileSketch(max_value=2 ** 32, integers=True),
+        # See `estimate_quantile`
+        FILE_LAYOUT_SCORE: QuantileSketch(min_value=1e-6, max_value=1)
+    }
+
+
+def merge_sketches(target: dict, sketches: dict):
+    """ Merge each sketch of `sketches` into the sketch of the same metric in
+        `target`. """
+    for name, sketch in sketches.items():
+        target[name].merge(sketch)
+    return target
+
+
+def get_quantile_names(name):
+    """ The names of the QUANTILES of the given sketched metric """
+    if name == FILE_LAYOUT_SCORE:
+        return LOW_QUANTILE_NAMES
+    return QUANTILE_NAMES
+
+
+def quantile_header():
+    """ The names of the columns of `quantile_row` """
+    return [f"{name} {quantile_name}" for name in SKETCHED_METRICS
+            for quantile_name in get_quantile_names(name)]
+
+
+def estimate_quantile(sketches: dict, name, q):
+    """ Estimate the `q` quantile of one of the SKETCHED_METRICS.
+
+        The badly laid out files are the ones with a low layout score, so for
+        FILE_LAYOUT_SCORE this estimates the `1 - q` quantile instead (see
+        LOW_QUANTILE_NAMES). Most files have a layout score of exactly 1,
+        which a QuantileSketch can only estimate as roughly 1, so its sketch
+        holds `1 - layout score` of which the 0s are counted exactly. """
+    if name == FILE_LAYOUT_SCORE:
+        estimate = sketches[name].quantile(q)
+        return None if estimate is None else 1 - estimate
+    return sketches[name].quantile(q)
+
+
+def quantile_row(sketches: dict):
+    """ The QUANTILES of each of the SKETCHED_METRICS. They're None if there
+        are no sketches, like for volumes that were measured with pushdown. """
+    if len(sketches) == 0:
+        return [None] * len(quantile_header())
+    return [estimate_quantile(sketches, name, q) for name in SKETCHED_METRICS
+            for q in QUANTILES]
+
+
+class FileQuantilesAccumulator(Accumulator):
+    """ Sketches the distribution of the following over the files of a
+        volume, so that their tails can be reported instead of only their
+        means:
+        - FILE_SIZE: The size of each file of which the size is known.
+        - GAP_SIZE: The size of each gap. Only the sum of the gap sizes of
+          each file is stored, so each gap of a file is counted with the
+          average gap size of the file.
+        - GAPS_PER_FILE: The amount of gaps of each file with blocks.
+        - FILE_LAYOUT_SCORE: The layout score (see `calc_layout_score`) of
+          each file with more than one block. See `estimate_quantile`.
+        `finish` returns a dictionary with a QuantileSketch for each. """
+    columns = ["size", "num_blocks", "num_gaps", "sum_gaps_bytes", "resident"]
+
+    def __init__(self):
+        self.sketches = make_sketches()
+        self.buffer = {name: [] for name in SKETCHED_METRICS}
+        self.gap_counts = []
+
+    def update(self, file: File):
+        buffer = self.buffer
+        if file.size is not None:
+            buffer[FILE_SIZE].append(file.size)
+
+        if not file.resident and file.num_blocks:
+            buffer[GAPS_PER_FILE].append(file.num_gaps)
+            if file.num_blocks > 1:
+                buffer[FILE_LAYOUT_SCORE].append(
+                    file.num_gaps / (file.num_blocks - 1)
+                )
+            if file.num_gaps >= 1:
+                buffer[GAP_SIZE].append(file.sum_gaps_bytes / file.num_gaps)
+                self.gap_counts.append(file.num_gaps)
+
+        if len(buffer[FILE_SIZE]) >= UPDATE_BUFFER_SIZE:
+            self.__flush()
+
+    def __flush(self):
+        for name, values in self.buffer.items():
+            weights = self.gap_counts if name == GAP_SIZE else None
+            self.sketches[name].add_many(values, weights)
+            values.clear()
+        self.gap_counts.clear()
+
+    def update_frame(self, frame: VolumeFrame):
+        sketches = self.sketches
+        sketches[FILE_SIZE].add_many(frame["size"][~frame.is_null("size")])
+
+        # NULLs are stored as 0 in a frame, so files without a known amount
+        # of blocks are left out just like in `update`.
+        num_blocks = frame["num_blocks"]
+        num_gaps = frame["num_gaps"]
+        has_blocks = (frame["resident"] == 0) & (num_blocks != 0)
+        sketches[GAPS_PER_FILE].add_many(num_gaps[has_blocks])
+
+        is_fraggable = has_blocks & (num_blocks > 1)
+        sketches[FILE_LAYOUT_SCORE].add_many(
+            num_gaps[is_fraggable] / (num_blocks[is_fraggable] - 1)
+        )
+
+        has_gaps = has_blocks & (num_gaps >= 1)
+        sketches[GAP_SIZE].add_many(
+            frame["sum_gaps_bytes"][has_gaps] / num_gaps[has_gaps],
+            num_gaps[has_gaps]
+        )
+
+    def finish(self):
+        self.__flush()
+        return self.sketches
+
+
+class __Tests(unittest.TestCase):
+    def test__update_frame(self):
+        columns = ["size", "num_blocks", "num_gaps", "sum_gaps_bytes",
+                   "resident"]
+        rows = [(10, 1, 0, 0, 0), (None, 4, 3, 300, 0), (0, 0, 0, 0, 1),
+                (4000, 5, 1, 20, 0)]
+        frame = VolumeFrame.from_row_batches([rows], columns)
+        files = [SimpleNamespace(**dict(zip(columns, row))) for row in rows]
+
+        per_file = MetricEngine([FileQuantilesAccumulator()]).run(files)[0]
+        vectorized = MetricEngine([FileQuantilesAccumulator()]) \
+            .run_frame(frame)[0]
+
+        for name in SKETCHED_METRICS:
+            self.assertEqual(per_file[name].counts.tolist(),
+                             vectorized[name].counts.tolist())
+        self.assertEqual(4, vectorized[GAP_SIZE].count())
+        self.assertEqual(100, vectorized[GAP_SIZE].quantile(0.5))
+        self.assertAlmostEqual(0.75, estimate_quantile(
+            vectorized, FILE_LAYOUT_SCORE, 0.5
+        ), delta=0.01)
+        self.assertAlmostEqual(0.0, estimate_quantile(
+            vectorized, FILE_LAYOUT_SCORE, 0.999
+        ), delta=0.01)
+        row = quantile_row(vectorized)
+        self.assertEqual(10, row[0])
+        self.assertAlmostEqual(4000, row[3], delta=0.01 * 4000)
@@ -0,0 +1,191 @@
+from statistics import NormalDist
+from types import SimpleNamespace
+import math
+import numpy as np
+import unittest
+from wildfrag.data import File
+from wildfrag.frame import VolumeFrame
+from metrics.engine import Accumulator, MetricEngine
+from metrics.out_of_orderness import count_out_of_order_gaps, \
+    count_out_of_order_gaps_batch
+
+
+# How sure a confidence interval is to contain the value of the whole volume
+CONFIDENCE = 0.95
+
+# The ratio metrics that are estimated from a sample of the files, see
+# `SampleRatiosAccumulator`. These are the same as the columns of the main
+# CSV.
+LAYOUT_SCORE = "aggregate layout score"
+AGGREGATE_OOO = "aggregate out of orderness"
+FRAGMENTED_FRACTION = "fragmented fraction"
+RATIO_METRICS = [LAYOUT_SCORE, AGGREGATE_OOO, FRAGMENTED_FRACTION]
+
+
+class RatioMoments:
+    """
+    The sums that are needed to estimate a ratio `sum(y) / sum(x)` over all
+    files of a volume from a random sample of them, and how far off the
+    estimate can be. `x` and `y` are numbers of each sampled file.
+    """
+    n: int
+    sum_x: float
+    sum_y: float
+    sum_xx: float
+    sum_yy: float
+    sum_xy: float
+
+    def __init__(self):
+        self.n = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_yy = 0.0
+        self.sum_xy = 0.0
+
+    def add(self, y, x):
+        self.n += 1
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_yy += y * y
+        self.sum_xy += x * y
+
+    def add_many(self, y, x):
+        y = np.asarray(y, dtype=np.float64)
+        x = np.asarray(x, dtype=np.float64)
+        self.n += len(x)
+        self.sum_x += float(x.sum())
+        self.sum_y += float(y.sum())
+        self.sum_xx += float(np.dot(x, x))
+        self.sum_yy += float(np.dot(y, y))
+        self.sum_xy += float(np.dot(x, y))
+
+    def ratio(self):
+        if self.sum_x == 0:
+            return None
+        return self.sum_y / self.sum_x
+
+    def confidence_interval(self, sample_rate, confidence=CONFIDENCE):
+        """ The analytic confidence interval of the ratio estimator, with the
+            finite population correction for the fraction of the files that
+            was sampled.
+            :returns the lowest and highest value, or None and None if there
+                     are too few files to tell """
+        ratio = self.ratio()
+        if ratio is None or self.n < 2:
+            return None, None
+
+        # The variance of the residuals `y - ratio * x`...
+        residuals = self.sum_yy - 2 * ratio * self.sum_xy \
+            + ratio * ratio * self.sum_xx
+        variance = max(residuals, 0) / (self.n - 1)
+        mean_x = self.sum_x / self.n
+        standard_error = math.sqrt(
+            max(1 - sample_rate, 0) * variance / (self.n * mean_x * mean_x)
+        )
+
+        z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+        return ratio - z * standard_error, ratio + z * standard_error
+
+
+def calc_confidence_intervals(moments: dict, sample_rate,
+                              confidence=CONFIDENCE):
+    """ :param moments: The result of `SampleRatiosAccumulator`
+        :returns the lowest and highest value of each of the RATIO_METRICS """
+    intervals = {name: moments[name].confidence_interval(sample_rate,
+                                                         confidence)
+                 for name in RATIO_METRICS}
+
+    # The moments of the layout score are those of the fraction of blocks
+    # that is fragmented, which is 1 minus the layout score.
+    low, high = intervals[LAYOUT_SCORE]
+    if low is not None:
+        intervals[LAYOUT_SCORE] = (1 - high, 1 - low)
+    return intervals
+
+
+class SampleRatiosAccumulator(Accumulator):
+    """ Collects the RatioMoments of each of the RATIO_METRICS, so that their
+        confidence intervals can be derived when only a sample of the files
+        of a volume was looked at. The ratios are the same as in
+        `VolumeReport`:
+        - LAYOUT_SCORE: 1 - the gaps over the blocks after the first of each
+          file with blocks.
+        - AGGREGATE_OOO: The backwards gaps over the gaps of each file with
+          gaps.
+        - FRAGMENTED_FRACTION: The fragmented files over all files.
+        `finish` returns a dictionary with the RatioMoments of each. """
+    columns = ["blocks", "num_blocks", "num_gaps", "fragmented", "resident"]
+
+    def __init__(self):
+        self.moments = {name: RatioMoments() for name in RATIO_METRICS}
+
+    def update(self, file: File):
+        moments = self.moments
+        moments[FRAGMENTED_FRACTION].add(1 if file.fragmented else 0, 1)
+
+        if not file.resident and file.num_blocks:
+            moments[LAYOUT_SCORE].add(file.num_gaps, file.num_blocks - 1)
+            if file.num_gaps >= 1:
+                moments[AGGREGATE_OOO].add(
+                    count_out_of_order_gaps(file, self.block_ranges(file)),
+                    file.num_gaps
+                )
+
+    def update_frame(self, frame: VolumeFrame):
+        moments = self.moments
+        fragmented = (frame["fragmented"] != 0).astype(np.int64)
+        moments[FRAGMENTED_FRACTION].add_many(fragmented,
+                                              np.ones(len(frame)))
+
+        num_blocks = frame["num_blocks"]
+        num_gaps = frame["num_gaps"]
+        has_blocks = (frame["resident"] == 0) & (num_blocks != 0)
+        moments[LAYOUT_SCORE].add_many(num_gaps[has_blocks],
+                                       num_blocks[has_blocks] - 1)
+
+        has_gaps = has_blocks & (num_gaps >= 1)
+        if has_gaps.any():
+            backwards_gaps = count_out_of_order_gaps_batch(frame.block_ranges)
+            moments[AGGREGATE_OOO].add_many(backwards_gaps[has_gaps],
+                                            num_gaps[has_gaps])
+
+    def finish(self):
+        return self.moments
+
+
+class __Tests(unittest.TestCase):
+    def test__confidence_interval(self):
+        rng = np.random.default_rng(1)
+        x = rng.integers(1, 100, 100_000)
+        y = rng.binomial(x, 0.3)
+        sample = rng.random(len(x)) < 0.01
+
+        moments = RatioMoments()
+        moments.add_many(y[sample], x[sample])
+        low, high = moments.confidence_interval(0.01)
+        self.assertLess(low, y.sum() / x.sum())
+        self.assertGreater(high, y.sum() / x.sum())
+        self.assertLess(high - low, 0.01)
+
+        moments.add_many(y[~sample], x[~sample])
+        low, high = moments.confidence_interval(1.0)
+        self.assertAlmostEqual(low, high)
+
+    def test__update_frame(self):
+        columns = ["blocks", "num_blocks", "num_gaps", "fragmented",
+                   "resident"]
+        rows = [("0 - 9", 1, 0, 0, 0), ("20 - 29 0 - 9 40 - 49", 3, 2, 1, 0),
+                (None, 0, 0, 0, 1), ("50 - 59 70 - 79", 2, 1, 1, 0)]
+        frame = VolumeFrame.from_row_batches([rows], columns)
+        files = [SimpleNamespace(**dict(zip(columns, row))) for row in rows]
+
+        per_file = MetricEngine([SampleRatiosAccumulator()]).run(files)[0]
+        vectorized = MetricEngine([SampleRatiosAccumulator()]) \
+            .run_frame(frame)[0]
+
+        for name in RATIO_METRICS:
+            self.assertEqual(vars(per_file[name]), vars(vectorized[name]))
+        self.assertEqual(1 / 3, vectorized[AGGREGATE_OOO].ratio())
+        self.assertEqual(0.5, vectorized[FRAGMENTED_FRACTION].ratio())
@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from wildfrag.util import get_each_volume
+from wildfrag.wildfrag import WildFrag
+from prefetch import DEFAULT_PREFETCH_MEMORY, prefetch_each_volume
+import profiling
+from profiling import Profiler
+
+
+# The WildFrag connections of a worker process, by database path, extract
+# path and file sample. Each worker process opens its own connections, because SQLite
+# connections can't be shared between processes. They are kept open, because
+# a worker processes many volumes of the same databases.
+__worker_wildfrags = {}
+
+
+def __init_worker(trace_memory):
+    """ :param trace_memory: None if the main process isn't profiling,
+                              otherwise whether its profiler traces memory """
+    if trace_memory is not None:
+        profiling.enable(Profiler(trace_memory))
+
+
+def __get_worker_wildfrag(db_path, extract_path, file_sample):
+    key = (db_path, extract_path, file_sample)
+    if key not in __worker_wildfrags:
+        __worker_wildfrags[key] = WildFrag(
+            db_path, read_only=True, extract_path=extract_path,
+            use_extract=extract_path is not None, file_sample=file_sample
+        )
+    return __worker_wildfrags[key]
+
+
+def __calc_in_worker(calc, db_path, extract_path, file_sample, volume_id,
+                     args):
+    """ :returns the result of calc, and the profiling results of this volume
+                 or None if the worker isn't profiling """
+    wildfrag = __get_worker_wildfrag(db_path, extract_path, file_sample)
+    volume = wildfrag.retrieve_volume(volume_id)
+    with profiling.volume(volume_id):
+        result = calc(wildfrag, volume, *args)
+
+    profiler = profiling.get_profiler()
+    if profiler is None:
+        return result, None
+    return result, profiler.take_results()
+
+
+def __get_no_args(*ignored):
+    return ()
+
+
+def map_each_volume_in_databases(wildfrags, calc, jobs=1,
+                                 get_args=__get_no_args, costs=None,
+                                 skip=None, prefetch_columns=None,
+                                 prefetch_memory=DEFAULT_PREFETCH_MEMORY):
+    """
+    Iterate through all the volumes in the given databases and call
+    `calc(wildfrag, volume, *get_args(wildfrag, volume))` for each of them.
+    This returns the WildFrag of each volume, followed by the same things as
+    `get_each_volume` and the result of calc.
+
+    If `jobs` is more than 1, the volumes are divided over that many processes.
+    `calc` must then be a function at the top level of a module (so it can be
+    pickled) and it is given each process's own WildFrag. The volumes of all
+    databases are divided over the same processes, so that each process stays
+    busy until all databases are done. The databases are returned in the given
+    order, and the volumes of each in the same order as `get_each_volume`, no
+    matter how many jobs are used.
+    :param costs: A dict with how much work each volume id is for each
+                  database path, used to process the largest volumes first.
+                  The costs of databases that are missing from it come from
+                  `WildFrag.retrieve_work_estimates`.
+    :param skip: Is given the WildFrag and the volume, and returns whether
+                 calc should be skipped for it. The result of a skipped volume
+                 is None. Defaults to skipping nothing.
+    :param prefetch_columns: The columns of the Files table that calc reads
+                             through `volume.get_frame`. If given and `jobs`
+                             is 1, the frame of the next volumes is loaded
+                             while calc runs, see `prefetch_each_volume`.
+    :param prefetch_memory: The memory budget of the prefetched frames in
+                            bytes. 0 to not prefetch.
+    """
+    if jobs <= 1:
+        for wildfrag in wildfrags:
+            each_volume = get_each_volume(wildfrag)
+            if prefetch_columns is not None and prefetch_memory > 0:
+                each_volume = prefetch_each_volume(
+                    wildfrag, prefetch_columns, prefetch_memory,
+                    None if skip is None
+                    else lambda volume: skip(wildfrag, volume)
+                )
+
+            for volume, system, device, i_vol, i_sys, i_dev in each_volume:
+                result = None
+                if skip is None or not skip(wildfrag, volume):
+                    with profiling.volume(volume.id):
+                        result = calc(wildfrag, volume,
+                                      *get_args(wildfrag, volume))
+                yield wildfrag, volume, system, device, i_vol, i_sys, i_dev, \
+                    result
+        return
+
+    # Note that this doesn't access `volume.files`, so no files are retrieved.
+    each_volume = []
+    volume_costs = []
+    for wildfrag in wildfrags:
+        database_costs = None
+        if costs is not None:
+            database_costs = costs.get(wildfrag.db_path)
+        if database_costs is None:
+            database_costs = {
+                volume_id: estimate.cost() for volume_id, estimate
+                in wildfrag.retrieve_work_estimates().items()
+            }
+
+        for volume_tuple in get_each_volume(wildfrag):
+            each_volume.append((wildfrag, *volume_tuple))
+            volume_costs.append(database_costs.get(volume_tuple[0].id, 0))
+
+    # Start with the largest volumes, so a single huge volume doesn't end up
+    # being processed on its own after all the other volumes are done.
+    schedule = sorted(range(len(each_volume)), key=lambda i: -volume_costs[i])
+
+    # The workers profile the volumes they process, and send the results back
+    # to be merged into the profiler of this process.
+    profiler = profiling.get_profiler()
+    trace_memory = None
+    if profiler is not None:
+        trace_memory = profiler.trace_memory
+
+    with ProcessPoolExecutor(jobs, initializer=__init_worker,
+                             initargs=(trace_memory,)) as pool:
+        futures = {}
+        for i in schedule:
+            wildfrag, volume = each_volume[i][:2]
+            if skip is None or not skip(wildfrag, volume):
+                extract_path = None
+                if wildfrag.extract is not None:
+                    extract_path = wildfrag.extract.path
+                futures[i] = pool.submit(__calc_in_worker, calc,
+                                         wildfrag.db_path, extract_path,
+                                         wildfrag.file_sample, volume.id,
+                                         get_args(wildfrag, volume))
+
+        for i, volume_tuple in enumerate(each_volume):
+            result = None
+            if i in futures:
+                result, profiling_results = futures.pop(i).result()
+                if profiling_results is not None:
+                    profiler.merge(profiling_results)
+            yield *volume_tuple, result
@@ -0,0 +1,161 @@
+"""
+Loads the files of the next volumes on a separate thread while the current
+volume is being measured, so that reading from SQLite and measuring overlap.
+Reading from SQLite and most of the NumPy work of building a VolumeFrame
+release the GIL, so the loader thread mostly runs while the main thread is
+busy with metrics.
+"""
+
+from collections import deque
+import threading
+import unittest
+
+from wildfrag.util import get_each_volume
+from wildfrag.wildfrag import WildFrag
+import profiling
+
+
+# How many bytes of frames may be waiting in the queue by default
+DEFAULT_PREFETCH_MEMORY = 512 * 1_000_000
+
+
+class PrefetchQueue:
+    """
+    A queue of loaded frames that holds at most `memory_budget` bytes of
+    frames, going by `VolumeFrame.nbytes`. The amount of frames that fit
+    depends on how large they are. A frame that is larger than the whole
+    budget is still let through when the queue is empty, so one huge volume
+    can't stop everything.
+    """
+    memory_budget: int
+
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self.__condition = threading.Condition()
+        self.__items = deque()
+        self.__nbytes = 0
+        self.__closed = False
+
+    def put(self, item, nbytes):
+        """ Wait until the item fits in the budget, then add it.
+            :returns False if the queue was closed instead """
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: self.__closed or len(self.__items) == 0
+                or self.__nbytes + nbytes <= self.memory_budget
+            )
+            if self.__closed:
+                return False
+            self.__items.append((item, nbytes))
+            self.__nbytes += nbytes
+            self.__condition.notify_all()
+            return True
+
+    def get(self):
+        """ Wait for the next item and remove it. """
+        with self.__condition:
+            self.__condition.wait_for(lambda: len(self.__items) != 0)
+            item, nbytes = self.__items.popleft()
+            self.__nbytes -= nbytes
+            self.__condition.notify_all()
+            return item
+
+    def close(self):
+        """ Make the waiting and future calls to `put` give up. """
+        with self.__condition:
+            self.__closed = True
+            self.__items.clear()
+            self.__nbytes = 0
+            self.__condition.notify_all()
+
+
+def __load_frames(wildfrag: WildFrag, volume_ids, column_names,
+                  queue: PrefetchQueue):
+    """ The loader thread: load the frame of each volume id in order and put
+        it in the queue. An exception is put in the queue instead, so that
+        it's raised on the main thread. """
+    try:
+        # SQLite connections can only be used by the thread that made them.
+        loader_wildfrag = wildfrag.open_copy()
+    except Exception as exception:
+        queue.put(exception, 0)
+        return
+
+    for volume_id in volume_ids:
+        try:
+            with profiling.prefetched(volume_id):
+                volume = loader_wildfrag.retrieve_volume(volume_id)
+                frame = volume.get_frame(column_names)
+        except Exception as exception:
+            queue.put(exception, 0)
+            break
+        if not queue.put(frame, frame.nbytes()):
+            break
+    loader_wildfrag.connection.close()
+
+
+def prefetch_each_volume(wildfrag: WildFrag, column_names=None,
+                         memory_budget=DEFAULT_PREFETCH_MEMORY, skip=None):
+    """ Iterate through all the volumes in the given database like
+        `get_each_volume`, but with the frame of each volume already loaded
+        by a loader thread with its own connection. The loader thread works
+        ahead for as many volumes as fit in the memory budget.
+
+        `volume.get_frame(column_names)` returns the loaded frame, and the
+        files are still loaded on demand if anything else is accessed.
+        :param column_names: The columns of the Files table to load, see
+                             `WildFrag.retrieve_frame`.
+        :param memory_budget: How many bytes of frames may be waiting in the
+                              queue, not counting the frame that is being
+                              used.
+        :param skip: Is given each volume, and returns whether its frame
+                     shouldn't be loaded. """
+    # Retrieving the volumes themselves is quick, and the loader thread needs
+    # to know which volumes to load.
+    each_volume = list(get_each_volume(wildfrag))
+    is_loaded = [skip is None or not skip(volume)
+                 for volume, *_ in each_volume]
+    volume_ids = [volume.id for (volume, *_), loaded
+                  in zip(each_volume, is_loaded) if loaded]
+
+    queue = PrefetchQueue(memory_budget)
+    loader = threading.Thread(
+        target=__load_frames, args=(wildfrag, volume_ids, column_names, queue),
+        name="prefetch", daemon=True
+    )
+    loader.start()
+
+    try:
+        for volume_tuple, loaded in zip(each_volume, is_loaded):
+            volume = volume_tuple[0]
+            if loaded:
+                frame = queue.get()
+                if isinstance(frame, Exception):
+                    raise frame
+                volume.frame = frame
+            yield volume_tuple
+            volume.release_files()
+    finally:
+        # Also stop the loader if the caller stops iterating early.
+        queue.close()
+        loader.join()
+
+
+class __Tests(unittest.TestCase):
+    def test__queue_budget(self):
+        queue = PrefetchQueue(100)
+        self.assertTrue(queue.put("a", 60))
+        put_b = threading.Thread(target=queue.put, args=("b", 60))
+        put_b.start()
+        put_b.join(0.05)
+        self.assertTrue(put_b.is_alive())  # It doesn't fit next to "a"
+
+        self.assertEqual("a", queue.get())
+        put_b.join()
+        self.assertTrue(queue.put("c", 40))
+        self.assertEqual(["b", "c"], [queue.get(), queue.get()])
+
+        # A single item larger than the budget still fits in an empty queue.
+        self.assertTrue(queue.put("d", 1000))
+        queue.close()
+        self.assertFalse(queue.put("e", 1))
@@ -0,0 +1,309 @@
+"""
+Measures where the time of a run goes. Code that does something expensive
+wraps it in `stage(name)`, and each volume is wrapped in `volume(volume_id)`.
+Both do nothing unless a Profiler was enabled with `enable`, so they can be
+left in place permanently.
+
+Stages don't count the time spent in stages nested inside of them, so the
+stage times of a run add up to (at most) its total time. Stages are nested
+per thread, so the stages of a loader thread (see `prefetch.py`) are added
+to the same totals without getting mixed up with those of the main thread.
+A loader thread wraps the loading of each volume in `prefetched(volume_id)`,
+so that its work ends up in the record of that volume.
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+import tracemalloc
+import unittest
+
+# The resource module only exists on Unix-like systems.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# The names of the stages, so they're spelled the same everywhere
+STAGE_FETCH = "sqlite fetch"
+STAGE_EXTRACT = "extract loading"
+STAGE_FILES = "file construction"
+STAGE_FRAME = "frame construction"
+STAGE_PARSE = "block parsing"
+STAGE_METRICS = "metrics"
+STAGE_OUTPUT = "output"
+
+
+def get_peak_rss():
+    """ :returns the peak resident set size of this process in bytes, or None
+                 if that can't be determined on this system """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Profiler:
+    """ Collects the time spent in each stage and statistics about each
+        volume. See `summary` for what is collected. """
+    stage_seconds: dict
+    volumes: list
+
+    def __init__(self, trace_memory=False):
+        """ :param trace_memory: Whether to trace memory allocations with
+                                 tracemalloc, which makes everything slower """
+        self.trace_memory = trace_memory
+        self.stage_seconds = {}
+        self.volumes = []
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        # The stage times and rows of each volume that a loader thread
+        # loaded, until the volume itself is measured
+        self.__prefetched = {}
+
+    def __get_local(self):
+        """ The stages that the current thread is in, and the stage times and
+            rows of the current thread alone """
+        local = self.__local
+        if not hasattr(local, "stack"):
+            local.stack = []
+            local.stage_seconds = {}
+            local.rows = 0
+        return local
+
+    def __get_stack(self):
+        return self.__get_local().stack
+
+    @contextmanager
+    def stage(self, name):
+        stack = self.__get_stack()
+        # Pause the stage that this one is nested in...
+        now = time.perf_counter()
+        if len(stack) != 0:
+            self.__add_time(stack[-1], now)
+        stack.append([name, now])
+
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.__add_time(stack.pop(), now)
+            # ...and resume it.
+            if len(stack) != 0:
+                stack[-1][1] = now
+
+    def __add_time(self, entry, now):
+        name, since = entry
+        local_seconds = self.__get_local().stage_seconds
+        local_seconds[name] = local_seconds.get(name, 0) + (now - since)
+        with self.__lock:
+            self.stage_seconds[name] = \
+                self.stage_seconds.get(name, 0) + (now - since)
+        entry[1] = now
+
+    def count_rows(self, amount):
+        """ Record that this many rows were read. """
+        self.__get_local().rows += amount
+        with self.__lock:
+            self.rows += amount
+
+    @contextmanager
+    def __thread_delta(self):
+        """ Measure the stage times and rows of the current thread alone.
+            :returns a dict that is filled with the changes on exit """
+        local = self.__get_local()
+        stage_seconds = dict(local.stage_seconds)
+        rows = local.rows
+        delta = {}
+
+        yield delta
+
+        delta["rows"] = local.rows - rows
+        delta["stage_seconds"] = {
+            name: seconds - stage_seconds.get(name, 0)
+            for name, seconds in local.stage_seconds.items()
+        }
+
+    @contextmanager
+    def prefetched(self, volume_id):
+        """ Measure the work of a loader thread that loads the given volume
+            ahead of time. It's added to the record of that volume. """
+        with self.__thread_delta() as delta:
+            yield
+        with self.__lock:
+            self.__prefetched[volume_id] = delta
+
+    @contextmanager
+    def volume(self, volume_id):
+        start = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        with self.__thread_delta() as delta:
+            yield
+
+        seconds = time.perf_counter() - start
+        with self.__lock:
+            prefetched = self.__prefetched.pop(volume_id, None)
+        rows = delta["rows"]
+        if prefetched is not None:
+            rows += prefetched["rows"]
+
+        def stage_delta(name):
+            stage_seconds = delta["stage_seconds"].get(name, 0)
+            if prefetched is not None:
+                stage_seconds += prefetched["stage_seconds"].get(name, 0)
+            return stage_seconds
+
+        record = {
+            "volume_id": volume_id,
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds if seconds != 0 else None,
+            "fetch_seconds": stage_delta(STAGE_FETCH),
+            "parse_seconds": stage_delta(STAGE_PARSE),
+            "metric_seconds": stage_delta(STAGE_METRICS),
+            "peak_rss_bytes": get_peak_rss()
+        }
+        if self.trace_memory:
+            record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            record["top_allocations"] = self.__top_allocations()
+        self.volumes.append(record)
+
+    @staticmethod
+    def __top_allocations(amount=5):
+        snapshot = tracemalloc.take_snapshot()
+        return [{"location": str(statistic.traceback),
+                 "bytes": statistic.size}
+                for statistic in snapshot.statistics("lineno")[:amount]]
+
+    def take_results(self):
+        """ Return the stage times and volume records collected so far, and
+            start over. Used to send the results of a worker process to the
+            main process, which adds them to its own with `merge`. """
+        results = (self.stage_seconds, self.volumes, self.rows)
+        self.stage_seconds = {}
+        self.volumes = []
+        self.rows = 0
+        return results
+
+    def merge(self, results):
+        stage_seconds, volumes, rows = results
+        for name, seconds in stage_seconds.items():
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0) + seconds
+        self.volumes += volumes
+        self.rows += rows
+
+    def summary(self):
+        """ :returns a dict that can be written as JSON """
+        total_seconds = time.perf_counter() - self.start
+        # With several processes or a loader thread the stage times can add
+        # up to more than the total time, so "other" can be negative.
+        with self.__lock:
+            stage_seconds = dict(self.stage_seconds)
+        other = total_seconds - sum(stage_seconds.values())
+
+        peak_rss_children = None
+        if resource is not None:
+            peak_rss_children = resource.getrusage(
+                resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+        return {
+            "total_seconds": total_seconds,
+            "stage_seconds": {**stage_seconds, "other": other},
+            "rows": self.rows,
+            "peak_rss_bytes": get_peak_rss(),
+            "peak_rss_bytes_of_worker_processes": peak_rss_children,
+            "volumes": self.volumes
+        }
+
+
+# The profiler that `stage`, `volume` and `count_rows` report to
+__profiler = None
+
+
+def enable(profiler: Profiler):
+    global __profiler
+    __profiler = profiler
+
+
+def get_profiler():
+    """ :returns the enabled Profiler, or None """
+    return __profiler
+
+
+@contextmanager
+def stage(name):
+    if __profiler is None:
+        yield
+    else:
+        with __profiler.stage(name):
+            yield
+
+
+@contextmanager
+def volume(volume_id):
+    if __profiler is None:
+        yield
+    else:
+        with __profiler.volume(volume_id):
+            yield
+
+
+@contextmanager
+def prefetched(volume_id):
+    if __profiler is None:
+        yield
+    else:
+        with __profiler.prefetched(volume_id):
+            yield
+
+
+def count_rows(amount):
+    if __profiler is not None:
+        __profiler.count_rows(amount)
+
+
+class __Tests(unittest.TestCase):
+    def test__nested_stages(self):
+        profiler = Profiler()
+        with profiler.volume(1):
+            with profiler.stage("outer"):
+                time.sleep(0.02)
+                with profiler.stage("inner"):
+                    time.sleep(0.02)
+                profiler.count_rows(10)
+
+        self.assertLess(profiler.stage_seconds["outer"], 0.035)
+        self.assertGreater(profiler.stage_seconds["inner"], 0.015)
+        self.assertEqual(10, profiler.volumes[0]["rows"])
+
+    def test__prefetched_volume(self):
+        profiler = Profiler()
+
+        def load():
+            with profiler.prefetched(2):
+                with profiler.stage(STAGE_FETCH):
+                    profiler.count_rows(5)
+
+        loader = threading.Thread(target=load)
+        loader.start()
+        loader.join()
+        with profiler.volume(1):
+            profiler.count_rows(1)
+        with profiler.volume(2):
+            with profiler.stage(STAGE_METRICS):
+                profiler.count_rows(2)
+
+        self.assertEqual([1, 7], [record["rows"]
+                                  for record in profiler.volumes])
+        self.assertEqual(0, profiler.volumes[0]["fetch_seconds"])
+        self.assertGreater(profiler.volumes[1]["fetch_seconds"], 0)
+        self.assertEqual(8, profiler.rows)
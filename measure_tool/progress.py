@@ -0,0 +1,127 @@
+import io
+import sys
+import time
+import unittest
+
+from wildfrag.data import WorkEstimate
+
+
+# How often the progress line is redrawn, in seconds
+PROGRESS_INTERVAL = 1.0
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+class ProgressReporter:
+    """
+    Keeps a single progress line up to date on a terminal while volumes are
+    being measured. The line shows how many volumes are done, how many files
+    and how many bytes of `blocks` text are processed per second, and how
+    long the rest of the run will take.
+
+    The amounts of files and bytes come from the WorkEstimates of the
+    volumes, so the line only changes when a volume is done. The remaining
+    time is extrapolated from the estimated cost of the remaining volumes.
+    """
+    def __init__(self, estimates: dict, volume_count, stream=sys.stderr,
+                 interval=PROGRESS_INTERVAL):
+        """ :param estimates: A WorkEstimate for each volume, by any key that
+                              identifies the volume
+            :param volume_count: The amount of volumes that will be reported
+                                 as done, including skipped volumes """
+        self.estimates = estimates
+        self.volume_count = volume_count
+        self.stream = stream
+        self.interval = interval
+
+        self.volumes_done = 0
+        self.files_done = 0
+        self.block_bytes_done = 0
+        self.cost_done = 0
+        self.cost_left = sum(estimate.cost() for estimate in estimates.values())
+        self.start = time.perf_counter()
+        self.last_print = None
+
+    def volume_done(self, key, skipped=False):
+        """ Record that a volume is done.
+            :param key: The key of the volume in the estimates
+            :param skipped: Whether the volume was skipped instead of measured,
+                            so it doesn't count towards the speed. """
+        estimate = self.estimates.get(key, WorkEstimate(None))
+        self.volumes_done += 1
+        self.cost_left -= estimate.cost()
+        if not skipped:
+            self.files_done += estimate.files
+            self.block_bytes_done += estimate.block_bytes
+            self.cost_done += estimate.cost()
+
+        now = time.perf_counter()
+        if self.last_print is None or now - self.last_print >= self.interval:
+            self.__print_line(now)
+
+    def __print_line(self, now):
+        self.last_print = now
+        # \r returns to the start of the line, so the line is overwritten.
+        self.stream.write(f"\r{self.format_line(now - self.start)}\033[K")
+        self.stream.flush()
+
+    def format_line(self, seconds):
+        files_per_second = 0
+        bytes_per_second = 0
+        if seconds > 0:
+            files_per_second = self.files_done / seconds
+            bytes_per_second = self.block_bytes_done / seconds
+
+        eta = "?"
+        if self.cost_done > 0:
+            eta = format_duration(
+                seconds * max(self.cost_left, 0) / self.cost_done
+            )
+
+        return f"Volume {self.volumes_done}/{self.volume_count}, " + \
+               f"{files_per_second:,.0f} files/s, " + \
+               f"{bytes_per_second / 1_000_000:,.1f} MB/s of blocks, " + \
+               f"ETA {eta}"
+
+    def finish(self):
+        """ Print the final progress line, and end it so that later output
+            starts on a new line. """
+        self.__print_line(time.perf_counter())
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+def report_progress(each_volume, estimates: dict, volume_count,
+                    stream=sys.stderr):
+    """ Pass through the tuples of `map_each_volume_in_databases`, while
+        keeping a progress line up to date. A volume whose result is None
+        counts as skipped.
+        :param estimates: A WorkEstimate for each (database path, volume id) """
+    reporter = ProgressReporter(estimates, volume_count, stream)
+    for volume_tuple in each_volume:
+        wildfrag, volume = volume_tuple[:2]
+        reporter.volume_done((wildfrag.db_path, volume.id),
+                             volume_tuple[-1] is None)
+        yield volume_tuple
+    reporter.finish()
+
+
+class __Tests(unittest.TestCase):
+    def test__volume_done(self):
+        stream = io.StringIO()
+        reporter = ProgressReporter(
+            {1: WorkEstimate(1, 100, 1000), 2: WorkEstimate(2, 300, 3000)},
+            2, stream, interval=float("inf")
+        )
+        reporter.volume_done(1)
+        self.assertIn("Volume 1/2", stream.getvalue())
+        self.assertTrue(reporter.format_line(10).endswith("ETA 0:00:30"))
+        self.assertIn("10 files/s", reporter.format_line(10))
+
+        reporter.volume_done(2, skipped=True)
+        reporter.finish()
+        self.assertIn("Volume 2/2", stream.getvalue())
+        self.assertTrue(stream.getvalue().endswith("\n"))
@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import tempfile
+from dataclasses import asdict
+import unittest
+
+from metrics.bins import QuantileSketch
+from metrics.percentage_stats import VolumeStats
+from volume_report import METRIC_VERSION
+
+
+def default_result_store_path(db_path):
+    return f"{db_path}.results"
+
+
+class ResultStore:
+    """
+    A small SQLite database that remembers the CSV rows of each volume between
+    runs. A stored row stays valid as long as the files of its volume and the
+    metrics haven't changed, so an interrupted run can pick up where it left
+    off, and a run after new systems were added only measures the new volumes.
+
+    Each row is stored with a fingerprint of the files of its volume (see
+    `WildFrag.retrieve_file_fingerprints`) and the METRIC_VERSION.
+
+    The quantile sketches of each volume are kept in a table of their own, so
+    that stores that were created before there were sketches can still be
+    opened.
+    """
+    path: str
+    connection = None
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS VolumeResults(
+                volume_id INTEGER PRIMARY KEY,
+                file_count INT,
+                max_file_id INT,
+                metric_version INT,
+                main_row TEXT,
+                general_stats TEXT
+            );""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS VolumeSketches(
+                volume_id INTEGER PRIMARY KEY,
+                sketches TEXT
+            );""")
+        self.connection.commit()
+
+    def is_up_to_date(self, volume_id, fingerprint):
+        """ Check whether the stored results of a volume were derived from
+            files with the given fingerprint by the current metrics. """
+        row = self.connection.execute(
+            "SELECT file_count, max_file_id, metric_version " +
+            "FROM VolumeResults WHERE volume_id = ?;", (volume_id,)
+        ).fetchone()
+        return row is not None and \
+            tuple(row) == (*fingerprint, METRIC_VERSION)
+
+    def store(self, volume_id, fingerprint, main_row, general_stats,
+              sketches=None):
+        """ Store the results of a volume, replacing any older results.
+            This commits right away, so nothing is lost if the run is
+            interrupted afterwards.
+            :param sketches: The QuantileSketches of the volume by name """
+        file_count, max_file_id = fingerprint
+        self.connection.execute(
+            "INSERT OR REPLACE INTO VolumeResults VALUES (?, ?, ?, ?, ?, ?);",
+            (volume_id, file_count, max_file_id, METRIC_VERSION,
+             json.dumps(main_row), json.dumps(asdict(general_stats)))
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO VolumeSketches VALUES (?, ?);",
+            (volume_id, json.dumps({name: sketch.to_dict() for name, sketch
+                                    in (sketches or {}).items()}))
+        )
+        self.connection.commit()
+
+    def load(self, volume_id):
+        """ :returns the stored main CSV row, VolumeStats and QuantileSketches
+                     of a volume """
+        main_row, general_stats, sketches = self.connection.execute(
+            "SELECT main_row, general_stats, sketches FROM VolumeResults " +
+            "LEFT JOIN VolumeSketches USING (volume_id) " +
+            "WHERE volume_id = ?;", (volume_id,)
+        ).fetchone()
+        sketches = {name: QuantileSketch.from_dict(values) for name, values
+                    in json.loads(sketches or "{}").items()}
+        return json.loads(main_row), VolumeStats(**json.loads(general_stats)), \
+            sketches
+
+    def close(self):
+        self.connection.close()
+
+
+class __Tests(unittest.TestCase):
+    def test__store(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = ResultStore(f"{folder}/results")
+            self.assertFalse(store.is_up_to_date(1, (10, 25)))
+
+            main_row = [1, 2, 3, True, "ntfs", 0.5, None, 0.1]
+            sketch = QuantileSketch()
+            sketch.add_many([1, 10, 100])
+            store.store(1, (10, 25), main_row, VolumeStats(total_files=10),
+                        {"size": sketch})
+            store.close()
+
+            store = ResultStore(f"{folder}/results")
+            self.assertTrue(store.is_up_to_date(1, (10, 25)))
+            self.assertFalse(store.is_up_to_date(1, (11, 26)))
+            loaded_row, loaded_stats, loaded_sketches = store.load(1)
+            self.assertEqual((main_row, VolumeStats(total_files=10)),
+                             (loaded_row, loaded_stats))
+            self.assertEqual(sketch.counts.tolist(),
+                             loaded_sketches["size"].counts.tolist())
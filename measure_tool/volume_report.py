@@ -0,0 +1,235 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from wildfrag.data import FileAggregates, Volume
+from wildfrag.util import parse_block_ranges_batch
+from metrics.engine import MetricEngine
+from metrics.internal_fragmentation import AvgInternalFragAccumulator
+from metrics.out_of_orderness import AvgOutOfOrdernessAccumulator, \
+    count_out_of_order_gaps_batch
+from metrics.percentage_stats import VolumeStats, VolumeStatsAccumulator, \
+    volume_stats_from_aggregates
+from metrics.quantiles import FileQuantilesAccumulator
+from metrics.sample_ratios import SampleRatiosAccumulator, \
+    calc_confidence_intervals
+from parallel import map_each_volume_in_databases
+from prefetch import DEFAULT_PREFETCH_MEMORY
+import profiling
+
+
+# Bump this whenever a change to the metrics changes the contents of a
+# VolumeReport, so that results in a ResultStore are derived again.
+METRIC_VERSION = 3
+
+@dataclass
+class VolumeReport:
+    """ All statistics that are derived from the files of a single volume.
+        This is what `print_statistics` and `generate_csv_files` output for
+        each volume. """
+    volume_id: int
+    fs_type: str
+    size_in_GB: float
+    used_space_in_GB: float
+    fullness: float
+    layout_score: float
+    aggregate_ooo: float
+    gap_size_avg: float
+    normalized_gap_size_avg: float
+    avg_internal_frag: float
+    average_ooo: float
+    general_stats: VolumeStats
+    filetype_stats: dict = field(default_factory=dict)
+    # A QuantileSketch of each of the SKETCHED_METRICS, see
+    # `FileQuantilesAccumulator`. Empty for reports derived with pushdown.
+    sketches: dict = field(default_factory=dict)
+    # The fraction of the files of the volume that the report was derived
+    # from, if only a sample of the files was looked at. The counts of
+    # `general_stats` are then of the sampled files only.
+    sample_rate: float = None
+    # The confidence interval of each of the RATIO_METRICS, as the lowest and
+    # highest value. Only for reports derived from a sample.
+    confidence_intervals: dict = field(default_factory=dict)
+
+
+def calc_aggregate_layout_score_2(stats: VolumeStats):
+    # Note: `_2` to prevent collision with the function in `layout_score.py`
+    if stats.total_blocks <= stats.files_with_blocks:
+        return 1
+    return 1.0 - (stats.num_gaps / (stats.total_blocks - stats.files_with_blocks))
+
+
+def calc_aggregate_out_of_orderness(stats: VolumeStats):
+    if stats.num_gaps == 0:
+        return 0
+    return stats.backwards_gaps / stats.num_gaps
+
+
+def derive_fullness(volume):
+    # We used to estimate the fullness when volume.used was None, but the
+    # estimates turned out to be rather inaccurate (4 GB inaccurate on average)
+    assert volume.used is not None
+    return volume.used / volume.size
+
+
+def __make_engine(with_filetype_stats, top_extensions, is_sampled):
+    # All metrics that need to look at individual files are derived in a
+    # single pass over the files...
+    engine = MetricEngine([VolumeStatsAccumulator(with_filetype_stats,
+                                                  top_extensions),
+                           AvgOutOfOrdernessAccumulator(),
+                           AvgInternalFragAccumulator(),
+                           FileQuantilesAccumulator()])
+    # ...and when the files are a sample, so is how far off the ratios can be.
+    if is_sampled:
+        engine.register(SampleRatiosAccumulator())
+    return engine
+
+
+def get_report_columns(with_filetype_stats=True, is_sampled=False):
+    """ :returns the columns of the Files table that `calc_volume_report`
+                 reads """
+    return __make_engine(with_filetype_stats, None, is_sampled).columns()
+
+
+def calc_volume_report(volume: Volume, with_filetype_stats=True,
+                       top_extensions=None):
+    """ Derive all statistics of a single volume.
+        :param top_extensions: See `VolumeStatsAccumulator`. """
+    engine = __make_engine(with_filetype_stats, top_extensions,
+                           volume.sample_rate is not None)
+    # Only the columns that these metrics read are retrieved...
+    frame = volume.get_frame(engine.columns())
+    (general_stats, filetype_stats), average_ooo, avg_internal_frag, \
+        sketches, *sample_moments = engine.run_frame(frame)
+
+    if not with_filetype_stats:
+        filetype_stats = {}
+
+    report = __derive_volume_report(volume, general_stats, filetype_stats,
+                                    average_ooo, avg_internal_frag, sketches)
+    if volume.sample_rate is not None:
+        report.sample_rate = volume.sample_rate
+        report.confidence_intervals = calc_confidence_intervals(
+            sample_moments[0], volume.sample_rate
+        )
+    return report
+
+
+def calc_volume_report_pushdown(wildfrag, volume: Volume,
+                                aggregates: FileAggregates):
+    """ Derive the same statistics as `calc_volume_report`, but from counters
+        that were aggregated inside of SQLite. The only files that are
+        retrieved are the ones with gaps, because their backwards gaps can't
+        be counted in SQL. Filetype statistics and quantile sketches are not
+        available this way. """
+    backwards_gaps = 0
+
+    for rows in wildfrag.retrieve_gapped_blocks(volume.id):
+        blocks, num_gaps = zip(*rows)
+        with profiling.stage(profiling.STAGE_PARSE):
+            block_ranges = parse_block_ranges_batch(blocks)
+        assert (np.array_equal(block_ranges.counts(), np.add(num_gaps, 1)))
+        backwards_gaps += int(count_out_of_order_gaps_batch(block_ranges).sum())
+
+    general_stats = volume_stats_from_aggregates(aggregates, backwards_gaps)
+
+    average_ooo = 0
+    if aggregates.files_with_multiple_gaps != 0:
+        average_ooo = aggregates.sum_ooo / aggregates.files_with_multiple_gaps
+
+    avg_internal_frag = 0
+    if aggregates.files_with_multiple_blocks != 0:
+        avg_internal_frag = \
+            aggregates.sum_internal_frag / aggregates.files_with_multiple_blocks
+
+    return __derive_volume_report(volume, general_stats, {},
+                                  average_ooo, avg_internal_frag)
+
+
+def __derive_volume_report(volume: Volume, general_stats, filetype_stats,
+                           average_ooo, avg_internal_frag, sketches=None):
+    size_in_GB = volume.size / 1_000_000_000
+
+    used_space_in_GB = None
+    fullness = None
+    if volume.used is not None:
+        used_space_in_GB = volume.used / 1_000_000_000
+        fullness = derive_fullness(volume)
+
+    layout_score = calc_aggregate_layout_score_2(general_stats)
+    aggregate_ooo = calc_aggregate_out_of_orderness(general_stats)
+
+    gap_size_avg = 0
+    if general_stats.num_gaps != 0:
+        gap_size_avg = general_stats.sum_gap_sizes / general_stats.num_gaps
+
+    assert volume.size != 0
+    normalized_gap_size_avg = gap_size_avg / volume.size
+
+    return VolumeReport(volume.id, volume.fs_type, size_in_GB,
+                        used_space_in_GB, fullness, layout_score,
+                        aggregate_ooo, gap_size_avg, normalized_gap_size_avg,
+                        avg_internal_frag, average_ooo, general_stats,
+                        filetype_stats, sketches or {})
+
+
+def __calc_report(wildfrag, volume, with_filetype_stats, top_extensions,
+                  aggregates):
+    if aggregates is not None:
+        return calc_volume_report_pushdown(wildfrag, volume, aggregates)
+    return calc_volume_report(volume, with_filetype_stats, top_extensions)
+
+
+def get_each_volume_report_in_databases(wildfrags, jobs=1,
+                                        with_filetype_stats=True,
+                                        pushdown=False, skip=None, costs=None,
+                                        top_extensions=None,
+                                        prefetch_memory=DEFAULT_PREFETCH_MEMORY):
+    """ Iterate through all the volumes in the given databases and derive a
+        VolumeReport for each of them.
+        This returns the same things as `map_each_volume_in_databases`, with
+        the report as the result. The volumes are always returned in the same
+        order, no matter how many jobs are used.
+        :param pushdown: Whether to use `calc_volume_report_pushdown`, which
+                         can't derive filetype statistics.
+        :param skip: Is given the WildFrag and the volume, and returns whether
+                     the volume should be skipped. The report of a skipped
+                     volume is None.
+        :param costs: See `map_each_volume_in_databases`.
+        :param top_extensions: See `VolumeStatsAccumulator`.
+        :param prefetch_memory: The memory budget of the frames that are
+                                loaded ahead in bytes, see
+                                `map_each_volume_in_databases`. """
+    all_aggregates = {}
+    if pushdown:
+        assert (not with_filetype_stats)
+        costs = dict(costs or {})
+        for wildfrag in wildfrags:
+            aggregates = wildfrag.retrieve_file_aggregates()
+            all_aggregates[wildfrag.db_path] = aggregates
+            costs.setdefault(wildfrag.db_path, {
+                volume_id: volume_aggregates.total_files
+                for volume_id, volume_aggregates in aggregates.items()
+            })
+
+    def get_args(wildfrag, volume):
+        aggregates = None
+        if wildfrag.db_path in all_aggregates:
+            aggregates = all_aggregates[wildfrag.db_path].get(
+                volume.id, FileAggregates(volume.id)
+            )
+        return with_filetype_stats, top_extensions, aggregates
+
+    # Pushdown doesn't load the frames of the volumes, so there's nothing to
+    # prefetch.
+    prefetch_columns = None
+    if not pushdown:
+        prefetch_columns = get_report_columns(
+            with_filetype_stats,
+            any(wildfrag.file_sample is not None for wildfrag in wildfrags)
+        )
+
+    return map_each_volume_in_databases(wildfrags, __calc_report, jobs,
+                                        get_args, costs, skip,
+                                        prefetch_columns, prefetch_memory)
@@ -0,0 +1,172 @@
+"""
+An extract is a copy of the Files table of a PriFiwalk database, stored as one
+NumPy array per column so it can be memory-mapped. It looks like this:
+
+    <extract>/manifest.json
+    <extract>/volume_<id>/<column>.npy       For each column in NUMERIC_COLUMNS
+    <extract>/volume_<id>/<column>.null.npy  Only for columns containing NULLs
+    <extract>/volume_<id>/extension.npy      Index into extensions.json
+    <extract>/volume_<id>/extensions.json
+    <extract>/volume_<id>/block_starts.npy   The normalized block ranges, as in
+    <extract>/volume_<id>/block_ends.npy     `BlockRanges`
+    <extract>/volume_<id>/block_offsets.npy
+
+The manifest remembers the size and modification time of the database, so that
+an outdated extract is not used.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+from wildfrag.frame import NUMERIC_COLUMNS, VolumeFrame
+from wildfrag.util import BlockRanges
+
+
+# Bump this whenever the layout of an extract changes.
+EXTRACT_VERSION = 1
+
+
+def default_extract_path(db_path):
+    return f"{db_path}.extract"
+
+
+def describe_database(db_path):
+    """ The things an extract is keyed by. """
+    stat = os.stat(db_path)
+    return {
+        "version": EXTRACT_VERSION,
+        "db_path": os.path.abspath(db_path),
+        "db_size": stat.st_size,
+        "db_mtime_ns": stat.st_mtime_ns
+    }
+
+
+def is_extract_fresh(extract_path, db_path):
+    """ Check whether the extract exists and was made from the database as it
+        is right now. """
+    manifest_path = f"{extract_path}/manifest.json"
+    if not os.path.isfile(manifest_path):
+        return False
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    return manifest["database"] == describe_database(db_path)
+
+
+def compile_extract(wildfrag, extract_path, batch_size=100_000):
+    """ Convert the Files table of the given database into an extract. """
+    # Build the extract in a temporary folder first, so an interrupted
+    # compilation never leaves a half-finished extract behind.
+    temp_path = f"{extract_path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    volume_ids = []
+    for (volume_id,) in wildfrag.retrieve_volume_ids().fetchall():
+        frame = VolumeFrame.from_row_batches(
+            wildfrag.retrieve_file_rows(volume_id, batch_size)
+        )
+        __write_volume(f"{temp_path}/volume_{volume_id}", frame)
+        volume_ids.append(volume_id)
+
+    with open(f"{temp_path}/manifest.json", 'w') as manifest_file:
+        json.dump({"database": describe_database(wildfrag.db_path),
+                   "volumes": volume_ids}, manifest_file, indent=4)
+
+    shutil.rmtree(extract_path, ignore_errors=True)
+    os.rename(temp_path, extract_path)
+
+
+def __write_volume(volume_path, frame: VolumeFrame):
+    os.makedirs(volume_path)
+
+    for name in NUMERIC_COLUMNS:
+        np.save(f"{volume_path}/{name}.npy", frame[name])
+        if name in frame.nulls:
+            np.save(f"{volume_path}/{name}.null.npy", frame.nulls[name])
+
+    np.save(f"{volume_path}/extension.npy", frame.extension_codes)
+    with open(f"{volume_path}/extensions.json", 'w') as extensions_file:
+        json.dump(frame.extensions, extensions_file)
+
+    block_ranges = frame.block_ranges
+    np.save(f"{volume_path}/block_starts.npy", block_ranges.starts)
+    np.save(f"{volume_path}/block_ends.npy", block_ranges.ends)
+    np.save(f"{volume_path}/block_offsets.npy", block_ranges.offsets)
+
+
+class Extract:
+    """ An extract that was compiled by `compile_extract`. """
+    path: str
+    volume_ids: set
+
+    def __init__(self, path):
+        self.path = path
+        with open(f"{path}/manifest.json") as manifest_file:
+            self.volume_ids = set(json.load(manifest_file)["volumes"])
+
+    def __contains__(self, volume_id):
+        return volume_id in self.volume_ids
+
+    def volume(self, volume_id):
+        return VolumeExtract(f"{self.path}/volume_{volume_id}")
+
+
+class VolumeExtract:
+    """ The files of a single volume within an extract. The columns are only
+        memory-mapped once they're first accessed. """
+    path: str
+
+    def __init__(self, path):
+        self.path = path
+        self.__block_ranges = None
+
+    def column(self, name):
+        """ :returns the column as an array and an array that says which of
+                     its values are NULL (or None if there are no NULLs) """
+        array = np.load(f"{self.path}/{name}.npy", mmap_mode='r')
+        is_null = None
+        if os.path.isfile(f"{self.path}/{name}.null.npy"):
+            is_null = np.load(f"{self.path}/{name}.null.npy", mmap_mode='r')
+        return array, is_null
+
+    def extensions(self):
+        """ :returns the extension code of each file and the extension that
+                     belongs to each code """
+        codes = np.load(f"{self.path}/extension.npy", mmap_mode='r')
+        with open(f"{self.path}/extensions.json") as extensions_file:
+            return codes, json.load(extensions_file)
+
+    @property
+    def block_ranges(self):
+        if self.__block_ranges is None:
+            self.__block_ranges = BlockRanges(
+                np.load(f"{self.path}/block_starts.npy", mmap_mode='r'),
+                np.load(f"{self.path}/block_ends.npy", mmap_mode='r'),
+                np.load(f"{self.path}/block_offsets.npy", mmap_mode='r')
+            )
+        return self.__block_ranges
+
+    def to_frame(self):
+        """ A VolumeFrame of the files in this extract. Its arrays are the
+            memory-mapped columns themselves, so nothing is copied. """
+        columns = {}
+        nulls = {}
+        for name in NUMERIC_COLUMNS:
+            columns[name], is_null = self.column(name)
+            if is_null is not None:
+                nulls[name] = is_null
+
+        codes, extensions = self.extensions()
+        return VolumeFrame(len(codes), columns, nulls, codes, extensions,
+                           self.block_ranges)
+
+    def to_files(self):
+        """ Build a File for each row of the extract. The timestamps are not
+            part of an extract, so they are None. The `blocks` string is
+            rebuilt from the normalized block ranges. """
+        return self.to_frame().files()
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+import sqlite3
+import numpy as np
+import unittest
+
+
+# Whether a file is sampled depends on `(id * HASH_MULTIPLIER + offset) %
+# HASH_MODULUS`, where the offset is derived from the seed. The multiplier is
+# 2^32 divided by the golden ratio, which spreads consecutive ids evenly over
+# the hashes. This fits in the 64-bit integers of SQLite for file ids up to
+# about 3.4 billion.
+HASH_MULTIPLIER = 2654435761
+HASH_MODULUS = 2 ** 32
+SEED_MULTIPLIER = 2246822519
+
+
+@dataclass(frozen=True)
+class FileSample:
+    """
+    Describes a reproducible random sample of the files of each volume, so
+    that statistics can be estimated without looking at every file. Either a
+    fraction `rate` of the files of each volume is sampled, or roughly
+    `files_per_volume` files of each volume.
+
+    A file is sampled when a hash of its id is below a threshold, so the same
+    sample is drawn on every run with the same seed. The hash is computed
+    inside SQLite (see `to_sql`), so the files that aren't sampled are never
+    sent to Python.
+    """
+    rate: float = None
+    files_per_volume: int = None
+    seed: int = 0
+
+    def get_rate(self, file_count):
+        """ :returns the fraction of the files that is sampled of a volume
+                     with the given amount of files """
+        if self.files_per_volume is None:
+            return self.rate
+        if file_count <= self.files_per_volume:
+            return 1.0
+        return self.files_per_volume / file_count
+
+    @staticmethod
+    def __threshold(rate):
+        return round(rate * HASH_MODULUS)
+
+    def __offset(self):
+        # Seeds that are close together should still give different samples.
+        return (self.seed * SEED_MULTIPLIER + 1) % HASH_MODULUS
+
+    def to_sql(self, rate, files_table="Files"):
+        """ :returns a SQL condition on the given table of files that is true
+                     for a fraction `rate` of the files, and the parameters
+                     that go with it """
+        return (f"({files_table}.id * {HASH_MULTIPLIER} + ?) % " +
+                f"{HASH_MODULUS} < ?",
+                [self.__offset(), FileSample.__threshold(rate)])
+
+    def is_sampled(self, ids, rate):
+        """ The same as the condition of `to_sql`, for an array of file ids.
+            :returns a boolean array """
+        hashes = (np.asarray(ids, dtype=np.int64) * HASH_MULTIPLIER
+                  + self.__offset()) % HASH_MODULUS
+        return hashes < FileSample.__threshold(rate)
+
+
+class __Tests(unittest.TestCase):
+    def test__to_sql(self):
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE Files(id INTEGER PRIMARY KEY);")
+        connection.executemany("INSERT INTO Files VALUES (?);",
+                               [(i,) for i in range(1, 10_001)])
+
+        sample = FileSample(rate=0.1, seed=3)
+        condition, parameters = sample.to_sql(0.1)
+        ids = [row[0] for row in connection.execute(
+            f"SELECT id FROM Files WHERE {condition};", parameters
+        )]
+
+        self.assertAlmostEqual(1_000, len(ids), delta=50)
+        is_sampled = sample.is_sampled(np.arange(1, 10_001), 0.1)
+        self.assertEqual(ids, (np.flatnonzero(is_sampled) + 1).tolist())
+        other_ids = np.flatnonzero(
+            FileSample(seed=4).is_sampled(np.arange(1, 10_001), 0.1)
+        ) + 1
+        self.assertLess(len(set(ids) & set(other_ids.tolist())), 500)
+
+        self.assertEqual(0.5, FileSample(files_per_volume=50).get_rate(100))
+        self.assertEqual(1.0, FileSample(files_per_volume=50).get_rate(10))
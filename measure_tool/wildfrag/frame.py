@@ -0,0 +1,263 @@
+from dataclasses import fields
+
+import numpy as np
+import unittest
+
+from wildfrag.data import File
+from wildfrag.util import BlockRanges, concatenate_block_ranges, \
+    parse_block_ranges_batch
+import profiling
+
+
+FILE_COLUMNS = [f.name for f in fields(File)]
+NUMERIC_COLUMNS = [
+    "id", "volume_id", "extension_len", "size", "num_blocks", "num_gaps",
+    "sum_gaps_bytes", "sum_gaps_blocks", "fragmented", "backward",
+    "num_backward", "resident", "fs_compressed", "sparse", "linearconsecutive",
+    "hardlink_id", "num_hardlink", "fs_seq", "fs_nlink", "fs_inode"
+]
+# The columns of the Files table that a VolumeFrame can hold, in table order.
+FRAME_COLUMNS = [name for name in FILE_COLUMNS
+                 if name in NUMERIC_COLUMNS or name in ("extension", "blocks")]
+# The numeric columns that are only ever 0 or 1, which are stored as int8
+# instead of int64.
+FLAG_COLUMNS = [
+    "fragmented", "backward", "resident", "fs_compressed", "sparse",
+    "linearconsecutive"
+]
+
+
+class VolumeFrame:
+    """
+    The files of a single volume, stored column by column instead of as one
+    File per row. This takes a fraction of the memory that a list of Files
+    takes, and lets metrics look at all files at once with NumPy.
+
+    - Each numeric column is an int64 array, except for the FLAG_COLUMNS which
+      are int8 arrays. NULLs are stored as 0, and `nulls` has a boolean array
+      for each column that contains NULLs.
+    - The extensions are dictionary-encoded: `extension_codes` has an index
+      into `extensions` for each file.
+    - The `blocks` strings are stored as their parsed and normalized
+      BlockRanges.
+    - The timestamps are not stored, because no metric uses them.
+
+    Columns that weren't loaded are simply missing, see `column_names`. Files
+    can still be looked at one at a time with `file(i)`, which builds a File
+    on demand.
+    """
+    length: int
+    columns: dict
+    nulls: dict
+    extension_codes: np.ndarray = None
+    extensions: list = None
+    block_ranges: BlockRanges = None
+    # The columns of the Files table that were loaded into this frame
+    column_names: list = FRAME_COLUMNS
+
+    def __init__(self, length, columns, nulls, extension_codes=None,
+                 extensions=None, block_ranges=None,
+                 column_names=FRAME_COLUMNS):
+        self.length = length
+        self.columns = columns
+        self.nulls = nulls
+        self.extension_codes = extension_codes
+        self.extensions = extensions
+        self.block_ranges = block_ranges
+        self.column_names = column_names
+
+    def __len__(self):
+        return self.length
+
+    def has_columns(self, column_names=None):
+        """ Check whether all of the given columns were loaded.
+            :param column_names: Defaults to every column in FRAME_COLUMNS """
+        if column_names is None:
+            column_names = FRAME_COLUMNS
+        return set(column_names) <= set(self.column_names)
+
+    def __getitem__(self, name):
+        """ The array of the given numeric column """
+        return self.columns[name]
+
+    def is_null(self, name):
+        """ Which values of the given numeric column are NULL """
+        if name in self.nulls:
+            return self.nulls[name]
+        return np.zeros(self.length, dtype=bool)
+
+    def nbytes(self):
+        """ Roughly how much memory the arrays of this frame take up """
+        arrays = list(self.columns.values()) + list(self.nulls.values())
+        if self.extension_codes is not None:
+            arrays.append(self.extension_codes)
+        if self.block_ranges is not None:
+            arrays += [self.block_ranges.starts, self.block_ranges.ends,
+                       self.block_ranges.offsets]
+        return sum(array.nbytes for array in arrays)
+
+    def __column_values(self, name):
+        """ The values of any column as a list, like a File would have them """
+        if name in self.columns:
+            values = self.columns[name].tolist()
+            if name in self.nulls:
+                values = [None if null else value for value, null
+                          in zip(values, self.nulls[name].tolist())]
+            return values
+        if name == "extension" and self.extension_codes is not None:
+            extensions = self.extensions
+            return [extensions[code] for code in self.extension_codes.tolist()]
+        if name == "blocks" and self.block_ranges is not None:
+            return format_blocks_strs(self.block_ranges)
+        return [None] * self.length
+
+    def files(self):
+        """ Build a File for each row. The timestamps are None, and the
+            `blocks` strings are rebuilt from the normalized block ranges. """
+        columns = [self.__column_values(name) for name in FILE_COLUMNS]
+        return [File(*row) for row in zip(*columns)]
+
+    def file(self, i):
+        """ Build a File for row `i` only. """
+        values = {}
+        for name in FILE_COLUMNS:
+            value = None
+            if name in self.columns:
+                if name not in self.nulls or not self.nulls[name][i]:
+                    value = int(self.columns[name][i])
+            elif name == "extension" and self.extension_codes is not None:
+                value = self.extensions[self.extension_codes[i]]
+            elif name == "blocks" and self.block_ranges is not None:
+                value = " ".join(format_block_ranges(self.block_ranges[i]))
+            values[name] = value
+        return File(**values)
+
+    @staticmethod
+    def __to_array(values):
+        """ Convert the values of a numeric column to an int64 array.
+            :returns the array and which values are NULL, or None if there
+                     are no NULLs """
+        # Most columns don't contain any NULLs, and converting those in one
+        # go is much faster than looking at each value.
+        try:
+            return np.array(values, dtype=np.int64), None
+        except TypeError:
+            pass
+
+        is_null = np.fromiter((value is None for value in values), dtype=bool,
+                              count=len(values))
+        array = np.fromiter((0 if value is None else value for value in values),
+                            dtype=np.int64, count=len(values))
+        return array, is_null
+
+    @staticmethod
+    def from_row_batches(batches, column_names=None):
+        """ Build a frame from rows of the Files table, in batches like
+            `WildFrag.retrieve_file_rows` returns them.
+            :param column_names: The column of each value in a row. Defaults
+                                 to all columns, like `SELECT *`. """
+        if column_names is None:
+            column_names = FILE_COLUMNS
+        numeric = [name for name in column_names if name in NUMERIC_COLUMNS]
+
+        length = 0
+        arrays = {name: [] for name in numeric}
+        null_arrays = {name: [] for name in numeric}
+        codes = {}
+        code_arrays = []
+        block_ranges = []
+
+        # Fetching the next batch is timed separately by `batches` itself.
+        for rows in batches:
+            with profiling.stage(profiling.STAGE_FRAME):
+                length += len(rows)
+                columns = dict(zip(column_names, zip(*rows)))
+
+                for name in numeric:
+                    array, is_null = VolumeFrame.__to_array(columns[name])
+                    arrays[name].append(array)
+                    null_arrays[name].append(is_null)
+
+                if "extension" in column_names:
+                    code_arrays.append(np.fromiter(
+                        (codes.setdefault(extension, len(codes))
+                         for extension in columns["extension"]),
+                        dtype=np.int32, count=len(rows)
+                    ))
+
+            if "blocks" in column_names:
+                with profiling.stage(profiling.STAGE_PARSE):
+                    block_ranges.append(
+                        parse_block_ranges_batch(columns["blocks"])
+                    )
+
+        with profiling.stage(profiling.STAGE_FRAME):
+            return VolumeFrame.__concatenate(
+                length, column_names, numeric, arrays, null_arrays, codes,
+                code_arrays, block_ranges
+            )
+
+    @staticmethod
+    def __concatenate(length, column_names, numeric, arrays, null_arrays,
+                      codes, code_arrays, block_ranges):
+        """ Combine the arrays of each batch into a frame. """
+        loaded = [name for name in column_names if name in FRAME_COLUMNS]
+        columns = {}
+        nulls = {}
+        for name in numeric:
+            array = np.concatenate(arrays[name] or [[]]).astype(np.int64)
+            if name in FLAG_COLUMNS:
+                array = (array != 0).astype(np.int8)
+            columns[name] = array
+
+            if any(is_null is not None for is_null in null_arrays[name]):
+                nulls[name] = np.concatenate([
+                    np.zeros(len(batch), dtype=bool) if is_null is None
+                    else is_null
+                    for batch, is_null in zip(arrays[name], null_arrays[name])
+                ])
+
+        frame = VolumeFrame(length, columns, nulls, column_names=loaded)
+        if "extension" in column_names:
+            frame.extension_codes = np.concatenate(code_arrays or [[]]) \
+                .astype(np.int32)
+            frame.extensions = list(codes)
+        if "blocks" in column_names:
+            frame.block_ranges = concatenate_block_ranges(block_ranges)
+        return frame
+
+
+def format_block_ranges(block_ranges):
+    """ Format each block range like it is formatted in a `blocks` string.
+        Joining the results with spaces gives the inverse of
+        `parse_block_ranges`. """
+    return [f"{start} - {end}" for start, end in block_ranges]
+
+
+def format_blocks_strs(block_ranges: BlockRanges):
+    """ Rebuild a `blocks` string for each file of the given BlockRanges. """
+    range_strs = format_block_ranges(zip(block_ranges.starts.tolist(),
+                                         block_ranges.ends.tolist()))
+    offsets = block_ranges.offsets.tolist()
+    return [" ".join(range_strs[offsets[i]:offsets[i + 1]])
+            for i in range(len(block_ranges))]
+
+
+class __Tests(unittest.TestCase):
+    def test__from_row_batches(self):
+        batches = [[(1, None, "txt", "0 - 9 10 - 19")],
+                   [(2, 5, "jpg", "40 - 49"), (3, 0, "txt", None)]]
+        frame = VolumeFrame.from_row_batches(
+            batches, ["id", "size", "extension", "blocks"]
+        )
+
+        self.assertEqual(3, len(frame))
+        self.assertEqual([1, 2, 3], frame["id"].tolist())
+        self.assertEqual([True, False, False], frame.is_null("size").tolist())
+        self.assertEqual([0, 1, 0], frame.extension_codes.tolist())
+        self.assertEqual([(40, 49)], frame.block_ranges[1])
+
+        file = frame.file(0)
+        self.assertEqual((None, "txt", "0 - 19", None),
+                         (file.size, file.extension, file.blocks, file.mtime))
+        self.assertEqual(file, frame.files()[0])
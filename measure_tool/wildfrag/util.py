@@ -1,17 +1,170 @@
+import numpy as np
+import unittest
+
+
 def get_each_volume(wildfrag):
     """ Iterate through all the volumes in the given database.
         This returns the datastructures `volume`, `system`, `device`
-        and the indices `i_volume`, `i_system`, `i_device` """
+        and the indices `i_volume`, `i_system`, `i_device`
+
+        The files of each volume are only retrieved once `volume.files` is
+        accessed, and they're released again as soon as the next volume is
+        requested. This means only one volume's files are in memory at a time,
+        unless you keep a reference to `volume.files` yourself. """
     for (i_system,) in wildfrag.retrieve_system_ids():
         system = wildfrag.retrieve_system(i_system)
 
         for i_device, device in enumerate(system.devices):
             for i_volume, volume in enumerate(device.volumes):
                 yield volume, system, device, i_volume, i_system, i_device
+                volume.release_files()
+
+
+class BlockRanges:
+    """
+    The block ranges of many files, stored in a CSR layout: the block ranges of
+    file `i` are `starts[offsets[i]:offsets[i + 1]]` and
+    `ends[offsets[i]:offsets[i + 1]]`.
+    """
+    starts: np.ndarray
+    ends: np.ndarray
+    offsets: np.ndarray
+
+    def __init__(self, starts, ends, offsets):
+        self.starts = starts
+        self.ends = ends
+        self.offsets = offsets
+        self.__lists = None
+
+    def __len__(self):
+        """ The amount of files (not the amount of ranges) """
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """ The block ranges of file `i` as a list of tuples, just like
+            `parse_and_normalize_block_ranges` would return. """
+        # Slicing a NumPy array for every file is much slower than slicing a
+        # list, so the arrays are converted to lists once.
+        if self.__lists is None:
+            self.__lists = (self.starts.tolist(), self.ends.tolist(),
+                            self.offsets.tolist())
+        starts, ends, offsets = self.__lists
+
+        begin = offsets[i]
+        end = offsets[i + 1]
+        return list(zip(starts[begin:end], ends[begin:end]))
+
+    def counts(self):
+        """ The amount of block ranges of each file """
+        return np.diff(self.offsets)
+
+    def owners(self):
+        """ The index of the file that each block range belongs to """
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.counts())
+
+
+def concatenate_block_ranges(parts):
+    """ Combine several BlockRanges into one, with the files of each part
+        after the files of the parts before it. """
+    if len(parts) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return BlockRanges(empty, empty, np.zeros(1, dtype=np.int64))
+    if len(parts) == 1:
+        return parts[0]
+
+    # Shift the offsets of each part by the amount of ranges before it...
+    range_counts = [len(part.starts) for part in parts]
+    shifts = np.cumsum([0] + range_counts[:-1])
+    offsets = [parts[0].offsets[:1]]
+    for part, shift in zip(parts, shifts):
+        offsets.append(part.offsets[1:] + shift)
+
+    return BlockRanges(np.concatenate([part.starts for part in parts]),
+                       np.concatenate([part.ends for part in parts]),
+                       np.concatenate(offsets))
+
+
+def parse_block_ranges_batch(blocks_strs, normalize=True):
+    """
+    Parse the `blocks` strings of many files at once.
+    This does the same as calling `parse_and_normalize_block_ranges` on each
+    string, except that the numbers are tokenized with NumPy and the results
+    end up in one BlockRanges instead of a list for each file.
+    A `blocks` string that is None is treated as an empty string.
+    :param normalize: Whether to fuse contiguous block ranges together.
+    """
+    blocks_strs = ["" if blocks is None else blocks for blocks in blocks_strs]
+    file_count = len(blocks_strs)
+
+    # Put all of the strings in one big buffer, separated by newlines...
+    buffer = np.frombuffer("\n".join(blocks_strs).encode(), dtype=np.uint8)
+    string_lengths = np.fromiter(map(len, blocks_strs), dtype=np.int64,
+                                 count=file_count)
+    string_begins = np.cumsum(string_lengths + 1) - (string_lengths + 1)
+
+    # Find the first and last character of each number...
+    is_digit = (buffer >= ord("0")) & (buffer <= ord("9"))
+    edges = np.diff(is_digit.astype(np.int8), prepend=0, append=0)
+    number_begins = np.flatnonzero(edges == 1)
+    number_ends = np.flatnonzero(edges == -1)
+
+    # Convert the numbers. This handles one digit position at a time, aligned
+    # to the last digit of each number, so each step is a single vectorized
+    # multiply-add over all numbers at once.
+    lengths = number_ends - number_begins
+    assert (lengths.max(initial=0) <= 18)  # Larger numbers don't fit in int64
+    numbers = np.zeros(len(number_begins), dtype=np.int64)
+    for position in range(lengths.max(initial=0), 0, -1):
+        has_digit = lengths >= position
+        digit = buffer[np.where(has_digit, number_ends - position, 0)]
+        numbers *= 10
+        numbers += np.where(has_digit, digit - ord("0"), 0)
+
+    # Pair the numbers up into ranges, dropping a trailing unpaired number in
+    # each string (the old parser didn't read those either)...
+    number_owners = np.searchsorted(string_begins, number_begins, "right") - 1
+    number_counts = np.bincount(number_owners, minlength=file_count)
+    first_numbers = np.cumsum(number_counts) - number_counts
+    index_in_string = np.arange(len(numbers)) - first_numbers[number_owners]
+    is_paired = index_in_string < (number_counts // 2 * 2)[number_owners]
+    pairs = numbers[is_paired].reshape(-1, 2)
+
+    offsets = np.zeros(file_count + 1, dtype=np.int64)
+    np.cumsum(number_counts // 2, out=offsets[1:])
+    block_ranges = BlockRanges(pairs[:, 0].copy(), pairs[:, 1].copy(), offsets)
+
+    if normalize:
+        block_ranges = normalize_block_ranges_batch(block_ranges)
+    return block_ranges
+
+
+def normalize_block_ranges_batch(block_ranges: BlockRanges):
+    """ Fuse contiguous block ranges together, like `normalize_block_ranges`
+        does, for every file of the given BlockRanges at once.
+        :returns a new BlockRanges """
+    starts = block_ranges.starts
+    ends = block_ranges.ends
+    owners = block_ranges.owners()
+
+    # A range is kept if it doesn't continue the previous range of its file.
+    # Ranges that do continue the previous range are merged into it.
+    is_kept = np.ones(len(starts), dtype=bool)
+    is_kept[1:] = (ends[:-1] + 1 != starts[1:]) | (owners[:-1] != owners[1:])
+    kept = np.flatnonzero(is_kept)
+    last_of_merged = np.append(kept, len(starts))[1:] - 1
+
+    offsets = np.zeros(len(block_ranges) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owners[kept], minlength=len(block_ranges)),
+              out=offsets[1:])
+    return BlockRanges(starts[kept], ends[last_of_merged], offsets)
 
 
 def parse_block_ranges(blocks_str: str):
+    """ Parse a single `blocks` string. Use `parse_block_ranges_batch` to
+        parse many strings at once, which is a lot faster. """
     ranges = []
+    if blocks_str is None:
+        return ranges
     current_position = 0
 
     while True:
@@ -47,29 +200,48 @@ def normalize_block_ranges(block_ranges: list):
     contiguous and could be fused together. This function fuses them together.
     This function edits the list in-place and does not make a copy.
     """
-    to_be_removed = []
-
-    # Merge the ranges together...
-    for i in range(len(block_ranges)):
-        # If this_range and the next range are contiguous...
-        i_next = i + 1
-        while i_next < len(block_ranges) \
-                and block_ranges[i][1] + 1 == block_ranges[i_next][0]:
-            # Merge the ranges together...
-            block_ranges[i] = (block_ranges[i][0], block_ranges[i_next][1])
-            # Mark the next range as dead...
-            block_ranges[i_next] = (-2, -2)
-            to_be_removed.append(i_next)
-            # Check again whether the next range is also contiguous...
-            i_next += 1
-
-    # Delete ranges that were merged into other ranges...
-    for removed_index in reversed(to_be_removed):
-        block_ranges.pop(removed_index)
-
+    if len(block_ranges) == 0:
+        return block_ranges
+
+    # Extend the last merged range for as long as the next range continues
+    # it, and start a new one otherwise...
+    merged = [block_ranges[0]]
+    for start, end in block_ranges[1:]:
+        last_start, last_end = merged[-1]
+        if last_end + 1 == start:
+            merged[-1] = (last_start, end)
+        else:
+            merged.append((start, end))
+
+    block_ranges[:] = merged
     return block_ranges
 
 
 def parse_and_normalize_block_ranges(blocks_str: str):
     """ Tiny helper function. This is usually what you want. """
     return normalize_block_ranges(parse_block_ranges(blocks_str))
+
+
+class __Tests(unittest.TestCase):
+    def test__parse_block_ranges_batch(self):
+        block_ranges = parse_block_ranges_batch(
+            ["10 - 50 51 - 60 120 - 130", None, "", "7 - 8 9"]
+        )
+        self.assertEqual([0, 2, 2, 2, 3], block_ranges.offsets.tolist())
+        self.assertEqual([(10, 60), (120, 130)], block_ranges[0])
+        self.assertEqual([], block_ranges[1])
+        self.assertEqual([(7, 8)], block_ranges[3])
+
+    def test__concatenate_block_ranges(self):
+        block_ranges = concatenate_block_ranges([
+            parse_block_ranges_batch(["1 - 2 5 - 6", ""]),
+            parse_block_ranges_batch(["8 - 9"])
+        ])
+        self.assertEqual([0, 2, 2, 3], block_ranges.offsets.tolist())
+        self.assertEqual([(8, 9)], block_ranges[2])
+
+    def test__normalize_block_ranges(self):
+        block_ranges = [(0, 9), (10, 19), (20, 29), (40, 49), (50, 59)]
+        normalize_block_ranges(block_ranges)
+        self.assertEqual([(0, 29), (40, 59)], block_ranges)
+        self.assertEqual([], normalize_block_ranges([]))
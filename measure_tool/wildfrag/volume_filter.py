@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+import unittest
+
+
+@dataclass
+class VolumeFilter:
+    """
+    Describes which volumes to look at. Each condition that is None is ignored.
+    The filter can be turned into SQL with `to_sql`, so volumes that don't
+    match are never read from the database at all.
+    """
+    fs_type: str = None
+    # In bytes, both inclusive
+    min_size: int = None
+    max_size: int = None
+    # True for volumes on HDDs, False for volumes on SSDs. This is the
+    # `rotational` column of the StorageDevices table.
+    rotational: bool = None
+    system_ids: list = None
+    volume_ids: list = None
+    # The minimum of `used / size`, inclusive. Volumes of which the used space
+    # is unknown never match.
+    min_fullness: float = None
+
+    def is_empty(self):
+        """ Check whether every volume matches. """
+        return self == VolumeFilter()
+
+    @staticmethod
+    def __placeholders(values):
+        """ :returns "(?, ?, ...)" with a ? for each value """
+        return "(" + ", ".join("?" * len(values)) + ")"
+
+    def to_sql(self, volumes_table="Volumes"):
+        """ :returns a SQL condition on the given table of volumes and the
+                     parameters that go with it. The conditions on devices
+                     and systems are checked through subqueries, so the
+                     condition only needs the table of volumes. """
+        conditions = []
+        parameters = []
+
+        if self.fs_type is not None:
+            conditions.append(f"{volumes_table}.fs_type = ?")
+            parameters.append(self.fs_type)
+        if self.min_size is not None:
+            conditions.append(f"{volumes_table}.size >= ?")
+            parameters.append(self.min_size)
+        if self.max_size is not None:
+            conditions.append(f"{volumes_table}.size <= ?")
+            parameters.append(self.max_size)
+        if self.volume_ids is not None:
+            conditions.append(f"{volumes_table}.id IN " +
+                              VolumeFilter.__placeholders(self.volume_ids))
+            parameters += self.volume_ids
+        if self.min_fullness is not None:
+            # This is `used / size >= min_fullness` without the division.
+            conditions.append(f"{volumes_table}.used >= " +
+                              f"? * {volumes_table}.size")
+            parameters.append(self.min_fullness)
+
+        device_conditions = []
+        if self.rotational is not None:
+            device_conditions.append("rotational = ?")
+            parameters.append(int(self.rotational))
+        if self.system_ids is not None:
+            device_conditions.append(
+                "system_id IN " + VolumeFilter.__placeholders(self.system_ids)
+            )
+            parameters += self.system_ids
+        if len(device_conditions) != 0:
+            conditions.append(f"{volumes_table}.storage_device_id IN (" +
+                              "SELECT id FROM StorageDevices WHERE " +
+                              " AND ".join(device_conditions) + ")")
+
+        if len(conditions) == 0:
+            return "1", parameters
+        return " AND ".join(conditions), parameters
+
+
+class __Tests(unittest.TestCase):
+    def test__to_sql(self):
+        volume_filter = VolumeFilter(fs_type="ntfs", min_size=10)
+        self.assertEqual(("V.fs_type = ? AND V.size >= ?", ["ntfs", 10]),
+                         volume_filter.to_sql("V"))
+        self.assertEqual(("1", []), VolumeFilter().to_sql())
+        self.assertTrue(VolumeFilter().is_empty())
+
+        volume_filter = VolumeFilter(volume_ids=[1, 2], rotational=True)
+        self.assertEqual(
+            ("V.id IN (?, ?) AND V.storage_device_id IN " +
+             "(SELECT id FROM StorageDevices WHERE rotational = ?)",
+             [1, 2, 1]),
+            volume_filter.to_sql("V")
+        )
@@ -1,6 +1,16 @@
 import sqlite3
 import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+import unittest
 from wildfrag.data import *
+from wildfrag.extract import Extract, default_extract_path, is_extract_fresh
+from wildfrag.frame import FRAME_COLUMNS, VolumeFrame
+from wildfrag.file_sample import FileSample
+from wildfrag.volume_filter import VolumeFilter
+import profiling
 
 
 # Hindsight note: I took the idea to put this in a dict from some other
@@ -11,31 +21,186 @@ queries = {
     "retrieve system": "SELECT * FROM Systems WHERE id = ?;",
     "retrieve devices": "SELECT * FROM StorageDevices WHERE system_id = ?;",
     "retrieve volumes": "SELECT * FROM Volumes WHERE storage_device_id = ?;",
+    "retrieve volume": "SELECT * FROM Volumes WHERE id = ?;",
+    "retrieve volume ids": "SELECT id FROM Volumes;",
     "retrieve notes": "SELECT * FROM VolumeNotes WHERE volume_id = ?;",
-    "retrieve files": "SELECT * FROM Files WHERE volume_id = ?;"
+    "retrieve files": "SELECT * FROM Files WHERE volume_id = ?;",
+    # The {} is replaced by a list of columns.
+    "retrieve file columns": "SELECT {} FROM Files WHERE volume_id = ?;",
+    # The last {} is replaced by the condition of a FileSample.
+    "retrieve sampled files": "SELECT * FROM Files WHERE volume_id = ? AND {};",
+    "retrieve sampled file columns":
+        "SELECT {} FROM Files WHERE volume_id = ? AND {};",
+    "count volume files": "SELECT COUNT(*) FROM Files WHERE volume_id = ?;",
+    "estimate work": """
+        SELECT volume_id, COUNT(*), COALESCE(SUM(LENGTH(blocks)), 0)
+        FROM Files GROUP BY volume_id;""",
+    "fingerprint files":
+        "SELECT volume_id, COUNT(*), MAX(id) FROM Files GROUP BY volume_id;",
+    # The conditions in here mirror the ones in `VolumeStatsAccumulator`.
+    # `CASE WHEN resident THEN 0 WHEN ...` is used instead of `NOT resident`
+    # because `NOT NULL` is not true in SQL, while `not None` is in Python.
+    "aggregate files": """
+        SELECT volume_id,
+            COUNT(*),
+            SUM(CASE WHEN resident THEN 0 WHEN num_blocks > 1 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN fragmented THEN 1 ELSE 0 END),
+            SUM(CASE WHEN size = 0 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN resident THEN 1 ELSE 0 END),
+            SUM(CASE WHEN sparse THEN 1 ELSE 0 END),
+            SUM(CASE WHEN fs_compressed THEN 1 ELSE 0 END),
+            SUM(CASE WHEN hardlink_id IS NOT NULL THEN 1 ELSE 0 END),
+            SUM(CASE WHEN resident THEN 0 WHEN num_blocks != 0 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN resident THEN 0 ELSE COALESCE(num_blocks, 0) END),
+            SUM(CASE WHEN resident THEN 0
+                     WHEN num_blocks IS NULL OR num_blocks = 0 THEN 0
+                     WHEN num_gaps >= 1 THEN num_gaps ELSE 0 END),
+            SUM(CASE WHEN resident THEN 0
+                     WHEN num_blocks IS NULL OR num_blocks = 0 THEN 0
+                     WHEN num_gaps >= 1 THEN sum_gaps_bytes ELSE 0 END),
+            COALESCE(SUM(size), 0),
+            TOTAL(CASE WHEN num_gaps > 1
+                       THEN CAST(num_backward AS REAL) / num_gaps END),
+            SUM(CASE WHEN num_gaps > 1 THEN 1 ELSE 0 END),
+            TOTAL(CASE WHEN num_blocks > 1
+                       THEN CAST(num_gaps AS REAL) / (num_blocks - 1) END),
+            SUM(CASE WHEN num_blocks > 1 THEN 1 ELSE 0 END)
+        FROM Files GROUP BY volume_id;""",
+    # The blocks of the files that `VolumeStatsAccumulator` counts the
+    # backwards gaps of.
+    "retrieve gapped blocks": """
+        SELECT blocks, num_gaps FROM Files
+        WHERE volume_id = ? AND num_gaps >= 1 AND num_blocks != 0
+              AND (resident IS NULL OR NOT resident);""",
+    "retrieve file sizes": "SELECT size FROM Files WHERE size IS NOT NULL;",
+    "count file sizes":
+        "SELECT COUNT(*) FROM Files WHERE size IS NOT NULL;",
+    # The {} is replaced by the condition of a VolumeFilter.
+    "retrieve filtered file sizes": """
+        SELECT Files.volume_id, Files.size
+        FROM Files JOIN Volumes ON Files.volume_id = Volumes.id
+        WHERE Files.size IS NOT NULL AND ({});""",
+    # These replace the queries without "filtered" when a WildFrag has a
+    # VolumeFilter. The {} is replaced by the condition of the filter. Systems
+    # and devices without any matching volumes are left out.
+    "retrieve filtered system ids": """
+        SELECT id FROM Systems WHERE id IN (
+            SELECT StorageDevices.system_id FROM StorageDevices
+            JOIN Volumes ON Volumes.storage_device_id = StorageDevices.id
+            WHERE {});""",
+    "retrieve filtered devices": """
+        SELECT * FROM StorageDevices WHERE system_id = ? AND id IN (
+            SELECT storage_device_id FROM Volumes WHERE {});""",
+    "retrieve filtered volumes":
+        "SELECT * FROM Volumes WHERE storage_device_id = ? AND ({});",
+    "retrieve filtered volume ids": "SELECT id FROM Volumes WHERE {};",
+    # This goes in front of the queries that aggregate over the whole Files
+    # table when a WildFrag has a VolumeFilter. It hides the files of the
+    # volumes that don't match, which are then never read thanks to the
+    # index on `volume_id`. The {} is replaced by the condition of the filter.
+    "filter files": """
+        WITH Files AS (
+            SELECT * FROM main.Files
+            WHERE volume_id IN (SELECT id FROM Volumes WHERE {})
+        )"""
 }
 
+# The queries that look rows up by a foreign key, and the index that each of
+# them needs to not scan the whole table.
+LOOKUP_INDEXES = {
+    "retrieve devices": ("StorageDevices", "system_id"),
+    "retrieve volumes": ("Volumes", "storage_device_id"),
+    "retrieve notes": ("VolumeNotes", "volume_id"),
+    "retrieve files": ("Files", "volume_id"),
+    "retrieve gapped blocks": ("Files", "volume_id"),
+}
+
+# Every query only reads, so SQLite is allowed to memory-map the database and
+# to use a large page cache. These are upper limits, not allocations.
+MMAP_SIZE = 1 << 30             # In bytes
+CACHE_SIZE = 256 * 1024         # In KiB
+
 
 class WildFrag:
     db_path: str
+    read_only: bool
     connection = None
     cursor = None
+    # The extract that the files are read from instead of the database, if
+    # there is an extract that is up-to-date. See `extract.py`.
+    extract: Extract = None
+    # Which volumes are returned by `retrieve_system`, and which volumes the
+    # queries over the whole Files table look at. None to use every volume.
+    volume_filter: VolumeFilter = None
+    # Which files of each volume are retrieved, if only a sample of the files
+    # is looked at. None to retrieve every file.
+    file_sample: FileSample = None
 
-    def __init__(self, database_path):
+    def __init__(self, database_path, read_only=True, extract_path=None,
+                 use_extract=True, volume_filter: VolumeFilter = None,
+                 file_sample: FileSample = None):
+        """ :param extract_path: Where to look for an extract of the database.
+                                 Defaults to "<database_path>.extract".
+            :param file_sample: The extract is not used with a sample, as it
+                                can only load every file of a volume. """
         self.db_path = database_path
+        self.read_only = read_only
+        if volume_filter is not None and not volume_filter.is_empty():
+            self.volume_filter = volume_filter
+        self.file_sample = file_sample
+        # The sample rate of each volume id, see `retrieve_sample_rate`
+        self.__sample_rates = {}
+        if file_sample is not None:
+            use_extract = False
 
         if not os.path.isfile(database_path):
             raise Exception(f"The file \"{database_path}\" does not exist.")
 
         self.__connect()
+
+        if extract_path is None:
+            extract_path = default_extract_path(database_path)
+        if use_extract and os.path.isdir(extract_path):
+            if is_extract_fresh(extract_path, database_path):
+                self.extract = Extract(extract_path)
+            else:
+                print(f"Note: Ignoring the extract \"{extract_path}\" " +
+                      "because the database has changed since it was made.",
+                      file=sys.stderr)
         # Integrity checks take a very long time on the full WildFrag DB
         # and so far there haven't been any integrity issues.
         #self.__check_integrity()
 
+    def open_copy(self):
+        """ Open another connection to the same database, with the same
+            extract, volume filter and file sample. SQLite connections can't
+            be shared between threads, so each thread needs its own. """
+        extract_path = None
+        if self.extract is not None:
+            extract_path = self.extract.path
+        copy = WildFrag(self.db_path, self.read_only, extract_path,
+                        use_extract=extract_path is not None,
+                        volume_filter=self.volume_filter,
+                        file_sample=self.file_sample)
+        # The volumes have the same amount of files, so there's no need to
+        # count them again.
+        copy.__sample_rates = self.__sample_rates
+        return copy
+
     def __connect(self):
-        self.connection = sqlite3.connect(self.db_path)
+        if self.read_only:
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            self.connection = sqlite3.connect(uri, uri=True)
+        else:
+            self.connection = sqlite3.connect(self.db_path)
         self.cursor = self.connection.cursor()
 
+        self.cursor.execute(f"PRAGMA mmap_size = {MMAP_SIZE};")
+        self.cursor.execute(f"PRAGMA cache_size = -{CACHE_SIZE};")
+        self.cursor.execute("PRAGMA temp_store = MEMORY;")
+        if self.read_only:
+            self.cursor.execute("PRAGMA query_only = ON;")
+
     def __check_integrity(self):
         self.cursor.execute("pragma integrity_check;")
         result = self.cursor.fetchone()[0]
@@ -44,8 +209,60 @@ class WildFrag:
             raise Exception("Database integrity check failed for database " +
                             f"\"{self.db_path}\".")
 
+    def explain_query_plans(self):
+        """ Ask SQLite how it would run each query that looks rows up by a
+            foreign key.
+            :returns a dict with the query plan of each query, as a list of
+                     the lines that EXPLAIN QUERY PLAN returns """
+        plans = {}
+        for query_name in LOOKUP_INDEXES:
+            rows = self.connection.execute(
+                "EXPLAIN QUERY PLAN " + queries[query_name], (0,)
+            ).fetchall()
+            plans[query_name] = [row[-1] for row in rows]
+        return plans
+
+    def find_unindexed_lookups(self):
+        """ :returns the names of the queries in LOOKUP_INDEXES that scan
+                     their whole table instead of using an index """
+        unindexed = []
+        for query_name, plan in self.explain_query_plans().items():
+            table, _ = LOOKUP_INDEXES[query_name]
+            # SQLite before 3.36 says "SCAN TABLE Files" instead of
+            # "SCAN Files".
+            scan = re.compile(rf"^SCAN (TABLE )?{table}\b")
+            if any(scan.match(line) for line in plan):
+                unindexed.append(query_name)
+        return unindexed
+
+    def make_indexed_copy(self, copy_path):
+        """ Copy the database to `copy_path` and create the indexes that the
+            queries in LOOKUP_INDEXES are missing in the copy. The original
+            database is left alone. (SQLite can't put an index on a table in
+            a different database file, so a copy is needed.)
+            :returns the names of the indexes that were created """
+        copy = sqlite3.connect(copy_path)
+        self.connection.backup(copy)
+
+        created = []
+        for query_name in self.find_unindexed_lookups():
+            table, column = LOOKUP_INDEXES[query_name]
+            index_name = f"measure_tool_{table}_{column}"
+            if index_name not in created:
+                copy.execute(f"CREATE INDEX IF NOT EXISTS {index_name} " +
+                             f"ON {table}({column});")
+                created.append(index_name)
+        copy.execute("ANALYZE;")
+        copy.commit()
+        copy.close()
+        return created
+
     def retrieve_system_ids(self):
         """ :returns a SQLite Cursor """
+        if self.volume_filter is not None:
+            return self.connection.cursor().execute(
+                *self.__filtered("retrieve filtered system ids")
+            )
         return self.connection.cursor().execute(queries["retrieve system ids"])
 
     def retrieve_system(self, id):
@@ -60,7 +277,9 @@ class WildFrag:
         devices = []
 
         # Build up a list of devices...
-        for row in self.run_sql("retrieve devices", system_id):
+        for row in self.__run_filtered_sql("retrieve devices",
+                                           "retrieve filtered devices",
+                                           system_id):
             devices.append(StorageDevice(
                 row[0], row[1], row[2], row[3], row[4], row[5], row[6]
             ))
@@ -79,36 +298,288 @@ class WildFrag:
         volumes = []
 
         # Build up a list of volumes...
-        for row in self.run_sql("retrieve volumes", device_id):
-            volumes.append(Volume(
-                row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7]
-            ))
-
-        # Find the files of each volume...
-        # This is in a separate for-loop because it also uses the DB cursor.
-        for volume in volumes:
-            volume.files = self.__retrieve_files(volume.id)
+        # The files of each volume are not retrieved here. Instead, they're
+        # retrieved when they're first accessed through `Volume.files`.
+        for row in self.__run_filtered_sql("retrieve volumes",
+                                           "retrieve filtered volumes",
+                                           device_id):
+            volumes.append(self.__make_volume(row))
 
         return volumes
 
+    def __make_volume(self, row):
+        volume = Volume(
+            row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7],
+            file_loader=self.__retrieve_files,
+            frame_loader=self.retrieve_frame
+        )
+
+        if self.file_sample is not None:
+            volume.sample_rate = self.retrieve_sample_rate(volume.id)
+
+        if self.extract is not None and volume.id in self.extract:
+            volume.extract = self.extract.volume(volume.id)
+            volume.file_loader = self.__retrieve_files_from_extract
+            volume.frame_loader = self.__retrieve_frame_from_extract
+
+        return volume
+
+    def retrieve_volume(self, id):
+        """ :returns a Volume, without its device or system """
+        row = self.run_sql("retrieve volume", id).fetchone()
+        return self.__make_volume(row)
+
+    def retrieve_sample_rate(self, volume_id):
+        """ :returns the fraction of the files of the given volume that the
+                     file sample retrieves """
+        # Counting the files of a large volume takes a while, so the rate of
+        # each volume is only derived once.
+        if volume_id in self.__sample_rates:
+            return self.__sample_rates[volume_id]
+
+        file_count = None
+        if self.file_sample.files_per_volume is not None:
+            # This uses its own cursor, because it's used while self.cursor
+            # is busy retrieving volumes.
+            file_count = self.connection.cursor().execute(
+                queries["count volume files"], (volume_id,)
+            ).fetchone()[0]
+        rate = self.file_sample.get_rate(file_count)
+        self.__sample_rates[volume_id] = rate
+        return rate
+
+    def __sampled(self, query_name, volume_id, *formats):
+        """ Fill in the condition of the file sample in one of the "sampled"
+            queries.
+            :returns the query and its parameters """
+        condition, parameters = self.file_sample.to_sql(
+            self.retrieve_sample_rate(volume_id)
+        )
+        return queries[query_name].format(*formats, condition), \
+            (volume_id, *parameters)
+
+    def retrieve_volume_ids(self):
+        """ The ids of the volumes that match the volume filter, if any.
+            :returns a SQLite Cursor """
+        # This uses its own cursor, so it can be used while self.cursor is
+        # busy with something else.
+        if self.volume_filter is None:
+            return self.connection.cursor().execute(
+                queries["retrieve volume ids"]
+            )
+        return self.connection.cursor().execute(
+            *self.__filtered("retrieve filtered volume ids")
+        )
+
+    def retrieve_work_estimates(self):
+        """ :returns a dict with a WorkEstimate for each volume id """
+        with profiling.stage(profiling.STAGE_FETCH):
+            rows = self.__run_sql_on_files("estimate work").fetchall()
+        return {row[0]: WorkEstimate(*row) for row in rows}
+
+    def retrieve_file_fingerprints(self):
+        """ Something that changes whenever files are added to or removed
+            from a volume, without looking at the files themselves. PriFiwalk
+            only ever appends files, so the amount of files and the highest
+            file id are enough.
+            :returns a dict with a (file count, max file id) tuple for each
+                     volume id that has files """
+        fingerprints = {}
+        for volume_id, file_count, max_id in self.__run_sql_on_files("fingerprint files"):
+            fingerprints[volume_id] = (file_count, max_id)
+        return fingerprints
+
+    def retrieve_file_aggregates(self):
+        """ Aggregate the files of every volume inside of SQLite, without
+            retrieving any individual files.
+            :returns a dict with a FileAggregates for each volume id """
+        aggregates = {}
+        with profiling.stage(profiling.STAGE_FETCH):
+            rows = self.__run_sql_on_files("aggregate files").fetchall()
+        for row in rows:
+            aggregates[row[0]] = FileAggregates(*row)
+        return aggregates
+
+    def retrieve_gapped_blocks(self, volume_id, batch_size=100_000):
+        """ Retrieve the `blocks` and `num_gaps` of each file of the given
+            volume that has at least one gap and isn't resident.
+            :returns an iterator of lists of (blocks, num_gaps) rows """
+        return self.__fetch_in_batches("retrieve gapped blocks", batch_size,
+                                       volume_id)
+
+    def retrieve_file_rows(self, volume_id, batch_size=100_000):
+        """ Retrieve the raw rows of the Files table for the given volume.
+            :returns an iterator of lists of rows """
+        return self.__fetch_in_batches("retrieve files", batch_size, volume_id)
+
+    def retrieve_file_sizes(self, batch_size=1_000_000):
+        """ Retrieve the size of every file in the database that has one, in
+            the order of the Files table.
+            :returns an iterator of lists of (size,) rows """
+        query, parameters = self.__filter_files(queries["retrieve file sizes"])
+        return self.__fetch_sql_in_batches(query, batch_size, *parameters)
+
+    def count_file_sizes(self):
+        """ :returns the amount of rows that `retrieve_file_sizes` returns """
+        return self.__run_sql_on_files("count file sizes").fetchone()[0]
+
+    def retrieve_filtered_file_sizes(self, volume_filter: VolumeFilter,
+                                     batch_size=100_000):
+        """ Retrieve the size of each file of each volume that matches the
+            given filter. Files without a size are skipped. Nothing else is
+            read from the Files table.
+            :returns an iterator of lists of (volume_id, size) rows """
+        condition, parameters = volume_filter.to_sql("Volumes")
+        query = queries["retrieve filtered file sizes"].format(condition)
+        return self.__fetch_sql_in_batches(query, batch_size, *parameters)
+
+    def __fetch_in_batches(self, query_name, batch_size, *query_args):
+        return self.__fetch_sql_in_batches(queries[query_name], batch_size,
+                                           *query_args)
+
+    def __fetch_sql_in_batches(self, query, batch_size, *query_args):
+        # This uses its own cursor, so it can be used while self.cursor is
+        # busy with something else.
+        cursor = self.connection.cursor()
+        with profiling.stage(profiling.STAGE_FETCH):
+            cursor.execute(query, query_args)
+
+        while True:
+            with profiling.stage(profiling.STAGE_FETCH):
+                rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            profiling.count_rows(len(rows))
+            yield rows
+
     def __retrieve_files(self, volume_id):
         files = []
 
+        query, parameters = queries["retrieve files"], (volume_id,)
+        if self.file_sample is not None:
+            query, parameters = self.__sampled("retrieve sampled files",
+                                               volume_id)
+
         # Build up a list of files...
-        for r in self.run_sql("retrieve files", volume_id):
-            files.append(File(
-                r[0], r[1], r[2], r[3], r[4], r[5], r[6], r[7], r[8], r[9],
-                r[10], r[11], r[12], r[13], r[14], r[15], r[16], r[17], r[18],
-                r[19], r[20], r[21], r[22], r[23], r[24], r[25]
-            ))
+        for rows in self.__fetch_sql_in_batches(query, 100_000, *parameters):
+            with profiling.stage(profiling.STAGE_FILES):
+                for r in rows:
+                    # Interning the extensions makes all files with the same
+                    # extension share one string, which also makes them
+                    # quicker to look up in a dict.
+                    extension = r[2] if r[2] is None else sys.intern(r[2])
+                    files.append(File(
+                        r[0], r[1], extension, r[3], r[4], r[5], r[6], r[7],
+                        r[8], r[9], r[10], r[11], r[12], r[13], r[14], r[15],
+                        r[16], r[17], r[18], r[19], r[20], r[21], r[22], r[23],
+                        r[24], r[25]
+                    ))
+
+        return files
 
+    def __retrieve_files_from_extract(self, volume_id):
+        with profiling.stage(profiling.STAGE_EXTRACT):
+            files = self.extract.volume(volume_id).to_files()
+        profiling.count_rows(len(files))
         return files
 
+    def retrieve_frame(self, volume_id, column_names=None,
+                       batch_size=100_000):
+        """ Retrieve the files of the given volume as a VolumeFrame. The rows
+            are converted one batch at a time, so there are never more than
+            `batch_size` rows in memory as Python objects.
+            :param column_names: The columns of the Files table to retrieve.
+                                 Nothing else is read from the database.
+                                 Defaults to all columns in FRAME_COLUMNS. """
+        if column_names is None:
+            column_names = FRAME_COLUMNS
+        assert (set(column_names) <= set(FRAME_COLUMNS))
+        # Keep the columns in table order, so the same set of columns always
+        # gives the same query.
+        column_names = [name for name in FRAME_COLUMNS if name in column_names]
+
+        query = queries["retrieve file columns"].format(
+            ", ".join(column_names)
+        )
+        parameters = (volume_id,)
+        if self.file_sample is not None:
+            query, parameters = self.__sampled(
+                "retrieve sampled file columns", volume_id,
+                ", ".join(column_names)
+            )
+        return VolumeFrame.from_row_batches(
+            self.__fetch_sql_in_batches(query, batch_size, *parameters),
+            column_names
+        )
+
+    def __retrieve_frame_from_extract(self, volume_id, column_names=None):
+        # An extract is memory-mapped, so columns that aren't used cost
+        # nothing and don't have to be left out.
+        with profiling.stage(profiling.STAGE_EXTRACT):
+            frame = self.extract.volume(volume_id).to_frame()
+        profiling.count_rows(len(frame))
+        return frame
+
     def run_sql(self, query_name, *query_args):
         self.cursor.execute(queries[query_name], query_args)
         return self.cursor
 
+    def __filtered(self, query_name, *query_args):
+        """ Fill in the condition of the volume filter in one of the
+            "filtered" queries.
+            :returns the query and its parameters """
+        condition, parameters = self.volume_filter.to_sql("Volumes")
+        return queries[query_name].format(condition), (*query_args,
+                                                       *parameters)
+
+    def __run_filtered_sql(self, query_name, filtered_query_name,
+                           *query_args):
+        """ Like `run_sql`, but runs the filtered version of the query if
+            there is a volume filter. """
+        if self.volume_filter is None:
+            return self.run_sql(query_name, *query_args)
+        self.cursor.execute(*self.__filtered(filtered_query_name,
+                                             *query_args))
+        return self.cursor
+
+    def __filter_files(self, query):
+        """ Make a query over the whole Files table only look at the files of
+            the volumes that match the volume filter.
+            :returns the query and its parameters """
+        if self.volume_filter is None:
+            return query, ()
+        condition, parameters = self.volume_filter.to_sql("Volumes")
+        return queries["filter files"].format(condition) + query, parameters
+
+    def __run_sql_on_files(self, query_name, *query_args):
+        """ Like `run_sql`, for the queries that `__filter_files` applies
+            to. """
+        query, parameters = self.__filter_files(queries[query_name])
+        self.cursor.execute(query, (*parameters, *query_args))
+        return self.cursor
 
 
+class __Tests(unittest.TestCase):
+    def test__make_indexed_copy(self):
+        with tempfile.TemporaryDirectory() as folder:
+            connection = sqlite3.connect(f"{folder}/original.db")
+            connection.executescript("""
+                CREATE TABLE StorageDevices(id INTEGER PRIMARY KEY,
+                    system_id INT);
+                CREATE TABLE Volumes(id INTEGER PRIMARY KEY,
+                    storage_device_id INT);
+                CREATE TABLE VolumeNotes(id INTEGER PRIMARY KEY,
+                    volume_id INT);
+                CREATE TABLE Files(id INTEGER PRIMARY KEY, volume_id INT,
+                    blocks TEXT, num_blocks INT, num_gaps INT, resident INT);
+                CREATE INDEX files_vol ON Files(volume_id);""")
+            connection.close()
 
+            wildfrag = WildFrag(f"{folder}/original.db")
+            self.assertEqual(["retrieve devices", "retrieve volumes",
+                              "retrieve notes"],
+                             wildfrag.find_unindexed_lookups())
 
+            wildfrag.make_indexed_copy(f"{folder}/copy.db")
+            copy = WildFrag(f"{folder}/copy.db")
+            self.assertEqual([], copy.find_unindexed_lookups())